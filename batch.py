@@ -0,0 +1,300 @@
+"""
+Batch processing module for WeCare Beauty system.
+Processes sales and restocks from CSV or JSONL order files without prompts.
+
+Each record is one product line. Consecutive records with the same type
+and order value belong to one invoice or purchase form. Fields:
+    type: "sale" or "restock"
+    order: Order or form reference used to group lines
+    name: Customer name (sale) or supplier name (restock)
+    phone: Customer phone number (sale only)
+    product_id: Product ID
+    quantity: Quantity sold or added
+    new_cost: New cost price (restock only, optional)
+    shipping: "y" to ship the order (sale only, optional)
+
+Usage:
+    python batch.py orders.csv [inventory.txt | inventory.db]
+"""
+
+import contextlib
+import csv
+import json
+import os
+import sys
+from docwriter import flush_documents
+from metrics import save_metrics, setup_metrics_from_environment
+from numbering import close_allocators
+from operation import validate_input
+from pricing import price_basket
+from storage import open_storage
+from write import (find_stock_shortage, generate_invoice, generate_purchase_form,
+                   release_unsaved, run_finishers)
+
+
+# Kinds of order error: a record that breaks the rules, or too little stock
+INVALID_ORDER = "invalid"
+STOCK_SHORTAGE = "stock"
+
+def read_records(filename):
+    """
+    Reads order records one at a time from a CSV or JSONL file.
+
+    Parameters:
+        filename (str): Name of order file
+
+    Yields:
+        tuple: (line number, record dict)
+    """
+    order_file = open(filename, "r", newline="")
+    try:
+        if filename.lower().endswith(".jsonl"):
+            for line_number, line in enumerate(order_file, 1):
+                if line.strip() == "":
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError:
+                    yield line_number, None
+        else:
+            # Header is line 1, so data starts at line 2
+            for line_number, record in enumerate(csv.DictReader(order_file), 2):
+                yield line_number, record
+    finally:
+        order_file.close()
+
+
+def field_text(record, field):
+    """
+    Gets a record field as stripped text.
+
+    Parameters:
+        record (dict): Order record
+        field (str): Field name
+
+    Returns:
+        str: Field value, empty if missing
+    """
+    value = record.get(field)
+    if value is None:
+        return ""
+    return str(value).strip()
+
+
+def group_orders(records):
+    """
+    Groups consecutive records of the same order together.
+
+    Parameters:
+        records: Iterable of (line number, record) tuples
+
+    Yields:
+        list: (line number, record) tuples of one order
+    """
+    current = []
+    current_key = None
+    for line_number, record in records:
+        if record is None:
+            key = None
+        else:
+            key = (field_text(record, "type").lower(), field_text(record, "order"))
+
+        # A bad record always forms its own group so it is reported alone
+        if current and (key is None or key != current_key):
+            yield current
+            current = []
+
+        current.append((line_number, record))
+        current_key = key
+
+    if current:
+        yield current
+
+
+def validate_order(lines, inventory_data):
+    """
+    Validates one order with the same rules as the console prompts.
+
+    Parameters:
+        lines (list): (line number, record) tuples of one order
+        inventory_data (Inventory): Product information
+
+    Returns:
+        tuple: (order dict, None, None) if valid, otherwise (None, error kind,
+               error message) where the kind is INVALID_ORDER or STOCK_SHORTAGE
+    """
+    first_line, first = lines[0]
+    if first is None:
+        return None, INVALID_ORDER, "line %d: record could not be read" % first_line
+
+    kind = field_text(first, "type").lower()
+    if kind not in ("sale", "restock"):
+        return None, INVALID_ORDER, ("line %d: unknown type '%s'"
+                                     % (first_line, field_text(first, "type")))
+
+    name, error = validate_input(field_text(first, "name"), "str")
+    if error:
+        return None, INVALID_ORDER, "line %d: name: %s" % (first_line, error)
+
+    order = {"type": kind, "name": name, "items": []}
+    if kind == "sale":
+        phone, error = validate_input(field_text(first, "phone"), "str")
+        if error:
+            return None, INVALID_ORDER, "line %d: phone: %s" % (first_line, error)
+        order["phone"] = phone
+        order["shipping"] = field_text(first, "shipping").upper() == "Y"
+
+    # Validate each product line
+    for line_number, record in lines:
+        product_id, error = validate_input(field_text(record, "product_id"),
+                                           "int", 1, len(inventory_data))
+        if error:
+            return None, INVALID_ORDER, "line %d: product_id: %s" % (line_number, error)
+
+        quantity, error = validate_input(field_text(record, "quantity"), "int", 1)
+        if error:
+            return None, INVALID_ORDER, "line %d: quantity: %s" % (line_number, error)
+
+        item = {"id": product_id, "quantity": quantity}
+        if kind == "restock":
+            item["new_cost"] = None
+            if field_text(record, "new_cost") != "":
+                new_cost, error = validate_input(field_text(record, "new_cost"),
+                                                 "float", 0.01)
+                if error:
+                    return None, INVALID_ORDER, "line %d: new_cost: %s" % (line_number, error)
+                item["new_cost"] = new_cost
+        order["items"].append(item)
+
+    # Whole order must fit in current stock, promotion units included
+    if kind == "sale":
+        shortage = find_stock_shortage(inventory_data,
+                                       price_basket(inventory_data, order["items"]))
+        if shortage is not None:
+            return None, STOCK_SHORTAGE, ("line %d: not enough stock for product %d "
+                                          "(need %d, have %d)" % ((first_line,) + shortage))
+
+    return order, None, None
+
+
+def run_batch(order_filename, inventory_filename="inventory.txt"):
+    """
+    Applies every order in a file.
+
+    A text inventory is locked for the whole batch and saved once at the
+    end; its documents, history and customer totals are only written once
+    that save has worked. A database commits each order as its own
+    transaction.
+
+    Parameters:
+        order_filename (str): Name of CSV or JSONL order file
+        inventory_filename (str): Name of inventory file or database
+
+    Returns:
+        dict: Counts of invoices, purchase forms and rejected orders,
+              and the list of rejection messages
+    """
+    storage = open_storage(inventory_filename)
+    try:
+        if storage.single_save:
+            # Other counters wait until the batch is saved
+            with storage.lock():
+                return process_orders(order_filename, storage)
+        return process_orders(order_filename, storage)
+    finally:
+        # Let the next run carry on from the last number used
+        close_allocators()
+        storage.close()
+
+
+def process_orders(order_filename, storage):
+    """
+    Applies every order in a file to an opened storage.
+
+    Parameters:
+        order_filename (str): Name of CSV or JSONL order file
+        storage: Opened inventory storage
+
+    Returns:
+        dict: Same summary as run_batch
+    """
+    inventory_data = storage.load()
+    summary = {"invoices": 0, "purchase_forms": 0, "rejected": 0, "errors": []}
+
+    # Record orders one at a time unless the storage saves in one go
+    save = not storage.single_save
+
+    # Documents, history and customer totals wait for the one save
+    finish = []
+    if storage.single_save:
+        inventory_data.pending_finish = finish
+
+    try:
+        # Documents are still written; only their screen copy is silenced
+        with open(os.devnull, "w") as quiet:
+            for lines in group_orders(read_records(order_filename)):
+                order, error_kind, error = validate_order(lines, inventory_data)
+                if error:
+                    summary["rejected"] += 1
+                    summary["errors"].append(error)
+                    continue
+
+                with contextlib.redirect_stdout(quiet):
+                    if order["type"] == "sale":
+                        document = generate_invoice(order["name"], order["phone"],
+                                                    order["items"], inventory_data,
+                                                    shipping=order["shipping"],
+                                                    save=save)
+                    else:
+                        document = generate_purchase_form(order["name"], order["items"],
+                                                          inventory_data, save=save)
+
+                if document is None:
+                    summary["rejected"] += 1
+                    summary["errors"].append("line %d: document could not be written"
+                                             % lines[0][0])
+                elif order["type"] == "sale":
+                    summary["invoices"] += 1
+                else:
+                    summary["purchase_forms"] += 1
+    finally:
+        inventory_data.pending_finish = None
+
+    # One save for the whole batch
+    if storage.single_save:
+        if storage.save(inventory_data):
+            run_finishers(finish)
+        else:
+            # Nothing was applied, so no document may claim otherwise
+            release_unsaved(inventory_data)
+            summary["errors"].append("inventory could not be saved: %d invoices and %d "
+                                     "purchase forms were not applied"
+                                     % (summary["invoices"], summary["purchase_forms"]))
+            summary["invoices"] = 0
+            summary["purchase_forms"] = 0
+
+    # Wait for the documents before reporting
+    for filename in flush_documents():
+        summary["errors"].append("document could not be written: " + filename)
+    return summary
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python batch.py ORDER_FILE [INVENTORY_FILE]")
+        sys.exit(1)
+
+    # Collect metrics if asked to by environment variables
+    setup_metrics_from_environment()
+
+    if len(sys.argv) > 2:
+        result = run_batch(sys.argv[1], sys.argv[2])
+    else:
+        result = run_batch(sys.argv[1])
+
+    print("Invoices generated: " + str(result["invoices"]))
+    print("Purchase forms generated: " + str(result["purchase_forms"]))
+    print("Orders rejected: " + str(result["rejected"]))
+    for message in result["errors"]:
+        print("  " + message)
+    save_metrics()
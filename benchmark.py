@@ -0,0 +1,358 @@
+"""
+Benchmark module for WeCare Beauty system.
+Times loading, listing, saving, sales and restocks on generated inventories.
+
+Each size gets a fresh inventory.txt in a temporary directory, so real
+files are never touched. Results are printed and saved as JSON, and two
+result files can be compared to spot slowdowns between versions.
+
+Usage:
+    python benchmark.py [SIZES] [OUTPUT_FILE]
+    python benchmark.py compare OLD_FILE NEW_FILE
+
+SIZES is a comma separated list such as 1000,10000,1000000.
+"""
+
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+from docwriter import flush_documents
+from numbering import close_allocators
+from read import get_inventory_data, print_inventory
+from write import generate_invoice, generate_purchase_form, save_inventory
+
+
+# Inventory sizes used when none are given
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+# Times each operation is run per size
+LOAD_RUNS = 5
+SAVE_RUNS = 5
+PRINT_RUNS = 20
+SALE_RUNS = 200
+RESTOCK_RUNS = 200
+
+# Largest basket in a scripted sale or restock
+MAX_BASKET_ITEMS = 5
+
+# Result change treated as a slowdown when comparing, 1.2 is 20% slower
+SLOWDOWN_RATIO = 1.2
+
+# Same baskets on every run
+RANDOM_SEED = 2024
+
+
+def write_synthetic_inventory(filename, size):
+    """
+    Writes an inventory file with generated products.
+
+    Parameters:
+        filename (str): Name of inventory file
+        size (int): Number of products
+
+    Returns:
+        None
+    """
+    brands = ["Garnier", "Cetaphil", "Aqualogica", "Nivea", "Olay", "Dove", "Neutrogena"]
+    origins = ["France", "Switzerland", "India", "Germany", "USA", "Korea", "Japan"]
+    rng = random.Random(RANDOM_SEED)
+
+    file = open(filename, "w")
+    try:
+        # Write in blocks to keep memory flat for large sizes
+        block = []
+        for number in range(1, size + 1):
+            block.append("Product %d, %s, %d, %d, %s\n" %
+                         (number, brands[number % len(brands)], 1000000,
+                          rng.randint(100, 5000), origins[number % len(origins)]))
+            if len(block) >= 10000:
+                file.write("".join(block))
+                block = []
+        file.write("".join(block))
+    finally:
+        file.close()
+
+
+def make_baskets(size, count, restock=False):
+    """
+    Makes scripted baskets in the format the console builds.
+
+    Parameters:
+        size (int): Number of products
+        count (int): Number of baskets
+        restock (bool): Whether to add new costs for restocks
+
+    Returns:
+        list: Lists of item dicts
+    """
+    rng = random.Random(RANDOM_SEED + count + int(restock))
+    baskets = []
+    for basket_number in range(count):
+        items = []
+        for item_number in range(rng.randint(1, MAX_BASKET_ITEMS)):
+            item = {"id": rng.randint(1, size), "quantity": rng.randint(1, 6)}
+            if restock:
+                item["new_cost"] = None
+                if rng.random() < 0.2:
+                    item["new_cost"] = float(rng.randint(100, 5000))
+            items.append(item)
+        baskets.append(items)
+    return baskets
+
+
+def percentile(sorted_values, fraction):
+    """
+    Gets a percentile by the nearest rank method.
+
+    Parameters:
+        sorted_values (list): Values in ascending order
+        fraction (float): Percentile as a fraction, 0.99 for p99
+
+    Returns:
+        float: Value at that percentile
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, elapsed):
+    """
+    Gets throughput and latency figures for one benchmark.
+
+    Parameters:
+        latencies (list): Time of each run in seconds
+        elapsed (float): Total time in seconds
+
+    Returns:
+        dict: Runs, throughput per second and latencies in milliseconds
+    """
+    ordered = sorted(latencies)
+    result = {"runs": len(ordered), "total_s": elapsed}
+    if elapsed > 0:
+        result["per_second"] = len(ordered) / elapsed
+    else:
+        result["per_second"] = 0.0
+    result["mean_ms"] = 1000.0 * sum(ordered) / max(1, len(ordered))
+    result["p50_ms"] = 1000.0 * percentile(ordered, 0.50)
+    result["p90_ms"] = 1000.0 * percentile(ordered, 0.90)
+    result["p99_ms"] = 1000.0 * percentile(ordered, 0.99)
+    result["max_ms"] = 1000.0 * (ordered[-1] if ordered else 0.0)
+    return result
+
+
+def time_runs(function, arguments):
+    """
+    Times a function once for each set of arguments.
+
+    Screen output of the function is discarded.
+
+    Parameters:
+        function (function): Function to time
+        arguments (list): Tuples of arguments, one per run
+
+    Returns:
+        dict: Summary from summarize
+    """
+    latencies = []
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+        start = time.perf_counter()
+        for args in arguments:
+            run_start = time.perf_counter()
+            function(*args)
+            latencies.append(time.perf_counter() - run_start)
+        elapsed = time.perf_counter() - start
+    return summarize(latencies, elapsed)
+
+
+def peak_memory_kb(function, args):
+    """
+    Measures the most Python memory used by one call.
+
+    Parameters:
+        function (function): Function to measure
+        args (tuple): Arguments for the call
+
+    Returns:
+        int: Peak traced memory in kilobytes
+    """
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+        tracemalloc.start()
+        try:
+            function(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return peak // 1024
+
+
+def benchmark_size(size):
+    """
+    Runs every benchmark on one inventory size.
+
+    Parameters:
+        size (int): Number of products
+
+    Returns:
+        dict: Results by operation
+    """
+    filename = "inventory.txt"
+    write_synthetic_inventory(filename, size)
+    results = {}
+
+    results["load"] = time_runs(get_inventory_data, [(filename,)] * LOAD_RUNS)
+    results["load"]["peak_kb"] = peak_memory_kb(get_inventory_data, (filename,))
+
+    inventory_data = get_inventory_data(filename)
+    results["print"] = time_runs(print_inventory, [(inventory_data, page)
+                                                    for page in range(1, PRINT_RUNS + 1)])
+
+    results["save"] = time_runs(save_inventory, [(inventory_data, filename, False)] * SAVE_RUNS)
+    results["save"]["peak_kb"] = peak_memory_kb(save_inventory,
+                                                (inventory_data, filename, False))
+
+    # Documents are queued during the runs, waiting for them is timed separately
+    results["sale"] = time_runs(generate_invoice,
+                                [("Bench Customer", "9800000000", basket, inventory_data, False)
+                                 for basket in make_baskets(size, SALE_RUNS)])
+    results["restock"] = time_runs(generate_purchase_form,
+                                   [("Bench Supplier", basket, inventory_data)
+                                    for basket in make_baskets(size, RESTOCK_RUNS, True)])
+
+    start = time.perf_counter()
+    flush_documents()
+    results["document_flush_s"] = time.perf_counter() - start
+    close_allocators()
+    return results
+
+
+def run_benchmarks(sizes=None):
+    """
+    Runs the benchmarks for several inventory sizes in a temporary directory.
+
+    Parameters:
+        sizes (list): Numbers of products, None for DEFAULT_SIZES
+
+    Returns:
+        dict: Machine details and results by size
+    """
+    if sizes is None:
+        sizes = DEFAULT_SIZES
+
+    report = {"python": platform.python_version(), "platform": platform.platform(),
+              "created": time.strftime("%Y-%m-%d %H:%M:%S"), "sizes": {}}
+
+    original_directory = os.getcwd()
+    for size in sizes:
+        work_directory = tempfile.mkdtemp(prefix="wecare-bench-")
+        os.chdir(work_directory)
+        try:
+            print("Benchmarking %d products..." % size)
+            report["sizes"][str(size)] = benchmark_size(size)
+        finally:
+            os.chdir(original_directory)
+            shutil.rmtree(work_directory, ignore_errors=True)
+
+    # Largest memory use of the whole process
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            max_rss //= 1024
+        report["max_rss_kb"] = max_rss
+    return report
+
+
+def print_results(report):
+    """
+    Prints benchmark results as a table.
+
+    Parameters:
+        report (dict): Results from run_benchmarks
+
+    Returns:
+        None
+    """
+    print("%-10s %-10s %-12s %-10s %-10s %-10s %-10s" %
+          ("Size", "Operation", "Per second", "p50 ms", "p90 ms", "p99 ms", "Peak KB"))
+    print("-" * 80)
+    for size, results in report["sizes"].items():
+        for operation in ("load", "print", "save", "sale", "restock"):
+            result = results[operation]
+            print("%-10s %-10s %-12.1f %-10.3f %-10.3f %-10.3f %-10s" %
+                  (size, operation, result["per_second"], result["p50_ms"],
+                   result["p90_ms"], result["p99_ms"], result.get("peak_kb", "")))
+    if "max_rss_kb" in report:
+        print("Process peak memory: %d KB" % report["max_rss_kb"])
+
+
+def compare_results(old_report, new_report):
+    """
+    Prints how median latencies changed between two result files.
+
+    Parameters:
+        old_report (dict): Earlier results
+        new_report (dict): Later results
+
+    Returns:
+        int: Number of operations that got slower than SLOWDOWN_RATIO
+    """
+    slowdowns = 0
+    for size, new_results in new_report["sizes"].items():
+        old_results = old_report["sizes"].get(size)
+        if old_results is None:
+            continue
+        for operation in ("load", "print", "save", "sale", "restock"):
+            old_ms = old_results[operation]["p50_ms"]
+            new_ms = new_results[operation]["p50_ms"]
+            if old_ms <= 0:
+                continue
+            ratio = new_ms / old_ms
+            marker = ""
+            if ratio > SLOWDOWN_RATIO:
+                marker = "  SLOWER"
+                slowdowns += 1
+            print("%-10s %-10s %10.3f ms -> %10.3f ms  x%.2f%s" %
+                  (size, operation, old_ms, new_ms, ratio, marker))
+    return slowdowns
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        if len(sys.argv) != 4:
+            print("Usage: python benchmark.py compare OLD_FILE NEW_FILE")
+            sys.exit(1)
+        with open(sys.argv[2]) as old_file, open(sys.argv[3]) as new_file:
+            slower = compare_results(json.load(old_file), json.load(new_file))
+        sys.exit(1 if slower else 0)
+
+    if len(sys.argv) > 1:
+        benchmark_sizes = [int(size) for size in sys.argv[1].split(",")]
+    else:
+        benchmark_sizes = None
+
+    if len(sys.argv) > 2:
+        output_filename = sys.argv[2]
+    else:
+        output_filename = "benchmark_results.json"
+
+    benchmark_report = run_benchmarks(benchmark_sizes)
+    print_results(benchmark_report)
+
+    with open(output_filename, "w") as output_file:
+        json.dump(benchmark_report, output_file, indent=2)
+    print("Results saved to " + output_filename)
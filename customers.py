@@ -0,0 +1,341 @@
+"""
+Customer module for WeCare Beauty system.
+Remembers customers by phone number so returning customers are not re-typed.
+
+Every invoice adds one line to the customer file next to the inventory:
+    date, invoice number, phone digits, amount, customer name
+The registry reads the file once and then only the lines added since,
+keeping running totals per customer, a dictionary by phone number and a
+name prefix index, so lookups do not search invoice files.
+
+Usage:
+    python customers.py [inventory.txt] [PHONE or NAME]
+"""
+
+import os
+import sys
+import threading
+from metrics import record_error
+from search import MAX_PREFIX, name_words
+
+
+# Open registries by customer file
+registries = {}
+registries_guard = threading.Lock()
+
+
+def get_customers_filename(filename="inventory.txt"):
+    """
+    Gets the name of the customer file of an inventory.
+
+    Parameters:
+        filename (str): Name of inventory file or database
+
+    Returns:
+        str: Name of customer file
+    """
+    return filename + ".customers"
+
+
+def normalize_phone(phone_number):
+    """
+    Reduces a phone number to its digits, so "976-162 5564" and "9761625564" match.
+
+    Parameters:
+        phone_number (str): Phone number as typed
+
+    Returns:
+        str: Digits of the number, empty if it has none
+    """
+    return "".join([c for c in phone_number if c.isdigit()])
+
+
+def record_customer_visit(customer_name, phone_number, document_num, when, amount,
+                          filename="inventory.txt"):
+    """
+    Adds one invoice to the customer file.
+
+    Parameters:
+        customer_name (str): Customer name
+        phone_number (str): Customer contact number
+        document_num (str): Invoice number
+        when (datetime): Date and time of the invoice
+        amount (float): Invoice total
+        filename (str): Name of inventory file or database
+
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    phone = normalize_phone(phone_number)
+    if not phone:
+        # Nothing to find the customer by later
+        return False
+
+    try:
+        date_str = "%d-%02d-%02d" % (when.year, when.month, when.day)
+        name = " ".join(customer_name.split())
+        line = "%s, %s, %s, %r, %s\n" % (date_str, document_num, phone, float(amount), name)
+
+        # One append per invoice, so lines from several counters do not mix
+        customers_file = open(get_customers_filename(filename), "a", encoding="utf-8")
+        try:
+            customers_file.write(line)
+        finally:
+            customers_file.close()
+        return True
+    except:
+        record_error("customers")
+        print("Error saving customer details")
+        return False
+
+
+def parse_customer_line(line):
+    """
+    Splits a customer file line into its values.
+
+    Parameters:
+        line (str): Customer file line
+
+    Returns:
+        tuple: (day, invoice number, phone, amount, name), or None if the line is not valid
+    """
+    parts = line.rstrip("\n").split(", ", 4)
+    if len(parts) != 5 or not parts[2]:
+        return None
+    try:
+        amount = float(parts[3])
+    except ValueError:
+        return None
+    return parts[0], parts[1], parts[2], amount, parts[4]
+
+
+class CustomerRegistry:
+    """
+    Customers of an inventory with their purchase totals.
+
+    Customers are kept by phone digits as dicts with name, phone, visits,
+    spend, first_visit, last_visit and last_invoice, plus their invoices
+    as (day, invoice number, amount) tuples. Names are indexed by every
+    prefix of every word, like product names in search.ProductIndex.
+    """
+
+    def __init__(self, filename="inventory.txt"):
+        """
+        Creates the registry, reading the customer file so far.
+
+        Parameters:
+            filename (str): Name of inventory file or database
+
+        Returns:
+            None
+        """
+        self.customers_filename = get_customers_filename(filename)
+        self.offset = 0
+        self.customers = {}
+        self.invoices = {}
+        self.prefix_index = {}
+        self.update()
+
+    def update(self):
+        """
+        Adds customer lines written since the last update.
+
+        Returns:
+            int: Number of lines added
+        """
+        if not os.path.exists(self.customers_filename):
+            return 0
+
+        added = 0
+        customers_file = open(self.customers_filename, "rb")
+        try:
+            customers_file.seek(self.offset)
+            for line in customers_file:
+                # Stop at a line that is still being written
+                if not line.endswith(b"\n"):
+                    break
+                self.offset += len(line)
+                if self.add_line(line.decode("utf-8")):
+                    added += 1
+        finally:
+            customers_file.close()
+        return added
+
+    def add_line(self, line):
+        """
+        Adds one invoice to its customer's totals.
+
+        Parameters:
+            line (str): Customer file line
+
+        Returns:
+            bool: True if the line was valid
+        """
+        entry = parse_customer_line(line)
+        if entry is None:
+            return False
+        day, invoice_num, phone, amount, name = entry
+
+        customer = self.customers.get(phone)
+        if customer is None:
+            customer = {"name": name, "phone": phone, "visits": 0, "spend": 0.0,
+                        "first_visit": day, "last_visit": day, "last_invoice": invoice_num}
+            self.customers[phone] = customer
+            self.invoices[phone] = []
+        elif name != customer["name"]:
+            # The newest spelling of the name is kept
+            customer["name"] = name
+
+        customer["visits"] += 1
+        customer["spend"] += amount
+        if day >= customer["last_visit"]:
+            customer["last_visit"] = day
+            customer["last_invoice"] = invoice_num
+        if day < customer["first_visit"]:
+            customer["first_visit"] = day
+        self.invoices[phone].append((day, invoice_num, amount))
+
+        # Old spellings stay findable too
+        for word in name_words(name):
+            for length in range(1, min(len(word), MAX_PREFIX) + 1):
+                self.prefix_index.setdefault(word[:length], set()).add(phone)
+        return True
+
+    def find_by_phone(self, phone_number):
+        """
+        Looks up a customer by phone number.
+
+        Parameters:
+            phone_number (str): Phone number in any format
+
+        Returns:
+            dict: Customer details, or None if not known
+        """
+        self.update()
+        return self.customers.get(normalize_phone(phone_number))
+
+    def find_by_name(self, text):
+        """
+        Finds customers whose name has a word starting with each search word.
+
+        Parameters:
+            text (str): Search words, any case
+
+        Returns:
+            list: Customer details, biggest spenders first
+        """
+        self.update()
+        words = name_words(text)
+        if not words:
+            return []
+
+        # Start from the rarest word to keep the intersection small
+        candidate_sets = [self.prefix_index.get(word[:MAX_PREFIX], set()) for word in words]
+        candidate_sets.sort(key=len)
+        matches = set(candidate_sets[0])
+        for candidates in candidate_sets[1:]:
+            matches &= candidates
+
+        # Words longer than the indexed prefix need a direct check
+        long_words = [word for word in words if len(word) > MAX_PREFIX]
+        found = []
+        for phone in matches:
+            customer = self.customers[phone]
+            customer_words = name_words(customer["name"])
+            if all(any(candidate.startswith(word) for candidate in customer_words)
+                   for word in long_words):
+                found.append(customer)
+        found.sort(key=lambda customer: (-customer["spend"], customer["name"]))
+        return found
+
+    def get_invoices(self, phone_number):
+        """
+        Gets a customer's invoices.
+
+        Parameters:
+            phone_number (str): Phone number in any format
+
+        Returns:
+            list: (day, invoice number, amount) tuples, oldest first
+        """
+        self.update()
+        return list(self.invoices.get(normalize_phone(phone_number), []))
+
+    def __len__(self):
+        """
+        Gets the number of known customers.
+
+        Returns:
+            int: Number of customers
+        """
+        return len(self.customers)
+
+
+def get_customer_registry(filename="inventory.txt"):
+    """
+    Gets the shared registry of an inventory's customers.
+
+    Parameters:
+        filename (str): Name of inventory file or database
+
+    Returns:
+        CustomerRegistry: Registry, brought up to date
+    """
+    customers_filename = get_customers_filename(filename)
+    with registries_guard:
+        registry = registries.get(customers_filename)
+        if registry is None:
+            registry = CustomerRegistry(filename)
+            registries[customers_filename] = registry
+            return registry
+    registry.update()
+    return registry
+
+
+def print_customer(customer, invoices=None):
+    """
+    Prints one customer's details.
+
+    Parameters:
+        customer (dict): Customer details
+        invoices (list): Invoices to list, None for none
+
+    Returns:
+        None
+    """
+    print("%s (%s) - %d visits - Spent: %s - Last visit: %s (%s)" %
+          (customer["name"], customer["phone"], customer["visits"],
+           str(round(customer["spend"], 2)), customer["last_visit"],
+           customer["last_invoice"]))
+    if invoices:
+        for day, invoice_num, amount in invoices:
+            print("  %s  %-10s %s" % (day, invoice_num, str(round(amount, 2))))
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    if arguments and os.path.exists(arguments[0]):
+        inventory_filename = arguments.pop(0)
+    else:
+        inventory_filename = "inventory.txt"
+    customer_registry = CustomerRegistry(inventory_filename)
+
+    search_text = " ".join(arguments)
+    if not search_text:
+        # Show the biggest spenders
+        top_customers = sorted(customer_registry.customers.values(),
+                               key=lambda customer: -customer["spend"])
+        for top_customer in top_customers[:20]:
+            print_customer(top_customer)
+    elif not any(c.isalpha() for c in search_text):
+        found_customer = customer_registry.find_by_phone(search_text)
+        if found_customer is None:
+            print("No customer with phone number " + search_text)
+        else:
+            print_customer(found_customer, customer_registry.get_invoices(search_text))
+    else:
+        found_customers = customer_registry.find_by_name(search_text)
+        if not found_customers:
+            print("No customer named " + search_text)
+        for found_customer in found_customers:
+            print_customer(found_customer)
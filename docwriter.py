@@ -0,0 +1,267 @@
+"""
+Document writing module for WeCare Beauty system.
+Writes invoices and purchase forms in the background so the counter can
+move on to the next customer straight away.
+
+Documents are stored next to the inventory, in subdirectories of its
+document directory by kind, month and block of numbers, for example
+inventory.txt.documents/INV/2026-10/10/. An index file maps each
+document number to its file so any document can be found without
+searching the directories.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+# Documents numbered alike share a directory, this many per directory
+NUMBERS_PER_DIR = 1000
+
+# Background threads writing documents
+WRITER_THREADS = 2
+
+# Pending writes checked for completion once this many are queued
+PRUNE_SIZE = 1000
+
+# Created on first use
+executor = None
+
+# Document writes not checked yet, and names of those that failed
+pending_documents = set()
+failed_documents = []
+documents_lock = threading.Lock()
+
+# (directory, document number) to file path, and how far each index file was read
+document_index = {}
+index_offsets = {}
+index_lock = threading.Lock()
+
+
+def get_document_dir(filename="inventory.txt"):
+    """
+    Gets the directory holding the invoices and purchase forms of an inventory.
+
+    Parameters:
+        filename (str): Name of inventory file or database
+
+    Returns:
+        str: Name of document directory
+    """
+    return filename + ".documents"
+
+
+def get_index_filename(directory):
+    """
+    Gets the name of the document index file.
+
+    Parameters:
+        directory (str): Document directory
+
+    Returns:
+        str: Name of index file
+    """
+    return os.path.join(directory, "index.txt")
+
+
+def get_document_path(document_num, filename, when, directory):
+    """
+    Gets where a document is stored.
+
+    Parameters:
+        document_num (str): Document number such as INV-10001
+        filename (str): File name of the document
+        when (datetime): Date and time of the document
+        directory (str): Document directory
+
+    Returns:
+        str: Path of document file
+    """
+    kind, number = document_num.rsplit("-", 1)
+    bucket = str(int(number) // NUMBERS_PER_DIR)
+    month = "%d-%02d" % (when.year, when.month)
+    return os.path.join(directory, kind, month, bucket, filename)
+
+
+def add_to_index(document_num, path, directory):
+    """
+    Appends a document to the index file.
+
+    Each entry is written with a single append, so entries from several
+    counters do not mix. Paths are kept relative to the document
+    directory, so the index still works from another directory.
+
+    Parameters:
+        document_num (str): Document number
+        path (str): Path of document file
+        directory (str): Document directory
+
+    Returns:
+        None
+    """
+    index_file = open(get_index_filename(directory), "a")
+    try:
+        index_file.write(document_num + ", " + os.path.relpath(path, directory) + "\n")
+    finally:
+        index_file.close()
+
+
+def write_file_atomic(filename, text):
+    """
+    Writes a whole document at once so it never appears half written.
+
+    Parameters:
+        filename (str): Name of document file
+        text (str): Complete document text
+
+    Returns:
+        str: Name of document file
+    """
+    temp_filename = filename + ".tmp"
+    file = open(temp_filename, "w")
+    try:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    finally:
+        file.close()
+    os.replace(temp_filename, filename)
+    return filename
+
+
+def store_document(path, text, document_num=None, directory=None):
+    """
+    Writes a document into its directory and adds it to the index.
+
+    Parameters:
+        path (str): Path of document file
+        text (str): Complete document text
+        document_num (str): Document number, None to leave it out of the index
+        directory (str): Document directory holding the index
+
+    Returns:
+        str: Path of document file
+    """
+    if os.path.dirname(path) != "":
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_file_atomic(path, text)
+
+    # Only documents that are fully written go in the index
+    if document_num is not None and directory is not None:
+        add_to_index(document_num, path, directory)
+    return path
+
+
+def find_document(document_num, directory):
+    """
+    Looks up where a document is stored.
+
+    New index entries are read on each call, earlier ones are kept in memory.
+
+    Parameters:
+        document_num (str): Document number such as INV-10001
+        directory (str): Document directory
+
+    Returns:
+        str: Path of document file, or None if it is not in the index
+    """
+    with index_lock:
+        path = document_index.get((directory, document_num))
+        if path is not None:
+            return path
+
+        index_filename = get_index_filename(directory)
+        if not os.path.exists(index_filename):
+            return None
+
+        index_file = open(index_filename, "rb")
+        try:
+            index_file.seek(index_offsets.get(directory, 0))
+            for line in index_file:
+                # Stop at an entry that is still being written
+                if not line.endswith(b"\n"):
+                    break
+                index_offsets[directory] = index_offsets.get(directory, 0) + len(line)
+                parts = line.decode("utf-8").rstrip("\n").split(", ", 1)
+                if len(parts) == 2:
+                    document_index[(directory, parts[0])] = os.path.join(directory, parts[1])
+        finally:
+            index_file.close()
+
+        return document_index.get((directory, document_num))
+
+
+def collect_finished(futures):
+    """
+    Takes finished writes out of the pending set and notes failures.
+
+    Should be called while holding documents_lock.
+
+    Parameters:
+        futures (list): Writes to check
+
+    Returns:
+        None
+    """
+    for future in futures:
+        if future.done():
+            pending_documents.discard(future)
+            if future.exception() is not None:
+                failed_documents.append(future.document_name)
+
+
+def submit_document(filename, text, document_num=None, directory=None):
+    """
+    Queues a document to be written in the background.
+
+    Parameters:
+        filename (str): Path of document file
+        text (str): Complete document text
+        document_num (str): Document number for the index
+        directory (str): Document directory holding the index
+
+    Returns:
+        Future: Finishes when the document is on disk
+    """
+    global executor
+
+    with documents_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=WRITER_THREADS,
+                                          thread_name_prefix="document-writer")
+
+        # Keep the pending set small during long runs
+        if len(pending_documents) >= PRUNE_SIZE:
+            collect_finished(list(pending_documents))
+
+        future = executor.submit(store_document, filename, text, document_num, directory)
+        future.document_name = filename
+        pending_documents.add(future)
+
+    return future
+
+
+def flush_documents():
+    """
+    Waits until every queued document has been written.
+
+    Parameters:
+        None
+
+    Returns:
+        list: Names of documents that could not be written since the last flush
+    """
+    global failed_documents
+
+    with documents_lock:
+        waiting = list(pending_documents)
+    wait(waiting)
+
+    with documents_lock:
+        collect_finished(waiting)
+        failed = failed_documents
+        failed_documents = []
+
+    for filename in failed:
+        print("Error writing document " + filename)
+    return failed
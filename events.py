@@ -0,0 +1,265 @@
+"""
+Stock event module for WeCare Beauty system.
+Publishes every stock and cost change for other systems to follow.
+
+Changes are appended to the event file next to the inventory, one JSON
+object per line:
+    {"time": ..., "kind": "SALE", "document": "INV-10001", "product": 3,
+     "quantity_change": -4, "stock": 16, "cost": 700.0}
+The events of one transaction, or of a whole group of them, are written
+with a single append. An event is addressed by the byte offset of its
+line, so a reader can stop anywhere and carry on from the same offset.
+
+Events are written while the inventory is locked, after the change is
+saved, so they are in the same order as the changes themselves. Batch
+runs save the whole inventory once at the end, and their changes are
+published with that save. Events that could not be written are kept
+and written ahead of the next ones this program publishes.
+
+Consumers keep their position in a named cursor file:
+    python events.py [inventory.txt] NAME [--follow]
+prints the events NAME has not seen yet and moves its cursor past them.
+"""
+
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from metrics import count, record_error
+
+
+# Most events returned by one read
+READ_LIMIT = 1000
+
+# Pause between reads when following the event file, in seconds
+FOLLOW_INTERVAL = 1.0
+
+# Event lines that could not be written yet, by event file name
+unpublished_lines = {}
+unpublished_lock = threading.Lock()
+
+
+def get_events_filename(filename="inventory.txt"):
+    """
+    Gets the name of the event file of an inventory.
+
+    Parameters:
+        filename (str): Name of inventory file or database
+
+    Returns:
+        str: Name of event file
+    """
+    return filename + ".events"
+
+
+def get_cursor_filename(name, filename="inventory.txt"):
+    """
+    Gets the name of the file holding a consumer's position.
+
+    Parameters:
+        name (str): Consumer name
+        filename (str): Name of inventory file or database
+
+    Returns:
+        str: Name of cursor file
+    """
+    return "%s.%s.cursor" % (get_events_filename(filename), name)
+
+
+def publish_events(records, filename="inventory.txt"):
+    """
+    Appends the changes of one or more transactions to the event file.
+
+    Should be called while holding the inventory lock, once the changes
+    are saved. A failure does not undo the changes; their events are kept
+    and written first the next time events are published.
+
+    Parameters:
+        records (list): Tuples of (kind, document number, changes, details)
+        filename (str): Name of inventory file or database
+
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    events_filename = get_events_filename(filename)
+    now = datetime.datetime.now().isoformat(" ", "seconds")
+    lines = []
+    for kind, document_num, changes, details in records:
+        for change in changes:
+            lines.append(json.dumps({"time": now, "kind": kind, "document": document_num,
+                                     "product": change["id"],
+                                     "quantity_change": change["quantity_change"],
+                                     "stock": change["stock"], "cost": change["cost"]},
+                                    separators=(",", ":")) + "\n")
+
+    with unpublished_lock:
+        # Events left over from a failed publish go first
+        lines = unpublished_lines.pop(events_filename, []) + lines
+        if not lines:
+            return True
+
+        try:
+            # One write and sync for the whole batch
+            events_file = open(events_filename, "a+b")
+            try:
+                data = "".join(lines).encode("utf-8")
+
+                # End a line cut short by a crash, so only that event is lost
+                size = events_file.seek(0, os.SEEK_END)
+                if size > 0:
+                    events_file.seek(-1, os.SEEK_END)
+                    if events_file.read(1) != b"\n":
+                        data = b"\n" + data
+                try:
+                    events_file.write(data)
+                    events_file.flush()
+                    os.fsync(events_file.fileno())
+                except:
+                    # Take back a partial write, so the retry does not repeat events
+                    events_file.truncate(size)
+                    raise
+            finally:
+                events_file.close()
+            count("events", len(lines))
+            return True
+        except:
+            unpublished_lines[events_filename] = lines
+            record_error("events")
+            print("Error publishing stock events, they will be retried")
+            return False
+
+
+def read_events(filename="inventory.txt", offset=0, limit=READ_LIMIT):
+    """
+    Reads events from an offset onwards.
+
+    A line that is still being written is left for the next read.
+
+    Parameters:
+        filename (str): Name of inventory file or database
+        offset (int): Offset of the first event to read
+        limit (int): Most events to return, None for all
+
+    Returns:
+        tuple: (list of (offset, event dict), offset after the last event read)
+    """
+    events_filename = get_events_filename(filename)
+    if not os.path.exists(events_filename):
+        return [], offset
+
+    events = []
+    events_file = open(events_filename, "rb")
+    try:
+        events_file.seek(offset)
+        for line in events_file:
+            if not line.endswith(b"\n") or (limit is not None and len(events) >= limit):
+                break
+            try:
+                events.append((offset, json.loads(line.decode("utf-8"))))
+            except ValueError:
+                print("Skipping damaged event at offset %d" % offset)
+            offset += len(line)
+    finally:
+        events_file.close()
+    return events, offset
+
+
+class EventCursor:
+    """
+    A named consumer's position in the event file.
+
+    Events are handed out by poll and only counted as done once commit
+    is called, so a consumer that stops half way sees them again.
+    """
+
+    def __init__(self, name, filename="inventory.txt"):
+        """
+        Opens a consumer's cursor, starting at the first event if it is new.
+
+        Parameters:
+            name (str): Consumer name
+            filename (str): Name of inventory file or database
+
+        Returns:
+            None
+        """
+        self.filename = filename
+        self.cursor_filename = get_cursor_filename(name, filename)
+        self.offset = 0
+        self.next_offset = 0
+        if os.path.exists(self.cursor_filename):
+            cursor_file = open(self.cursor_filename, "r")
+            try:
+                self.offset = int(cursor_file.read().strip() or 0)
+            finally:
+                cursor_file.close()
+        self.next_offset = self.offset
+
+    def poll(self, limit=READ_LIMIT):
+        """
+        Gets events after the last one handed out.
+
+        Parameters:
+            limit (int): Most events to return
+
+        Returns:
+            list: (offset, event dict) tuples, empty if there is nothing new
+        """
+        events, self.next_offset = read_events(self.filename, self.next_offset, limit)
+        return events
+
+    def commit(self):
+        """
+        Saves the position after the last event handed out by poll.
+
+        Returns:
+            None
+        """
+        if self.next_offset == self.offset:
+            return
+        temp_filename = self.cursor_filename + ".tmp"
+        cursor_file = open(temp_filename, "w")
+        try:
+            cursor_file.write(str(self.next_offset) + "\n")
+        finally:
+            cursor_file.close()
+        os.replace(temp_filename, self.cursor_filename)
+        self.offset = self.next_offset
+
+    def rewind(self):
+        """
+        Hands out the events since the last commit again.
+
+        Returns:
+            None
+        """
+        self.next_offset = self.offset
+
+
+if __name__ == "__main__":
+    arguments = [argument for argument in sys.argv[1:] if argument != "--follow"]
+    if not arguments:
+        print("Usage: python events.py [inventory.txt] NAME [--follow]")
+        sys.exit(1)
+    if len(arguments) > 1:
+        event_cursor = EventCursor(arguments[1], arguments[0])
+    else:
+        event_cursor = EventCursor(arguments[0])
+
+    try:
+        while True:
+            new_events = event_cursor.poll()
+            for event_offset, event in new_events:
+                print("%d %s" % (event_offset, json.dumps(event)))
+            sys.stdout.flush()
+            event_cursor.commit()
+
+            if len(new_events) < READ_LIMIT:
+                if "--follow" not in sys.argv:
+                    break
+                time.sleep(FOLLOW_INTERVAL)
+    except KeyboardInterrupt:
+        # Events printed since the last commit are shown again next time
+        pass
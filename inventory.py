@@ -0,0 +1,301 @@
+"""
+In-memory inventory model for WeCare Beauty system.
+Keeps product quantities, costs and selling prices in typed columns.
+"""
+
+import sys
+from array import array
+from pricing import get_default_rules
+
+
+def format_number(value):
+    """
+    Formats a number for the inventory file without a needless ".0".
+
+    Parameters:
+        value (float): Number to format
+
+    Returns:
+        str: Formatted number
+    """
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class Inventory:
+    """
+    Product table stored column by column.
+
+    Product IDs start at 1, so position 0 of every column is unused.
+    Quantities and costs are kept as numbers, and repeated text such as
+    brand and origin names is interned so it is stored only once.
+    Selling prices are worked out when a cost is set, not on every use.
+    """
+
+    def __init__(self, rules=None):
+        """
+        Creates an empty inventory.
+
+        Parameters:
+            rules (PricingRules): Rules for selling prices, None for the defaults
+
+        Returns:
+            None
+        """
+        self.names = [None]
+        self.brands = [None]
+        self.origins = [None]
+        self.quantities = array("q", [0])
+        self.costs = array("d", [0.0])
+        self.prices = array("d", [0.0])
+
+        # Pricing rules the selling prices are worked out with
+        if rules is None:
+            rules = get_default_rules()
+        self.rules = rules
+        self.price_stamp = rules.stamp
+
+        # Functions called with a product ID whenever that product changes
+        self.listeners = []
+
+        # Where the data was loaded from, used to catch up with other counters
+        self.filename = "inventory.txt"
+        self.snapshot_stamp = None
+        self.journal_stamp = None
+        self.journal_offset = 0
+
+        # Storage backend the data belongs to, None for a plain text file
+        self.storage = None
+
+        # Changes waiting for the end of a group transaction, None outside one
+        self.pending_records = None
+
+        # Stock and cost before the group changed them, by product ID
+        self.pending_undo = None
+
+        # Work waiting until the group is saved, as (function, arguments)
+        self.pending_finish = None
+
+        # Changes made without recording them, published with the next full save
+        self.unsaved_records = []
+
+    def __len__(self):
+        """
+        Gets the number of products.
+
+        Returns:
+            int: Number of products
+        """
+        return len(self.names) - 1
+
+    def product_ids(self):
+        """
+        Gets all valid product IDs.
+
+        Returns:
+            range: Product IDs from 1 to the number of products
+        """
+        return range(1, len(self.names))
+
+    def has_product(self, product_id):
+        """
+        Checks whether a product ID exists.
+
+        Parameters:
+            product_id (int): Product ID
+
+        Returns:
+            bool: True if the product exists
+        """
+        return 1 <= product_id < len(self.names)
+
+    def add_product(self, name, brand, quantity, cost, origin):
+        """
+        Adds a product to the end of the inventory.
+
+        Parameters:
+            name (str): Product name
+            brand (str): Brand name
+            quantity (int): Units in stock
+            cost (float): Cost price per unit
+            origin (str): Country of origin
+
+        Returns:
+            int: ID of the new product
+        """
+        # Numbers first, so a bad value leaves the columns unchanged
+        product_id = len(self.names)
+        price = self.rules.unit_price(product_id, brand, origin, cost)
+        self.quantities.append(quantity)
+        self.costs.append(cost)
+        self.prices.append(price)
+        self.names.append(sys.intern(name))
+        self.brands.append(sys.intern(brand))
+        self.origins.append(sys.intern(origin))
+        self.notify(product_id)
+        return product_id
+
+    def add_products(self, names, brands, quantities, costs, origins, prices=None):
+        """
+        Adds many products to the end of the inventory at once.
+
+        Text is used as given, so repeated brands and origins should
+        already share one string object.
+
+        Parameters:
+            names (list): Product names
+            brands (list): Brand names
+            quantities (array): Units in stock
+            costs (array): Cost prices per unit
+            origins (list): Countries of origin
+            prices (array): Selling prices worked out earlier, None to work them out
+
+        Returns:
+            None
+        """
+        first_id = len(self.names)
+        self.quantities.extend(quantities)
+        self.costs.extend(costs)
+        self.names.extend(names)
+        self.brands.extend(brands)
+        self.origins.extend(origins)
+        if prices is None:
+            self.prices.extend(array("d", bytes(8 * len(costs))))
+            self.reprice(first_id)
+        else:
+            self.prices.extend(prices)
+        if self.listeners:
+            for product_id in range(first_id, len(self.names)):
+                self.notify(product_id)
+
+    def get_name(self, product_id):
+        """Gets the name of a product."""
+        return self.names[product_id]
+
+    def get_brand(self, product_id):
+        """Gets the brand name of a product."""
+        return self.brands[product_id]
+
+    def get_origin(self, product_id):
+        """Gets the country of origin of a product."""
+        return self.origins[product_id]
+
+    def get_quantity(self, product_id):
+        """Gets the units in stock of a product."""
+        return self.quantities[product_id]
+
+    def get_cost(self, product_id):
+        """Gets the cost price per unit of a product."""
+        return self.costs[product_id]
+
+    def get_price(self, product_id):
+        """Gets the selling price per unit of a product."""
+        return self.prices[product_id]
+
+    def set_quantity(self, product_id, quantity):
+        """
+        Changes the stock of a product.
+
+        Parameters:
+            product_id (int): Product ID
+            quantity (int): New stock level
+
+        Returns:
+            None
+        """
+        self.quantities[product_id] = quantity
+        self.notify(product_id)
+
+    def set_cost(self, product_id, cost):
+        """
+        Changes the cost price of a product.
+
+        Parameters:
+            product_id (int): Product ID
+            cost (float): New cost price
+
+        Returns:
+            None
+        """
+        self.costs[product_id] = cost
+        self.prices[product_id] = self.rules.unit_price(
+            product_id, self.brands[product_id], self.origins[product_id], cost)
+        self.notify(product_id)
+
+    def reprice(self, first_id=1):
+        """
+        Works out selling prices again with the inventory's pricing rules.
+
+        Listeners are not told, since stock and cost stay the same.
+
+        Parameters:
+            first_id (int): First product ID to work out
+
+        Returns:
+            None
+        """
+        rules = self.rules
+        unit_price = rules.unit_price
+        for product_id in range(first_id, len(self.names)):
+            self.prices[product_id] = unit_price(product_id, self.brands[product_id],
+                                                 self.origins[product_id],
+                                                 self.costs[product_id])
+        self.price_stamp = rules.stamp
+
+    def add_listener(self, listener):
+        """
+        Registers a function to call whenever a product changes.
+
+        Parameters:
+            listener (function): Called with the changed product ID
+
+        Returns:
+            None
+        """
+        self.listeners.append(listener)
+
+    def notify(self, product_id):
+        """
+        Tells every listener that a product has changed.
+
+        Parameters:
+            product_id (int): Changed product ID
+
+        Returns:
+            None
+        """
+        for listener in self.listeners:
+            listener(product_id)
+
+    def get_row(self, product_id):
+        """
+        Gets a product as text fields in inventory file order.
+
+        Parameters:
+            product_id (int): Product ID
+
+        Returns:
+            list: Name, brand, quantity, cost and origin as strings
+        """
+        return [self.names[product_id], self.brands[product_id],
+                str(self.quantities[product_id]),
+                format_number(self.costs[product_id]),
+                self.origins[product_id]]
+
+    def copy(self):
+        """
+        Makes an independent copy of the inventory without its listeners.
+
+        Returns:
+            Inventory: Copy with its own columns
+        """
+        other = Inventory(self.rules)
+        other.names = list(self.names)
+        other.brands = list(self.brands)
+        other.origins = list(self.origins)
+        other.quantities = array("q", self.quantities)
+        other.costs = array("d", self.costs)
+        other.prices = array("d", self.prices)
+        other.price_stamp = self.price_stamp
+        return other
@@ -0,0 +1,238 @@
+"""
+Stock journal module for WeCare Beauty system.
+Records stock and cost changes so the inventory file does not have to be
+rewritten after every sale or restock.
+"""
+
+import os
+
+
+# Journal size (in bytes) at which it is folded back into inventory.txt
+COMPACT_SIZE = 1024 * 1024
+
+
+def get_journal_filename(filename="inventory.txt"):
+    """
+    Gets the name of the journal file that belongs to an inventory file.
+
+    Parameters:
+        filename (str): Name of inventory file
+
+    Returns:
+        str: Name of journal file
+    """
+    return filename + ".journal"
+
+
+def get_compacting_filename(filename="inventory.txt"):
+    """
+    Gets the name of the journal file that is being compacted.
+
+    Parameters:
+        filename (str): Name of inventory file
+
+    Returns:
+        str: Name of journal file waiting for compaction
+    """
+    return filename + ".journal.old"
+
+
+def append_journal(kind, document_num, changes, filename="inventory.txt"):
+    """
+    Appends one transaction to the journal file.
+
+    Each change line holds the product ID, the quantity change, the new
+    stock and the cost after the transaction. The transaction is closed by
+    an END line so a half written transaction is ignored on replay.
+
+    Parameters:
+        kind (str): Transaction type (SALE or RESTOCK)
+        document_num (str): Invoice or purchase form number
+        changes (list): List of dicts with id, quantity_change, stock and cost
+        filename (str): Name of inventory file
+
+    Returns:
+        int: Size of journal file after writing
+    """
+    return append_journal_transactions([(kind, document_num, changes)], filename)
+
+
+def append_journal_transactions(transactions, filename="inventory.txt"):
+    """
+    Appends several transactions to the journal file with one write and sync.
+
+    Parameters:
+        transactions (list): Tuples of (kind, document number, changes)
+        filename (str): Name of inventory file
+
+    Returns:
+        int: Size of journal file after writing
+    """
+    # Build every transaction first so they go out in one write
+    lines = []
+    for kind, document_num, changes in transactions:
+        for change in changes:
+            lines.append("%s, %s, %s, %s, %s, %s\n" %
+                         (kind, document_num, change["id"],
+                          change["quantity_change"], change["stock"],
+                          change["cost"]))
+        lines.append("END, %s\n" % document_num)
+
+    journal_file = open(get_journal_filename(filename), "a")
+    try:
+        journal_file.write("".join(lines))
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+        return journal_file.tell()
+    finally:
+        journal_file.close()
+
+
+def read_journal(journal_filename, offset=0):
+    """
+    Reads completed transactions from a journal file.
+
+    Parameters:
+        journal_filename (str): Name of journal file
+        offset (int): Position to start reading from
+
+    Returns:
+        tuple: (list of (product_id, stock, cost) tuples in journal order,
+                position after the last complete transaction)
+    """
+    if not os.path.exists(journal_filename):
+        return [], 0
+
+    journal_file = open(journal_filename, "rb")
+    try:
+        journal_file.seek(offset)
+        entries = []
+        pending = []
+        position = offset
+        for raw_line in journal_file:
+            # A line without newline is a torn write at the end of the file
+            if not raw_line.endswith(b"\n"):
+                break
+            position += len(raw_line)
+
+            data = [item.strip() for item in raw_line.decode("utf-8").split(",")]
+            try:
+                if data[0] == "END" and len(data) == 2:
+                    # Transaction finished, keep its changes
+                    entries.extend(pending)
+                    pending = []
+                    offset = position
+                elif len(data) == 6:
+                    pending.append((int(data[2]), int(data[4]), float(data[5])))
+            except ValueError:
+                # Skip damaged lines
+                continue
+
+        return entries, offset
+    finally:
+        journal_file.close()
+
+
+def apply_journal_entries(inventory_data, entries):
+    """
+    Applies journal entries to an inventory.
+
+    Parameters:
+        inventory_data (Inventory): Product data
+        entries (list): List of (product_id, stock, cost) tuples
+
+    Returns:
+        None
+    """
+    for product_id, stock, cost in entries:
+        if inventory_data.has_product(product_id):
+            if inventory_data.get_quantity(product_id) != stock:
+                inventory_data.set_quantity(product_id, stock)
+            if inventory_data.get_cost(product_id) != cost:
+                inventory_data.set_cost(product_id, cost)
+
+
+def replay_journal(inventory_data, filename="inventory.txt"):
+    """
+    Applies journalled changes on top of a loaded inventory snapshot.
+
+    Parameters:
+        inventory_data (Inventory): Product data loaded from snapshot
+        filename (str): Name of inventory file
+
+    Returns:
+        int: Position in the live journal after the last applied transaction
+    """
+    # Older journal waiting for compaction goes first
+    entries, offset = read_journal(get_compacting_filename(filename))
+    apply_journal_entries(inventory_data, entries)
+
+    entries, offset = read_journal(get_journal_filename(filename))
+    apply_journal_entries(inventory_data, entries)
+    return offset
+
+
+def get_journal_changes(filename="inventory.txt"):
+    """
+    Gets the latest journalled stock and cost of each changed product.
+
+    Parameters:
+        filename (str): Name of inventory file
+
+    Returns:
+        dict: Product ID mapped to (stock, cost)
+    """
+    changes = {}
+    for journal_filename in (get_compacting_filename(filename),
+                             get_journal_filename(filename)):
+        entries, offset = read_journal(journal_filename)
+        for product_id, stock, cost in entries:
+            changes[product_id] = (stock, cost)
+    return changes
+
+
+def start_compaction(filename="inventory.txt"):
+    """
+    Moves the live journal aside so it can be folded into a new snapshot.
+
+    Parameters:
+        filename (str): Name of inventory file
+
+    Returns:
+        bool: True if journal was moved, False if compaction is already running
+    """
+    if os.path.exists(get_compacting_filename(filename)):
+        return False
+
+    os.replace(get_journal_filename(filename), get_compacting_filename(filename))
+    return True
+
+
+def finish_compaction(filename="inventory.txt"):
+    """
+    Removes the compacted journal once the new snapshot is on disk.
+
+    Parameters:
+        filename (str): Name of inventory file
+
+    Returns:
+        None
+    """
+    if os.path.exists(get_compacting_filename(filename)):
+        os.remove(get_compacting_filename(filename))
+
+
+def clear_journal(filename="inventory.txt"):
+    """
+    Removes all journal files after a full inventory save.
+
+    Parameters:
+        filename (str): Name of inventory file
+
+    Returns:
+        None
+    """
+    for journal_filename in (get_compacting_filename(filename),
+                             get_journal_filename(filename)):
+        if os.path.exists(journal_filename):
+            os.remove(journal_filename)
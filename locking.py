@@ -0,0 +1,151 @@
+"""
+Inventory locking module for WeCare Beauty system.
+Lets several counters work on one inventory without losing each other's changes.
+"""
+
+import contextlib
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl, use msvcrt byte locks instead
+    fcntl = None
+    import msvcrt
+
+
+# Longest time to wait for another counter to finish, in seconds
+LOCK_TIMEOUT = 10.0
+
+# First and longest pause between lock attempts, in seconds
+RETRY_DELAY = 0.005
+MAX_RETRY_DELAY = 0.2
+
+# One lock per inventory file for threads of this process
+thread_locks = {}
+thread_locks_guard = threading.Lock()
+
+# Inventory files whose lock the current thread holds
+held_locks = threading.local()
+
+
+def get_lock_filename(filename="inventory.txt"):
+    """
+    Gets the name of the lock file that belongs to an inventory file.
+
+    Parameters:
+        filename (str): Name of inventory file
+
+    Returns:
+        str: Name of lock file
+    """
+    return filename + ".lock"
+
+
+def get_thread_lock(filename):
+    """
+    Gets the in-process lock for an inventory file.
+
+    Parameters:
+        filename (str): Name of inventory file
+
+    Returns:
+        threading.Lock: Lock shared by all threads of this process
+    """
+    key = os.path.abspath(filename)
+    with thread_locks_guard:
+        if key not in thread_locks:
+            thread_locks[key] = threading.Lock()
+        return thread_locks[key]
+
+
+def try_lock_file(lock_file):
+    """
+    Tries once to take the lock on an open lock file.
+
+    Parameters:
+        lock_file: Open lock file
+
+    Returns:
+        bool: True if the lock was taken
+    """
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def unlock_file(lock_file):
+    """
+    Releases the lock on an open lock file.
+
+    Parameters:
+        lock_file: Open lock file
+
+    Returns:
+        None
+    """
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextlib.contextmanager
+def inventory_lock(filename="inventory.txt", timeout=LOCK_TIMEOUT):
+    """
+    Holds the inventory lock for the duration of a with block.
+
+    Other threads of this process wait on a thread lock. Other processes
+    wait on an operating system lock on the lock file, which is retried
+    with a growing pause until the timeout runs out. A thread that already
+    holds the lock, like a batch run saving at the end, keeps it.
+
+    Parameters:
+        filename (str): Name of inventory file
+        timeout (float): Longest time to wait, in seconds
+
+    Raises:
+        TimeoutError: If the lock could not be taken in time
+    """
+    key = os.path.abspath(filename)
+    if not hasattr(held_locks, "keys"):
+        held_locks.keys = set()
+    if key in held_locks.keys:
+        yield
+        return
+
+    deadline = time.monotonic() + timeout
+    thread_lock = get_thread_lock(filename)
+    if not thread_lock.acquire(timeout=timeout):
+        raise TimeoutError("Inventory is busy at another counter")
+
+    held_locks.keys.add(key)
+    try:
+        lock_file = open(get_lock_filename(filename), "a+")
+        try:
+            # Retry until the other counter is done
+            delay = RETRY_DELAY
+            while not try_lock_file(lock_file):
+                if time.monotonic() >= deadline:
+                    raise TimeoutError("Inventory is busy at another counter")
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+
+            try:
+                yield
+            finally:
+                unlock_file(lock_file)
+        finally:
+            lock_file.close()
+    finally:
+        held_locks.keys.discard(key)
+        thread_lock.release()
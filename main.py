@@ -3,16 +3,25 @@ Main program for Beauty Products Management - WeCare.
 """
 
 import datetime
-from read import get_inventory_data, print_inventory
-from operation import restock_items, sell_items
-
-
-def display_header():
+import sys
+from docwriter import flush_documents
+from metrics import record_error, save_metrics, setup_metrics_from_environment
+from numbering import close_allocators
+from read import print_inventory
+from operation import restock_items, sell_items, view_inventory
+from pricing import current_rules
+from reorder import ReorderEngine
+from render import CatalogueRenderer, format_sale_row, format_stock_row, format_table_row
+from search import ProductIndex
+from storage import open_storage
+
+
+def display_header(filename="inventory.txt"):
     """
     Shows the program header and current date/time.
 
     Parameters:
-        None
+        filename (str): Name of inventory file or database, for its promotions
 
     Returns:
         None
@@ -31,7 +40,8 @@ def display_header():
     print("\t" * 3 + "Welcome to the system! " + date_string)
     print("-" * 80)
     print("\n")
-    print("Buy 3 Get 1 Free on all products!")
+    for promotion in current_rules(filename).describe():
+        print(promotion)
     print("\n")
 
 
@@ -50,7 +60,8 @@ def display_menu():
     print("=" * 30)
     print("1. Add New Stock")
     print("2. Process Sale")
-    print("3. Exit Program")
+    print("3. View Inventory")
+    print("4. Exit Program")
 
     try:
         selected = int(input("Enter option number: "))
@@ -70,16 +81,33 @@ def start_program():
     Returns:
         None
     """
+    # Collect metrics if asked to by environment variables
+    setup_metrics_from_environment()
+
+    # Text file or database given on the command line
+    filename = "inventory.txt"
+    if len(sys.argv) > 1:
+        filename = sys.argv[1]
+
     # Show program header
-    display_header()
+    display_header(filename)
 
     # Try to load inventory
     try:
-        # Load data from file
-        inventory_data = get_inventory_data()
+        storage = open_storage(filename)
+        inventory_data = storage.load()
+
+        # Build product search index and product lists once
+        product_index = ProductIndex(inventory_data)
+        table_renderer = CatalogueRenderer(inventory_data, format_table_row)
+        stock_renderer = CatalogueRenderer(inventory_data, format_stock_row)
+        sale_renderer = CatalogueRenderer(inventory_data, format_sale_row)
 
         # Display current inventory
-        print_inventory(inventory_data)
+        print_inventory(inventory_data, 1, table_renderer)
+
+        # Follow days of cover for low stock alerts
+        reorder_engine = ReorderEngine(inventory_data)
 
         # Start program loop
         program_running = True
@@ -91,28 +119,44 @@ def start_program():
                 # Process selected option
                 if option == 1:
                     # Restock inventory
-                    restock_items(inventory_data)
+                    restock_items(inventory_data, product_index, stock_renderer,
+                                  reorder_engine)
 
                 elif option == 2:
                     # Process a sale
-                    sell_items(inventory_data)
+                    sell_items(inventory_data, product_index, sale_renderer)
 
                 elif option == 3:
+                    # Page through the whole inventory
+                    view_inventory(inventory_data, table_renderer)
+
+                elif option == 4:
                     # Exit program
                     print("Thank you for using WeCare Beauty Products Management")
                     program_running = False
 
                 else:
-                    print("Please select a valid option (1-3)")
+                    print("Please select a valid option (1-4)")
 
             except:
+                record_error("menu")
                 print("An error occurred while processing your request")
                 print("Please try again")
 
+        # Make sure queued invoices and purchase forms reach the disk
+        flush_documents()
+        storage.close()
+
     except:
+        record_error("startup")
         print("Fatal error starting the program")
         print("System will now exit")
 
+    finally:
+        # Unused document numbers go back even after an error
+        close_allocators()
+        save_metrics()
+
 
 # Run program when script is executed directly
 if __name__ == "__main__":
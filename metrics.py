@@ -0,0 +1,336 @@
+"""
+Metrics module for WeCare Beauty system.
+Counts and times inventory work so slow spots can be found at busy hours.
+
+Metrics are off unless turned on, and then cost one flag check per
+timed call. They are turned on by enable_metrics or by setting one of:
+    WECARE_METRICS_FILE: File the metrics are written to on exit
+    WECARE_METRICS_PORT: Port serving the metrics at /metrics
+
+Both outputs use the Prometheus text format.
+"""
+
+import functools
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Prefix of every metric name
+METRIC_PREFIX = "wecare_"
+
+# Histogram bucket limits for durations in seconds and for item counts
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (1, 2, 3, 4, 5, 10, 20, 50, 100)
+
+# Whether metrics are being collected
+enabled = False
+
+# Counter values and histograms by (name, labels)
+counters = {}
+histograms = {}
+metrics_lock = threading.Lock()
+
+# File written by save_metrics when no other is given
+metrics_filename = None
+
+
+def enable_metrics(filename=None):
+    """
+    Starts collecting metrics.
+
+    Parameters:
+        filename (str): File save_metrics writes to, None for none
+
+    Returns:
+        None
+    """
+    global enabled, metrics_filename
+    enabled = True
+    if filename is not None:
+        metrics_filename = filename
+
+
+def disable_metrics():
+    """
+    Stops collecting metrics. Values collected so far are kept.
+
+    Returns:
+        None
+    """
+    global enabled
+    enabled = False
+
+
+def metric_key(name, labels):
+    """
+    Makes the dictionary key of a metric.
+
+    Parameters:
+        name (str): Metric name
+        labels (dict): Label values, None for none
+
+    Returns:
+        tuple: (name, sorted label pairs)
+    """
+    if not labels:
+        return (name, ())
+    return (name, tuple(sorted(labels.items())))
+
+
+def count(name, amount=1, labels=None):
+    """
+    Adds to a counter.
+
+    Parameters:
+        name (str): Counter name without prefix or _total
+        amount (int): Amount to add
+        labels (dict): Label values, None for none
+
+    Returns:
+        None
+    """
+    if not enabled:
+        return
+    key = metric_key(name, labels)
+    with metrics_lock:
+        counters[key] = counters.get(key, 0) + amount
+
+
+def observe(name, value, buckets=TIME_BUCKETS, labels=None):
+    """
+    Adds a value to a histogram.
+
+    Parameters:
+        name (str): Histogram name without prefix
+        value (float): Observed value
+        buckets (tuple): Upper bucket limits, used when the histogram is new
+        labels (dict): Label values, None for none
+
+    Returns:
+        None
+    """
+    if not enabled:
+        return
+    key = metric_key(name, labels)
+    with metrics_lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = {"buckets": buckets, "counts": [0] * len(buckets),
+                         "sum": 0.0, "count": 0}
+            histograms[key] = histogram
+
+        # Counts are kept per bucket and added up when exported
+        for position, limit in enumerate(histogram["buckets"]):
+            if value <= limit:
+                histogram["counts"][position] += 1
+                break
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+def timed(name):
+    """
+    Decorator that times every call of a function.
+
+    Calls that raise an error are counted as errors of the same name.
+
+    Parameters:
+        name (str): Histogram name without prefix or _seconds
+
+    Returns:
+        function: Decorator
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            except:
+                count("errors", labels={"where": name})
+                raise
+            finally:
+                observe(name + "_seconds", time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def record_error(where):
+    """
+    Counts an error that was handled by printing a message.
+
+    Parameters:
+        where (str): Part of the program the error happened in
+
+    Returns:
+        None
+    """
+    count("errors", labels={"where": where})
+
+
+def format_labels(labels, extra=None):
+    """
+    Formats label pairs for the Prometheus text format.
+
+    Parameters:
+        labels (tuple): Sorted (name, value) pairs
+        extra (tuple): One more (name, value) pair, None for none
+
+    Returns:
+        str: Labels in braces, empty if there are none
+    """
+    pairs = list(labels)
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    text = []
+    for label, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        text.append('%s="%s"' % (label, value))
+    return "{" + ",".join(text) + "}"
+
+
+def format_metrics():
+    """
+    Formats every metric in the Prometheus text format.
+
+    Returns:
+        str: Metrics text
+    """
+    with metrics_lock:
+        counter_items = sorted(counters.items())
+        histogram_items = sorted([(key, dict(histogram, counts=list(histogram["counts"])))
+                                  for key, histogram in histograms.items()])
+
+    lines = []
+    typed = set()
+    for (name, labels), value in counter_items:
+        full_name = METRIC_PREFIX + name + "_total"
+        if full_name not in typed:
+            lines.append("# TYPE %s counter" % full_name)
+            typed.add(full_name)
+        lines.append("%s%s %s" % (full_name, format_labels(labels), value))
+
+    for (name, labels), histogram in histogram_items:
+        full_name = METRIC_PREFIX + name
+        if full_name not in typed:
+            lines.append("# TYPE %s histogram" % full_name)
+            typed.add(full_name)
+
+        # Buckets are cumulative in the text format
+        running = 0
+        for limit, bucket_count in zip(histogram["buckets"], histogram["counts"]):
+            running += bucket_count
+            lines.append("%s_bucket%s %d" % (full_name,
+                                             format_labels(labels, ("le", repr(limit))),
+                                             running))
+        lines.append("%s_bucket%s %d" % (full_name, format_labels(labels, ("le", "+Inf")),
+                                         histogram["count"]))
+        lines.append("%s_sum%s %r" % (full_name, format_labels(labels), histogram["sum"]))
+        lines.append("%s_count%s %d" % (full_name, format_labels(labels), histogram["count"]))
+
+    return "\n".join(lines) + "\n"
+
+
+def save_metrics(filename=None):
+    """
+    Writes the metrics to a file, replacing it in one step.
+
+    Parameters:
+        filename (str): Name of metrics file, None for the enabled one
+
+    Returns:
+        bool: True if written, False if there was nothing to write to or it failed
+    """
+    if filename is None:
+        filename = metrics_filename
+    if filename is None:
+        return False
+    try:
+        temp_filename = filename + ".tmp"
+        metrics_file = open(temp_filename, "w")
+        try:
+            metrics_file.write(format_metrics())
+        finally:
+            metrics_file.close()
+        os.replace(temp_filename, filename)
+        return True
+    except:
+        print("Error writing metrics file " + filename)
+        return False
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serves the metrics at /metrics.
+    """
+
+    def do_GET(self):
+        """
+        Answers a metrics request.
+
+        Returns:
+            None
+        """
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = format_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """
+        Keeps requests off the console.
+
+        Returns:
+            None
+        """
+        return None
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """
+    Serves the metrics over HTTP from a background thread.
+
+    Parameters:
+        port (int): Port to listen on
+        host (str): Address to listen on
+
+    Returns:
+        ThreadingHTTPServer: Running server
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server",
+                              daemon=True)
+    thread.start()
+    return server
+
+
+def setup_metrics_from_environment():
+    """
+    Turns metrics on if WECARE_METRICS_FILE or WECARE_METRICS_PORT is set.
+
+    Returns:
+        bool: True if metrics were turned on
+    """
+    filename = os.environ.get("WECARE_METRICS_FILE")
+    port = os.environ.get("WECARE_METRICS_PORT")
+    if not filename and not port:
+        return False
+
+    enable_metrics(filename or None)
+    if port:
+        try:
+            start_metrics_server(int(port))
+        except:
+            print("Could not serve metrics on port " + port)
+    return True
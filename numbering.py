@@ -0,0 +1,251 @@
+"""
+Document numbering module for WeCare Beauty system.
+Hands out sequential invoice and purchase form numbers that are never reused.
+
+The next free number of each kind is kept in a counter file next to the
+inventory. A counter takes a block of numbers at a time under the file
+lock and hands them out from memory, so counters do not wait on each
+other for every document. Unused numbers of a block are given back when
+the program closes if no other counter has taken a block since.
+
+A number is also given back when its sale or restock is not saved.
+Numbers can still be skipped: the rest of a block is lost when another
+counter has taken a block since, or when the program is killed, and a
+number is only given back while it is the last one handed out.
+
+Gap-free numbering would mean locking the counter file for every
+document, which makes busy counters queue behind each other. Block
+allocation is kept on purpose, so skipped numbers are expected and
+numbers from several counters are not in the order documents were made.
+"""
+
+import os
+import threading
+from locking import inventory_lock
+
+
+# Numbers taken from the counter file at once
+ID_BLOCK_SIZE = 20
+
+# First number of a new counter, above the old four digit random numbers
+FIRST_NUMBER = 10000
+
+# One allocator per counter file for the whole process
+allocators = {}
+allocators_guard = threading.Lock()
+
+
+def get_counter_filename(prefix, filename="inventory.txt"):
+    """
+    Gets the name of the counter file for one kind of document.
+
+    Parameters:
+        prefix (str): Document prefix such as INV or PO
+        filename (str): Name of inventory file or database
+
+    Returns:
+        str: Name of counter file
+    """
+    return filename + "." + prefix.lower() + ".counter"
+
+
+def read_counter(counter_filename):
+    """
+    Reads the next free number from a counter file.
+
+    Parameters:
+        counter_filename (str): Name of counter file
+
+    Returns:
+        int: Next free number
+    """
+    if not os.path.exists(counter_filename):
+        return FIRST_NUMBER
+
+    file = open(counter_filename, "r")
+    try:
+        text = file.read().strip()
+    finally:
+        file.close()
+
+    # Never start over silently, that would repeat numbers
+    if not text.isdigit():
+        raise ValueError("Counter file " + counter_filename + " is damaged")
+    return int(text)
+
+
+def write_counter(counter_filename, next_number):
+    """
+    Saves the next free number so it survives a crash.
+
+    Parameters:
+        counter_filename (str): Name of counter file
+        next_number (int): Next free number
+
+    Returns:
+        None
+    """
+    temp_filename = counter_filename + ".tmp"
+    file = open(temp_filename, "w")
+    try:
+        file.write(str(next_number) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+    finally:
+        file.close()
+    os.replace(temp_filename, counter_filename)
+
+
+class IdAllocator:
+    """
+    Sequential numbers for one kind of document.
+
+    Numbers from one allocator always go up. Numbers are unique across
+    all counters sharing the counter file.
+    """
+
+    def __init__(self, counter_filename, block_size=ID_BLOCK_SIZE):
+        """
+        Creates an allocator with no numbers reserved yet.
+
+        Parameters:
+            counter_filename (str): Name of counter file
+            block_size (int): Numbers taken from the file at once
+
+        Returns:
+            None
+        """
+        self.counter_filename = counter_filename
+        self.block_size = block_size
+        self.lock = threading.Lock()
+
+        # Numbers reserved but not handed out: next_number up to block_end - 1
+        self.next_number = 0
+        self.block_end = 0
+
+    def reserve_block(self):
+        """
+        Takes the next block of numbers from the counter file.
+
+        Should be called while holding self.lock.
+
+        Returns:
+            None
+        """
+        with inventory_lock(self.counter_filename):
+            first = read_counter(self.counter_filename)
+            write_counter(self.counter_filename, first + self.block_size)
+        self.next_number = first
+        self.block_end = first + self.block_size
+
+    def allocate(self):
+        """
+        Hands out the next number.
+
+        Returns:
+            int: Document number
+        """
+        with self.lock:
+            if self.next_number >= self.block_end:
+                self.reserve_block()
+            number = self.next_number
+            self.next_number += 1
+            return number
+
+    def release(self, number):
+        """
+        Gives back a number that was not used, if it was the last handed out.
+
+        Parameters:
+            number (int): Document number
+
+        Returns:
+            bool: True if the number will be handed out again
+        """
+        with self.lock:
+            if number == self.next_number - 1 and number < self.block_end:
+                self.next_number = number
+                return True
+            return False
+
+    def close(self):
+        """
+        Gives the unused part of the block back to the counter file.
+
+        This only works if no other counter has taken a block since,
+        otherwise the unused numbers are skipped.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            if self.next_number >= self.block_end:
+                return
+            with inventory_lock(self.counter_filename):
+                if read_counter(self.counter_filename) == self.block_end:
+                    write_counter(self.counter_filename, self.next_number)
+            self.next_number = 0
+            self.block_end = 0
+
+
+def get_allocator(prefix, filename="inventory.txt"):
+    """
+    Gets the shared allocator for one kind of document.
+
+    Parameters:
+        prefix (str): Document prefix such as INV or PO
+        filename (str): Name of inventory file or database
+
+    Returns:
+        IdAllocator: Allocator for the document kind
+    """
+    counter_filename = os.path.abspath(get_counter_filename(prefix, filename))
+    with allocators_guard:
+        if counter_filename not in allocators:
+            allocators[counter_filename] = IdAllocator(counter_filename)
+        return allocators[counter_filename]
+
+
+def next_document_number(prefix, filename="inventory.txt"):
+    """
+    Gets a new document number such as INV-10001.
+
+    Parameters:
+        prefix (str): Document prefix such as INV or PO
+        filename (str): Name of inventory file or database
+
+    Returns:
+        str: Document number
+    """
+    return "%s-%d" % (prefix, get_allocator(prefix, filename).allocate())
+
+
+def release_document_number(document_num, filename="inventory.txt"):
+    """
+    Gives back a document number whose transaction did not go through.
+
+    Parameters:
+        document_num (str): Document number such as INV-10001
+        filename (str): Name of inventory file or database
+
+    Returns:
+        bool: True if the number will be handed out again
+    """
+    prefix, number = document_num.rsplit("-", 1)
+    return get_allocator(prefix, filename).release(int(number))
+
+
+def close_allocators():
+    """
+    Gives unused numbers of every allocator back to their counter files.
+
+    Returns:
+        None
+    """
+    with allocators_guard:
+        open_allocators = list(allocators.values())
+    for allocator in open_allocators:
+        try:
+            allocator.close()
+        except:
+            print("Error saving document counter " + allocator.counter_filename)
@@ -2,7 +2,61 @@
 Operations module for handling sales and restocking in WeCare Beauty System.
 """
 
-from write import generate_purchase_form, generate_invoice
+from customers import get_customer_registry
+from metrics import record_error
+from pricing import price_basket
+from read import print_inventory
+from reorder import print_low_stock
+from render import CatalogueRenderer, format_sale_row, format_stock_row, format_table_row
+from search import ProductIndex
+from write import generate_purchase_form, generate_invoice, sync_inventory
+
+
+# Most search results shown at once
+SEARCH_RESULT_LIMIT = 20
+
+
+def validate_input(raw_input, input_type="int", min_val=None, max_val=None):
+    """
+    Converts and checks a raw input value.
+
+    Parameters:
+        raw_input (str): Value as typed or read from a file
+        input_type (str): Type of input expected (int, float, str)
+        min_val: Minimum acceptable value
+        max_val: Maximum acceptable value
+
+    Returns:
+        tuple: (value, None) if valid, (None, error message) otherwise
+    """
+    try:
+        # Check input type
+        if input_type == "int":
+            # Convert to integer
+            value = int(raw_input)
+
+        elif input_type == "float":
+            # Convert to float
+            value = float(raw_input)
+
+        elif input_type == "str":
+            # Check for empty string
+            if raw_input == "":
+                return None, "Input cannot be empty"
+            return raw_input, None
+
+        else:
+            return None, "Unknown input type: " + input_type
+
+    except:
+        return None, "Invalid input. Please provide a valid " + input_type
+
+    # Check range
+    if min_val is not None and value < min_val:
+        return None, "Value must be at least " + str(min_val)
+    if max_val is not None and value > max_val:
+        return None, "Value must be at most " + str(max_val)
+    return value, None
 
 
 def check_input(prompt_message, input_type="int", min_val=None, max_val=None):
@@ -19,58 +73,110 @@ def check_input(prompt_message, input_type="int", min_val=None, max_val=None):
         Validated input value in appropriate type
     """
     while True:
-        try:
-            # Get input
-            raw_input = input(prompt_message)
-
-            # Check input type
-            if input_type == "int":
-                # Convert to integer
-                value = int(raw_input)
-
-                # Check range
-                if min_val is not None and value < min_val:
-                    print("Value must be at least " + str(min_val))
-                    continue
-                if max_val is not None and value > max_val:
-                    print("Value must be at most " + str(max_val))
-                    continue
-                return value
-
-            elif input_type == "float":
-                # Convert to float
-                value = float(raw_input)
-
-                # Check range
-                if min_val is not None and value < min_val:
-                    print("Value must be at least " + str(min_val))
-                    continue
-                if max_val is not None and value > max_val:
-                    print("Value must be at most " + str(max_val))
-                    continue
-                return value
-
-            elif input_type == "str":
-                # Check for empty string
-                if raw_input == "":
-                    print("Input cannot be empty")
-                    continue
-                return raw_input
-
-            else:
-                print("Unknown input type: " + input_type)
-                continue
+        # Get input
+        raw_input = input(prompt_message)
+
+        value, error = validate_input(raw_input, input_type, min_val, max_val)
+        if error is None:
+            return value
+        print(error)
+
+
+def choose_product(prompt_message, inventory_data, product_index, renderer):
+    """
+    Gets a product ID, letting the user page through or search products first.
+
+    Parameters:
+        prompt_message (str): Message to show user
+        inventory_data (Inventory): Product information
+        product_index (ProductIndex): Search index over the inventory
+        renderer (CatalogueRenderer): Paged product list
+
+    Returns:
+        int: Valid product ID
+    """
+    # Show the first page of products
+    page = renderer.print_page(1)
+
+    while True:
+        raw_input = input(prompt_message)
+
+        # Move between pages
+        if raw_input.strip().lower() == "n":
+            page = renderer.print_page(page + 1)
+            continue
+        if raw_input.strip().lower() == "p":
+            page = renderer.print_page(page - 1)
+            continue
+
+        # Search instead of typing an ID
+        if raw_input.strip().lower() == "s":
+            query = check_input("Search by name, brand or origin: ", "str")
+            matches = product_index.search(query)
+            if not matches:
+                print("No products found.")
+            for product_id in matches[:SEARCH_RESULT_LIMIT]:
+                print("%d. %s (%s) - %s - Stock: %s" %
+                      (product_id, inventory_data.get_name(product_id),
+                       inventory_data.get_brand(product_id),
+                       inventory_data.get_origin(product_id),
+                       inventory_data.get_quantity(product_id)))
+            if len(matches) > SEARCH_RESULT_LIMIT:
+                print("... and " + str(len(matches) - SEARCH_RESULT_LIMIT) +
+                      " more. Please search more precisely.")
+            continue
+
+        value, error = validate_input(raw_input, "int", 1, len(inventory_data))
+        if error is None:
+            return value
+        print(error)
+
+
+def view_inventory(inventory_data, renderer=None):
+    """
+    Shows the full inventory table, letting the user page through it.
+
+    Parameters:
+        inventory_data (Inventory): Product information
+        renderer (CatalogueRenderer): Inventory table, built if not given
+
+    Returns:
+        None
+    """
+    print("\n" + "=" * 40)
+    print("VIEW INVENTORY")
+    print("=" * 40)
 
-        except:
-            print("Invalid input. Please provide a valid " + input_type)
+    if renderer is None:
+        renderer = CatalogueRenderer(inventory_data, format_table_row)
 
+    # Catch up with changes from other counters
+    sync_inventory(inventory_data)
 
-def restock_items(inventory_data):
+    page = print_inventory(inventory_data, 1, renderer)
+    while True:
+        choice = input("N for next page, P for previous page, Enter to go back: ")
+        choice = choice.strip().lower()
+        if choice == "n":
+            page = print_inventory(inventory_data, page + 1, renderer)
+        elif choice == "p":
+            page = print_inventory(inventory_data, page - 1, renderer)
+        elif choice == "":
+            return
+        else:
+            print("Please enter N, P or press Enter.")
+
+
+def restock_items(inventory_data, product_index=None, renderer=None,
+                  reorder_engine=None):
     """
     Handles restocking products from suppliers.
 
     Parameters:
-        inventory_data (list): List of product information
+        inventory_data (Inventory): Product information
+        product_index (ProductIndex): Search index, built if not given
+        renderer (CatalogueRenderer): Restock product list, built if not given
+        reorder_engine (ReorderEngine): Shows products running out, if given
 
     Returns:
         bool: True if completed successfully, False otherwise
@@ -80,6 +186,18 @@ def restock_items(inventory_data):
     print("=" * 40)
 
     try:
+        if product_index is None:
+            product_index = ProductIndex(inventory_data)
+        if renderer is None:
+            renderer = CatalogueRenderer(inventory_data, format_stock_row)
+
+        # Catch up with changes from other counters
+        sync_inventory(inventory_data)
+
+        # Point out what needs restocking most
+        if reorder_engine is not None:
+            print_low_stock(reorder_engine)
+
         # Get supplier details
         supplier_name = check_input("Enter supplier name: ", "str")
 
@@ -89,16 +207,11 @@ def restock_items(inventory_data):
         # Process multiple items
         continue_adding = "y"
         while continue_adding.lower() == "y":
-            # Show available products
+            # Show available products and get product to restock
             print("\nCurrent products:")
-            for idx in range(1, len(inventory_data)):
-                product = inventory_data[idx]
-                print("%d. %s (%s) - Stock: %s - Cost: %s" %
-                      (idx, product[0], product[1], product[2], product[3]))
-
-            # Get product to restock
-            max_id = len(inventory_data) - 1
-            product_id = check_input("\nEnter product ID to restock: ", "int", 1, max_id)
+            product_id = choose_product("\nEnter product ID to restock "
+                                        "(S to search, N/P to change page): ",
+                                        inventory_data, product_index, renderer)
 
             # Get quantity
             quantity = check_input("Enter quantity to add: ", "int", 1)
@@ -122,7 +235,9 @@ def restock_items(inventory_data):
 
         # Generate purchase form if items were added
         if restock_list:
-            generate_purchase_form(supplier_name, restock_list, inventory_data)
+            if generate_purchase_form(supplier_name, restock_list, inventory_data) is None:
+                print("Stock update could not be completed.")
+                return False
             print("Stock update completed successfully!")
             return True
         else:
@@ -130,16 +245,19 @@ def restock_items(inventory_data):
             return False
 
     except:
+        record_error("restock")
         print("Error during restocking process")
         return False
 
 
-def sell_items(inventory_data):
+def sell_items(inventory_data, product_index=None, renderer=None):
     """
     Handles product sales to customers.
 
     Parameters:
-        inventory_data (list): List of product information
+        inventory_data (Inventory): Product information
+        product_index (ProductIndex): Search index, built if not given
+        renderer (CatalogueRenderer): Sale product list, built if not given
 
     Returns:
         bool: True if completed successfully, False otherwise
@@ -149,9 +267,27 @@ def sell_items(inventory_data):
     print("=" * 40)
 
     try:
-        # Get customer details
-        customer_name = check_input("Enter customer name: ", "str")
+        if product_index is None:
+            product_index = ProductIndex(inventory_data)
+        if renderer is None:
+            renderer = CatalogueRenderer(inventory_data, format_sale_row)
+
+        # Catch up with changes from other counters
+        sync_inventory(inventory_data)
+
+        # Get customer details, filling in returning customers by phone number
         contact_number = check_input("Enter phone number: ", "str")
+        customer = get_customer_registry(inventory_data.filename).find_by_phone(contact_number)
+        customer_name = ""
+        if customer is not None:
+            print("Returning customer: %s - %d visits - Spent: %s - Last visit: %s" %
+                  (customer["name"], customer["visits"], str(round(customer["spend"], 2)),
+                   customer["last_visit"]))
+            customer_name = input("Enter customer name [" + customer["name"] + "]: ").strip()
+            if not customer_name:
+                customer_name = customer["name"]
+        if not customer_name:
+            customer_name = check_input("Enter customer name: ", "str")
 
         # List to track items being sold
         sale_list = []
@@ -159,33 +295,26 @@ def sell_items(inventory_data):
         # Process multiple items
         continue_adding = "y"
         while continue_adding.lower() == "y":
-            # Show available products with prices
+            # Show available products with prices and get product to sell
             print("\nProducts available:")
-            for idx in range(1, len(inventory_data)):
-                product = inventory_data[idx]
-                # Calculate selling price
-                cost = float(product[3])
-                price = cost * 3  # 200% markup
-
-                print("%d. %s (%s) - Price: $%.2f - Stock: %s" %
-                      (idx, product[0], product[1], price, product[2]))
-
-            # Get product to sell
-            max_id = len(inventory_data) - 1
-            product_id = check_input("\nEnter product ID to sell: ", "int", 1, max_id)
+            product_id = choose_product("\nEnter product ID to sell "
+                                        "(S to search, N/P to change page): ",
+                                        inventory_data, product_index, renderer)
 
             # Show current stock
-            stock = int(inventory_data[product_id][2])
+            stock = inventory_data.get_quantity(product_id)
             print("Available stock: " + str(stock))
 
             # Get quantity
             quantity = check_input("Enter quantity to sell: ", "int", 1)
 
-            # Calculate promotional items
-            free_items = quantity // 3
-            total_needed = quantity + free_items
+            # Price the sale so far the way the invoice will, to get the free items
+            item = {"id": product_id, "quantity": quantity}
+            basket = price_basket(inventory_data, sale_list + [item])
+            free_items = basket["lines"][-1]["free"]
+            total_needed = basket["stock_used"][product_id]
 
-            # Check if enough stock
+            # Check if enough stock, counting earlier lines of the same product
             if total_needed > stock:
                 print("Not enough stock! You need " + str(total_needed) +
                       " units (" + str(quantity) + " paid + " +
@@ -195,20 +324,25 @@ def sell_items(inventory_data):
                 continue
 
             # Add to sale list
-            sale_list.append({
-                "id": product_id,
-                "quantity": quantity
-            })
+            sale_list.append(item)
 
             # Show promotional info
-            print("Customer gets " + str(free_items) + " free items with this purchase!")
+            if free_items:
+                print("Customer gets " + str(free_items) + " free items with this purchase!")
 
             # Ask if more items
             continue_adding = check_input("Add more items? (y/n): ", "str")
 
         # Generate sale invoice if items were sold
         if sale_list:
-            generate_invoice(customer_name, contact_number, sale_list, inventory_data)
+            # Asked here, so the invoice timing does not wait on the customer
+            shipping_input = input("\nDo you want your products to be shipped? (Y/N): ")
+            shipping = shipping_input.upper() == "Y"
+
+            if generate_invoice(customer_name, contact_number, sale_list, inventory_data,
+                                shipping) is None:
+                print("Sale could not be completed.")
+                return False
             print("Sale completed successfully!")
             return True
         else:
@@ -216,5 +350,6 @@ def sell_items(inventory_data):
             return False
 
     except:
+        record_error("sale")
         print("Error during sales process")
         return False
\ No newline at end of file
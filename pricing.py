@@ -0,0 +1,599 @@
+"""
+Pricing module for WeCare Beauty system.
+Works out selling prices and promotions from a rules file kept next to
+the inventory (inventory.txt.pricing for inventory.txt).
+
+Each line of the rules file is "kind, applies to, value" with an
+optional first and last day:
+    markup, all, 3                      Selling price is 3 times the cost
+    markup, brand Olay, 2.5             Brand markup
+    markup, cost 1000, 2.5              Markup for products costing at least 1000
+    discount, origin India, 10          10% off the selling price
+    free, all, 3+1                      Buy 3 get 1 free
+    free, product 7, 2+1, 2026-12-20, 2026-12-31
+    bundle, product 1 2, 15             15% off each set of products 1 and 2
+Rules apply to all, product ID, brand, origin or cost. The most specific
+rule of a kind wins (product, then brand, origin, cost and all), and a
+later line wins over an earlier one. Without a rules file, the standard
+markup and "Buy 3 Get 1 Free" apply.
+
+Rules are compiled into dictionaries and cost tiers once per day, so
+pricing an item is a few lookups however many rules there are. Selling
+prices are kept with the inventory and only worked out again when the
+active rules change.
+"""
+
+import bisect
+import datetime
+import operator
+import os
+import threading
+import zlib
+
+
+# Selling price is three times the cost price (200% markup)
+MARKUP = 3
+
+# One free unit for every this many units bought
+PROMO_BUY = 3
+
+# Rules used when there is no rules file
+DEFAULT_RULES = ["markup, all, %r" % MARKUP, "free, all, %d+1" % PROMO_BUY]
+
+# Kinds of rule and what they can apply to
+RULE_KINDS = ("markup", "discount", "free", "bundle")
+RULE_TARGETS = ("product", "brand", "origin", "cost", "all")
+
+# Rules compiled for today by rules file name, and the lock for replacing them
+active_rules = {}
+rules_lock = threading.Lock()
+
+# Default rules compiled once, for inventories not loaded from a file
+default_rules = None
+
+
+def parse_rule(line):
+    """
+    Splits one rules file line into a rule.
+
+    Parameters:
+        line (str): Line from the rules file
+
+    Returns:
+        dict: kind, target, key, value, start and end, or None for a blank
+              or comment line
+
+    Raises:
+        ValueError: If the line is not a valid rule
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+
+    parts = [part.strip() for part in line.split(",")]
+    if len(parts) < 3 or len(parts) > 5:
+        raise ValueError("expected kind, applies to, value[, from[, to]]")
+
+    kind = parts[0].lower()
+    if kind not in RULE_KINDS:
+        raise ValueError("unknown kind '%s'" % parts[0])
+
+    target, separator, key = parts[1].partition(" ")
+    target = target.lower()
+    key = key.strip()
+    if target not in RULE_TARGETS:
+        raise ValueError("unknown target '%s'" % parts[1])
+    if (target == "all") != (key == ""):
+        raise ValueError("'%s' needs a value, 'all' takes none" % target)
+
+    # Keys are compared in the same form they are looked up in
+    if target == "product":
+        key = tuple(dict.fromkeys([int(product_id) for product_id in key.split()]))
+        if kind != "bundle":
+            if len(key) != 1:
+                raise ValueError("only bundles apply to several products")
+            key = key[0]
+    elif target == "cost":
+        key = float(key)
+    else:
+        key = key.lower()
+    if kind == "bundle" and (target != "product" or len(key) < 2):
+        raise ValueError("bundles apply to two or more products")
+
+    if kind == "free":
+        buy, separator, free = parts[2].partition("+")
+        value = (int(buy), int(free))
+        if value[0] < 1 or value[1] < 0:
+            raise ValueError("free offers are 'buy+free' with buy of at least 1")
+    else:
+        value = float(parts[2])
+        if kind == "markup" and value <= 0:
+            raise ValueError("markup must be above 0")
+        if kind in ("discount", "bundle") and not 0 <= value <= 100:
+            raise ValueError("discount must be between 0 and 100")
+
+    start = None
+    end = None
+    if len(parts) > 3 and parts[3]:
+        start = datetime.date.fromisoformat(parts[3])
+    if len(parts) > 4 and parts[4]:
+        end = datetime.date.fromisoformat(parts[4])
+
+    return {"kind": kind, "target": target, "key": key, "value": value,
+            "start": start, "end": end, "text": line}
+
+
+def get_pricing_filename(filename="inventory.txt"):
+    """
+    Gets the name of the pricing rules file of an inventory.
+
+    Parameters:
+        filename (str): Name of inventory file or database
+
+    Returns:
+        str: Name of rules file
+    """
+    return filename + ".pricing"
+
+
+def read_rules(filename):
+    """
+    Reads the rules file, skipping lines that are not valid rules.
+
+    Parameters:
+        filename (str): Name of rules file
+
+    Returns:
+        list: Rules in file order, the default rules if there is no file
+    """
+    if not os.path.exists(filename):
+        return [parse_rule(line) for line in DEFAULT_RULES]
+
+    rules = []
+    rules_file = open(filename, "r")
+    try:
+        for line_number, line in enumerate(rules_file, 1):
+            try:
+                rule = parse_rule(line)
+            except ValueError as error:
+                print("Ignoring pricing rule on line %d of %s: %s" % (line_number, filename, error))
+                continue
+            if rule is not None:
+                rules.append(rule)
+    finally:
+        rules_file.close()
+    return rules
+
+
+class PricingRules:
+    """
+    Rules active on one day, compiled into lookup tables.
+
+    For markup, discount and free offers there is a dictionary per
+    target and a sorted list of cost tiers, so finding the rule for a
+    product takes the same few lookups whatever the number of rules.
+    Bundles are found through a dictionary by product.
+    """
+
+    def __init__(self, rules, day, file_stamp=None):
+        """
+        Compiles the rules active on a day.
+
+        Parameters:
+            rules (list): Rules from read_rules, in file order
+            day (date): Day the rules are compiled for
+            file_stamp (tuple): Version of the rules file they were read from
+
+        Returns:
+            None
+        """
+        self.day = day
+        self.file_stamp = file_stamp
+        self.active = [rule for rule in rules
+                       if (rule["start"] is None or rule["start"] <= day) and
+                       (rule["end"] is None or day <= rule["end"])]
+
+        # Same active rules give the same stamp, so prices are kept
+        self.stamp = zlib.crc32("\n".join([rule["text"] for rule in self.active])
+                                .encode("utf-8"))
+
+        self.tables = {}
+        self.tiers = {}
+        for kind in ("markup", "discount", "free"):
+            self.tables[kind] = {"product": {}, "brand": {}, "origin": {}, "all": {}}
+            tiers = {}
+            for rule in self.active:
+                if rule["kind"] != kind:
+                    continue
+                # Later lines replace earlier ones with the same key
+                if rule["target"] == "cost":
+                    tiers[rule["key"]] = rule["value"]
+                else:
+                    self.tables[kind][rule["target"]][rule["key"]] = rule["value"]
+            self.tiers[kind] = (sorted(tiers), [tiers[cost] for cost in sorted(tiers)])
+
+        self.bundles = {}
+        for rule in self.active:
+            if rule["kind"] == "bundle":
+                bundle = (rule["key"], rule["value"] / 100.0)
+                for product_id in set(rule["key"]):
+                    self.bundles.setdefault(product_id, []).append(bundle)
+
+    def find(self, kind, product_id, brand, origin, cost, default=None):
+        """
+        Finds the value of the most specific rule of a kind for a product.
+
+        Parameters:
+            kind (str): "markup", "discount" or "free"
+            product_id (int): Product ID
+            brand (str): Brand name
+            origin (str): Country of origin
+            cost (float): Cost price per unit
+            default: Value when no rule applies
+
+        Returns:
+            Value of the rule, or default
+        """
+        tables = self.tables[kind]
+        if product_id in tables["product"]:
+            return tables["product"][product_id]
+        if brand.lower() in tables["brand"]:
+            return tables["brand"][brand.lower()]
+        if origin.lower() in tables["origin"]:
+            return tables["origin"][origin.lower()]
+
+        # Highest tier the cost reaches
+        tier_costs, tier_values = self.tiers[kind]
+        position = bisect.bisect_right(tier_costs, cost)
+        if position > 0:
+            return tier_values[position - 1]
+        return tables["all"].get("", default)
+
+    def unit_price(self, product_id, brand, origin, cost):
+        """
+        Works out the selling price of a product.
+
+        Parameters:
+            product_id (int): Product ID
+            brand (str): Brand name
+            origin (str): Country of origin
+            cost (float): Cost price per unit
+
+        Returns:
+            float: Selling price per unit after markup and discount
+        """
+        price = cost * self.find("markup", product_id, brand, origin, cost, 1.0)
+        discount = self.find("discount", product_id, brand, origin, cost, 0.0)
+        if discount:
+            price = price * (100.0 - discount) / 100.0
+        return price
+
+    def free_units(self, product_id, brand, origin, cost, quantity):
+        """
+        Works out how many free units come with a purchase.
+
+        Parameters:
+            product_id (int): Product ID
+            brand (str): Brand name
+            origin (str): Country of origin
+            cost (float): Cost price per unit
+            quantity (int): Units paid for
+
+        Returns:
+            int: Free units given by the offer, 0 if there is none
+        """
+        offer = self.find("free", product_id, brand, origin, cost)
+        if offer is None:
+            return 0
+        return quantity // offer[0] * offer[1]
+
+    def describe(self):
+        """
+        Describes the active promotions for invoices and the header.
+
+        Returns:
+            list: One line per free offer, discount and bundle
+        """
+        lines = []
+        for rule in self.active:
+            if rule["kind"] == "markup":
+                continue
+            if rule["target"] == "all":
+                applies = "all products"
+            elif rule["target"] == "cost":
+                applies = "products costing %s or more" % format_amount(rule["key"])
+            elif rule["kind"] == "bundle":
+                applies = "products " + " and ".join([str(key) for key in rule["key"]]) + \
+                          " bought together"
+            elif rule["target"] == "product":
+                applies = "product %d" % rule["key"]
+            else:
+                applies = rule["text"].split(",")[1].strip().partition(" ")[2] + " products"
+
+            if rule["kind"] == "free":
+                text = "Buy %d Get %d Free on %s" % (rule["value"][0], rule["value"][1], applies)
+            else:
+                text = "%s%% off %s" % (format_amount(rule["value"]), applies)
+            if rule["end"] is not None:
+                text += " until %s" % rule["end"].isoformat()
+            lines.append(text + "!")
+        return lines
+
+
+def format_amount(value):
+    """
+    Formats a number from a rule without a needless ".0".
+
+    Parameters:
+        value (float): Number
+
+    Returns:
+        str: Formatted number
+    """
+    if value == int(value):
+        return str(int(value))
+    return str(value)
+
+
+def get_file_stamp(filename):
+    """
+    Gets the version of the rules file.
+
+    Parameters:
+        filename (str): Name of rules file
+
+    Returns:
+        tuple: (modification time, size), or None if there is no file
+    """
+    try:
+        info = os.stat(filename)
+    except OSError:
+        return None
+    return info.st_mtime_ns, info.st_size
+
+
+def get_default_rules():
+    """
+    Gets the default rules, compiling them the first time.
+
+    Returns:
+        PricingRules: Standard markup and "Buy 3 Get 1 Free"
+    """
+    global default_rules
+    if default_rules is None:
+        default_rules = PricingRules([parse_rule(line) for line in DEFAULT_RULES],
+                                     datetime.date.today())
+    return default_rules
+
+
+def current_rules(filename="inventory.txt"):
+    """
+    Gets the compiled rules of an inventory, reading them the first time.
+
+    Parameters:
+        filename (str): Name of inventory file or database
+
+    Returns:
+        PricingRules: Rules in use
+    """
+    rules = active_rules.get(get_pricing_filename(filename))
+    if rules is None:
+        return check_pricing_rules(filename)
+    return rules
+
+
+def check_pricing_rules(filename="inventory.txt"):
+    """
+    Compiles the rules again if the day or the rules file has changed.
+
+    Parameters:
+        filename (str): Name of inventory file or database
+
+    Returns:
+        PricingRules: Rules in use
+    """
+    pricing_filename = get_pricing_filename(filename)
+    today = datetime.date.today()
+    file_stamp = get_file_stamp(pricing_filename)
+    with rules_lock:
+        rules = active_rules.get(pricing_filename)
+        if rules is None or rules.day != today or rules.file_stamp != file_stamp:
+            rules = PricingRules(read_rules(pricing_filename), today, file_stamp)
+            active_rules[pricing_filename] = rules
+        return rules
+
+
+def refresh_prices(inventory_data):
+    """
+    Works out selling prices again if the inventory's rules have changed.
+
+    Parameters:
+        inventory_data (Inventory): Product information
+
+    Returns:
+        PricingRules: Rules in use
+    """
+    rules = check_pricing_rules(inventory_data.filename)
+    inventory_data.rules = rules
+    if inventory_data.price_stamp != rules.stamp:
+        inventory_data.reprice()
+    return rules
+
+
+def free_units(inventory_data, product_id, quantity):
+    """
+    Works out how many free units come with a purchase.
+
+    Parameters:
+        inventory_data (Inventory): Product information
+        product_id (int): Product ID
+        quantity (int): Units paid for
+
+    Returns:
+        int: Free units given by the promotion
+    """
+    return inventory_data.rules.free_units(product_id, inventory_data.get_brand(product_id),
+                                           inventory_data.get_origin(product_id),
+                                           inventory_data.get_cost(product_id), quantity)
+
+
+def units_needed(inventory_data, product_id, quantity):
+    """
+    Works out how many units leave the shelf for a purchase.
+
+    Parameters:
+        inventory_data (Inventory): Product information
+        product_id (int): Product ID
+        quantity (int): Units paid for
+
+    Returns:
+        int: Paid units plus free units
+    """
+    return quantity + free_units(inventory_data, product_id, quantity)
+
+
+def selling_price(cost, product_id=0, brand="", origin="", filename="inventory.txt"):
+    """
+    Works out the selling price of a product.
+
+    Parameters:
+        cost (float): Cost price per unit
+        product_id (int): Product ID, 0 for rules that do not depend on it
+        brand (str): Brand name
+        origin (str): Country of origin
+        filename (str): Name of inventory file or database the rules belong to
+
+    Returns:
+        float: Selling price per unit
+    """
+    return current_rules(filename).unit_price(product_id, brand, origin, cost)
+
+
+def apply_bundles(rules, lines, paid):
+    """
+    Takes bundle discounts off the lines of one basket.
+
+    Parameters:
+        rules (PricingRules): Rules in use
+        lines (list): Priced lines of the basket
+        paid (dict): Units paid for per product ID in the basket
+
+    Returns:
+        float: Total discount given
+    """
+    # Only bundles with a product in the basket are looked at
+    bundles = {}
+    for product_id in paid:
+        for bundle in rules.bundles.get(product_id, ()):
+            bundles[id(bundle)] = bundle
+
+    if not bundles:
+        return 0.0
+
+    # Each product's share comes off its first line
+    first_lines = {}
+    for line in lines:
+        first_lines.setdefault(line["id"], line)
+
+    total_discount = 0.0
+    for products, fraction in bundles.values():
+        sets = min([paid.get(product_id, 0) for product_id in products])
+        if sets <= 0:
+            continue
+        for product_id in products:
+            line = first_lines[product_id]
+            discount = line["price"] * sets * fraction
+            line["amount"] -= discount
+            total_discount += discount
+    return total_discount
+
+
+def price_baskets(inventory_data, baskets):
+    """
+    Prices many baskets at once.
+
+    All items are flattened into columns first, so each step of the
+    calculation runs over whole columns instead of one item at a time.
+
+    Parameters:
+        inventory_data (Inventory): Product information
+        baskets (list): List of baskets, each a list of dicts with id and quantity
+
+    Returns:
+        dict: "baskets" with lines and total for each basket,
+              "stock_used" with units leaving stock per product ID and
+              "grand_total" for all baskets
+    """
+    rules = refresh_prices(inventory_data)
+
+    # Flatten baskets into columns
+    basket_index = []
+    product_ids = []
+    quantities = []
+    for number, items in enumerate(baskets):
+        for item in items:
+            basket_index.append(number)
+            product_ids.append(item["id"])
+            quantities.append(item["quantity"])
+
+    # Apply the offers column by column, prices already include markup and discount
+    selling_prices = inventory_data.prices
+    brands = inventory_data.brands
+    origins = inventory_data.origins
+    costs = inventory_data.costs
+    free = [rules.free_units(product_id, brands[product_id], origins[product_id],
+                             costs[product_id], qty)
+            for product_id, qty in zip(product_ids, quantities)]
+    prices = [selling_prices[product_id] for product_id in product_ids]
+    amounts = list(map(operator.mul, prices, quantities))
+    units = list(map(operator.add, quantities, free))
+
+    # Group lines back into their baskets
+    results = [{"lines": [], "total": 0} for _ in baskets]
+    stock_used = {}
+    for row in range(len(product_ids)):
+        result = results[basket_index[row]]
+        product_id = product_ids[row]
+        result["lines"].append({
+            "id": product_id,
+            "quantity": quantities[row],
+            "free": free[row],
+            "price": prices[row],
+            "amount": amounts[row],
+            "units": units[row]
+        })
+        result["total"] += amounts[row]
+        stock_used[product_id] = stock_used.get(product_id, 0) + units[row]
+
+    grand_total = sum(amounts)
+    if rules.bundles:
+        for result in results:
+            paid = {}
+            for line in result["lines"]:
+                paid[line["id"]] = paid.get(line["id"], 0) + line["quantity"]
+            discount = apply_bundles(rules, result["lines"], paid)
+            result["total"] -= discount
+            grand_total -= discount
+
+    return {
+        "baskets": results,
+        "stock_used": stock_used,
+        "grand_total": grand_total
+    }
+
+
+def price_basket(inventory_data, items):
+    """
+    Prices a single basket.
+
+    Parameters:
+        inventory_data (Inventory): Product information
+        items (list): List of dicts with id and quantity
+
+    Returns:
+        dict: "lines", "total" and "stock_used" for the basket
+    """
+    priced = price_baskets(inventory_data, [items])
+    basket = priced["baskets"][0]
+    basket["stock_used"] = priced["stock_used"]
+    return basket
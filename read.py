@@ -2,54 +2,407 @@
 Inventory data loading module for WeCare Beauty system.
 """
 
+import mmap
+import os
+import zlib
+from array import array
+from inventory import Inventory
+from journal import (apply_journal_entries, get_compacting_filename, get_journal_changes,
+                     get_journal_filename, read_journal, replay_journal)
+from metrics import record_error, timed
+from pricing import check_pricing_rules
+from render import CatalogueRenderer, format_table_row
+from snapshot import (get_snapshot_filenames, load_binary_snapshot, parse_header,
+                      read_header_line, write_binary_snapshot)
 
-def get_inventory_data(filename="inventory.txt"):
+
+# Times a load is repeated when the file is replaced while it is read
+LOAD_ATTEMPTS = 3
+
+
+def parse_product_line(line):
     """
-    Loads inventory data from text file.
+    Splits one inventory file line into product fields.
 
     Parameters:
-        filename (str): Name of inventory file to read
+        line (str): Line from inventory file
 
     Returns:
-        list: List of product data where index corresponds to product ID
+        tuple: (name, brand, quantity, cost, origin), or None for a blank line.
+               Quantity and cost are None if they are not valid numbers.
+    """
+    data = [item.strip() for item in line.split(",")]
+
+    # Skip blank lines
+    if data == [""]:
+        return None
+
+    # Pad short lines so the product keeps its ID
+    while len(data) < 5:
+        data.append("")
+
+    # Convert stock and cost to numbers once
+    try:
+        quantity = int(data[2])
+        cost = float(data[3])
+    except ValueError:
+        quantity = None
+        cost = None
+
+    return data[0], data[1], quantity, cost, data[4]
+
+
+def iter_products(filename="inventory.txt"):
+    """
+    Reads products from an inventory file one line at a time.
+
+    Files with a snapshot header are checked against its product count
+    and checksum once the last line is read. Older files without a
+    header are read unchecked.
+
+    Parameters:
+        filename (str): Name of inventory file to read
+
+    Yields:
+        tuple: (name, brand, quantity, cost, origin) for each product
+
+    Raises:
+        ValueError: If the file does not match its header
     """
+    inventory_file = open(filename, "rb")
     try:
-        # Open inventory file
-        inventory_file = open(filename, "r")
-        file_content = inventory_file.readlines()
+        header = None
+        checksum = 0
+        product_count = 0
+        for line_number, raw_line in enumerate(inventory_file, 1):
+            line_content = raw_line.decode("utf-8")
+            if line_number == 1:
+                header = parse_header(line_content)
+                if header is not None:
+                    continue
+            if header is not None:
+                checksum = zlib.crc32(raw_line, checksum)
+
+            product = parse_product_line(line_content)
+            if product is None:
+                continue
+            product_count += 1
+
+            if product[2] is None:
+                print("Invalid stock or cost on line " + str(line_number) + " of " + filename)
+                product = (product[0], product[1], 0, 0.0, product[4])
+
+            yield product
+
+        # A torn or partly overwritten file fails here
+        if header is not None and (header["products"] != product_count or
+                                   header["crc32"] != checksum):
+            raise ValueError("Inventory file '%s' is damaged: %d of %d products, checksum %08x"
+                             " instead of %08x" % (filename, product_count, header["products"],
+                                                   checksum, header["crc32"]))
+    finally:
         inventory_file.close()
 
-        # Create inventory list
-        inventory_data = []
 
-        # Add placeholder at position 0 so IDs start at 1
-        inventory_data.append(None)
+@timed("inventory_load")
+def get_inventory_data(filename="inventory.txt"):
+    """
+    Loads inventory data from text file and its stock journal.
 
-        # Process each line in file
-        for line_content in file_content:
-            # Remove newline and split by comma
-            data = line_content.replace("\n", "").split(",")
+    The binary copy of the file is used when it matches, so the text is
+    only parsed after it has changed outside this program. If the file
+    is damaged, the newest older snapshot that is not is loaded instead.
+    Sample data is only written when there is no inventory file at all.
 
-            # Clean whitespace from each item
-            clean_data = []
-            for item in data:
-                # Remove leading space
-                if len(item) > 0 and item[0] == ' ':
-                    item = item[1:]
-                # Remove trailing space
-                if len(item) > 0 and item[-1] == ' ':
-                    item = item[:-1]
-                clean_data.append(item)
+    Parameters:
+        filename (str): Name of inventory file to read
 
-            # Add to inventory list
-            inventory_data.append(clean_data)
+    Returns:
+        Inventory: Product data where product IDs start at 1
 
-        return inventory_data
+    Raises:
+        ValueError: If every snapshot of the file is damaged
+    """
+    for attempt in range(LOAD_ATTEMPTS):
+        inventory_data = load_inventory_file(filename)
 
-    except:
+        # A save or compaction may have replaced the file and dropped the
+        # journal it had folded in while this load was reading them
+        if get_file_stamp(filename) == inventory_data.snapshot_stamp:
+            break
+    return inventory_data
+
+
+def load_inventory_file(filename="inventory.txt"):
+    """
+    Loads the newest readable snapshot of an inventory and replays its journal.
+
+    Parameters:
+        filename (str): Name of inventory file to read
+
+    Returns:
+        Inventory: Product data where product IDs start at 1
+
+    Raises:
+        ValueError: If every snapshot of the file is damaged
+    """
+    snapshot_filenames = get_snapshot_filenames(filename)
+    if not snapshot_filenames:
         print("Inventory file '" + filename + "' not found. Creating new file with sample data.")
         create_default_inventory(filename)
-        return get_inventory_data(filename)  # Try again after creating file
+        snapshot_filenames = get_snapshot_filenames(filename)
+
+    for snapshot_filename in snapshot_filenames:
+        try:
+            # Note file versions first, so any later change is noticed
+            snapshot_stamp = get_file_stamp(filename)
+            journal_stamp = get_file_stamp(get_journal_filename(filename))
+
+            inventory_data = None
+            if snapshot_filename == filename:
+                inventory_data = load_binary_snapshot(filename)
+
+            if inventory_data is None:
+                # Create inventory, IDs start at 1
+                inventory_data = Inventory(check_pricing_rules(filename))
+
+                # Build the inventory in one pass over the file
+                for name, brand, quantity, cost, origin in iter_products(snapshot_filename):
+                    inventory_data.add_product(name, brand, quantity, cost, origin)
+
+                if snapshot_filename == filename:
+                    save_binary_copy(inventory_data, filename, snapshot_stamp)
+
+            inventory_data.filename = filename
+            inventory_data.snapshot_stamp = snapshot_stamp
+            inventory_data.journal_stamp = journal_stamp
+
+        except (OSError, ValueError) as error:
+            record_error("inventory_load")
+            print("Could not read '%s': %s" % (snapshot_filename, error))
+            continue
+
+        if snapshot_filename != filename:
+            print("Loaded older inventory file '%s'. Changes saved after it may be missing."
+                  % snapshot_filename)
+
+        # Apply changes recorded since the last snapshot
+        inventory_data.journal_offset = replay_journal(inventory_data, filename)
+
+        return inventory_data
+
+    # Leave the damaged files for repair rather than replacing them
+    print("No readable inventory file for '" + filename + "'.")
+    raise ValueError("Every snapshot of '%s' is damaged" % filename)
+
+
+def save_binary_copy(inventory_data, filename, snapshot_stamp):
+    """
+    Writes the binary copy of a text file that was just parsed.
+
+    Nothing is written for files without a header, or if the file was
+    replaced while it was being read.
+
+    Parameters:
+        inventory_data (Inventory): Products read from the file
+        filename (str): Name of inventory file
+        snapshot_stamp (tuple): File version from get_file_stamp before reading
+
+    Returns:
+        None
+    """
+    header_line = read_header_line(filename)
+    if header_line is None or get_file_stamp(filename) != snapshot_stamp:
+        return
+    try:
+        write_binary_snapshot(inventory_data, filename, header_line)
+    except OSError:
+        record_error("binary_save")
+
+
+def get_file_stamp(filename):
+    """
+    Gets a value that changes whenever a file is replaced or rewritten.
+
+    Parameters:
+        filename (str): Name of file
+
+    Returns:
+        tuple: (inode, modification time, size), or None if there is no file
+    """
+    try:
+        info = os.stat(filename)
+    except OSError:
+        return None
+    return info.st_ino, info.st_mtime_ns, info.st_size
+
+
+def refresh_inventory(inventory_data):
+    """
+    Catches up with changes made by other counters.
+
+    Normally only journal entries written since the last refresh are read.
+    If the inventory file was replaced or the journal was compacted, the
+    whole inventory is reloaded. Should be called while holding the
+    inventory lock.
+
+    Parameters:
+        inventory_data (Inventory): Product information to update in place
+
+    Returns:
+        None
+    """
+    filename = inventory_data.filename
+    journal_filename = get_journal_filename(filename)
+    journal_stamp = get_file_stamp(journal_filename)
+
+    # A journal moved aside for compaction since the last look holds
+    # changes this inventory has not seen
+    unseen_journal = (inventory_data.journal_stamp is None and
+                      os.path.exists(get_compacting_filename(filename)))
+
+    if get_file_stamp(filename) == inventory_data.snapshot_stamp and not unseen_journal:
+        if journal_stamp is None and inventory_data.journal_stamp is None:
+            # Nothing journalled yet
+            return
+
+        if journal_stamp is not None and (
+                inventory_data.journal_stamp is None or
+                journal_stamp[0] == inventory_data.journal_stamp[0]):
+            # Same journal (or a new one), read only what was added
+            if inventory_data.journal_stamp is None:
+                inventory_data.journal_offset = 0
+            entries, offset = read_journal(journal_filename, inventory_data.journal_offset)
+            apply_journal_entries(inventory_data, entries)
+            inventory_data.journal_offset = offset
+            inventory_data.journal_stamp = journal_stamp
+            return
+
+    # Snapshot or journal was replaced, reload everything
+    fresh_data = get_inventory_data(filename)
+    for product_id in fresh_data.product_ids():
+        quantity = fresh_data.get_quantity(product_id)
+        cost = fresh_data.get_cost(product_id)
+        if not inventory_data.has_product(product_id):
+            inventory_data.add_product(fresh_data.get_name(product_id),
+                                       fresh_data.get_brand(product_id),
+                                       quantity, cost,
+                                       fresh_data.get_origin(product_id))
+            continue
+        if inventory_data.get_quantity(product_id) != quantity:
+            inventory_data.set_quantity(product_id, quantity)
+        if inventory_data.get_cost(product_id) != cost:
+            inventory_data.set_cost(product_id, cost)
+
+    inventory_data.snapshot_stamp = fresh_data.snapshot_stamp
+    inventory_data.journal_stamp = fresh_data.journal_stamp
+    inventory_data.journal_offset = fresh_data.journal_offset
+
+
+class MappedInventory:
+    """
+    Read-only view of an inventory file for looking up single products.
+
+    The file is memory-mapped and only scanned as far as the highest
+    product ID asked for, so a lookup does not parse the whole file.
+    Journalled stock and cost changes are applied to the result.
+    """
+
+    def __init__(self, filename="inventory.txt"):
+        """
+        Opens an inventory file for lookups.
+
+        Parameters:
+            filename (str): Name of inventory file to read
+
+        Returns:
+            None
+        """
+        self.file = open(filename, "rb")
+        if os.fstat(self.file.fileno()).st_size > 0:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = b""
+
+        # Start offset of each product line, position 0 is unused
+        self.offsets = array("q", [0])
+        self.scan_position = 0
+        self.changes = get_journal_changes(filename)
+
+    def scan_to(self, product_id):
+        """
+        Finds line offsets up to a product ID.
+
+        Parameters:
+            product_id (int): Highest product ID needed, None for all
+
+        Returns:
+            None
+        """
+        data_size = len(self.data)
+        while ((product_id is None or len(self.offsets) <= product_id)
+               and self.scan_position < data_size):
+            line_end = self.data.find(b"\n", self.scan_position)
+            if line_end == -1:
+                line_end = data_size
+
+            # Blank lines and the snapshot header do not get a product ID
+            line = self.data[self.scan_position:line_end]
+            if line.strip() and not (self.scan_position == 0 and line.startswith(b"#")):
+                self.offsets.append(self.scan_position)
+            self.scan_position = line_end + 1
+
+    def __len__(self):
+        """
+        Gets the number of products, scanning the rest of the file.
+
+        Returns:
+            int: Number of products
+        """
+        self.scan_to(None)
+        return len(self.offsets) - 1
+
+    def get_product(self, product_id):
+        """
+        Looks up one product by ID.
+
+        Parameters:
+            product_id (int): Product ID
+
+        Returns:
+            tuple: (name, brand, quantity, cost, origin), or None if not found
+        """
+        self.scan_to(product_id)
+        if product_id < 1 or product_id >= len(self.offsets):
+            return None
+
+        start = self.offsets[product_id]
+        line_end = self.data.find(b"\n", start)
+        if line_end == -1:
+            line_end = len(self.data)
+
+        name, brand, quantity, cost, origin = parse_product_line(
+            self.data[start:line_end].decode("utf-8"))
+        if quantity is None:
+            quantity = 0
+            cost = 0.0
+
+        # Journalled changes are newer than the file
+        if product_id in self.changes:
+            quantity, cost = self.changes[product_id]
+
+        return name, brand, quantity, cost, origin
+
+    def close(self):
+        """
+        Closes the mapped file.
+
+        Returns:
+            None
+        """
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
 
 
 def create_default_inventory(filename="inventory.txt"):
@@ -81,34 +434,25 @@ def create_default_inventory(filename="inventory.txt"):
         print("Could not create inventory file")
 
 
-def print_inventory(inventory_data):
+def print_inventory(inventory_data, page=1, renderer=None):
     """
-    Displays inventory data in a formatted table.
+    Displays inventory data in a formatted table, one page at a time.
 
     Parameters:
-        inventory_data (list): List of product information
+        inventory_data (Inventory): Product information
+        page (int): Page number to show
+        renderer (CatalogueRenderer): Table renderer whose row cache is kept
+                                      between calls, built if not given
 
     Returns:
-        None
+        int: Page number that was shown
     """
     # Print table header
     print("#" * 80)
     print("ID\t\tName\t\t\tBrand\t\tQty\tCost Price\tSelling Price\tOrigin")
     print("#" * 80)
 
-    # Print each product row
-    for index in range(1, len(inventory_data)):
-        try:
-            product = inventory_data[index]
-
-            # Calculate selling price (200% markup)
-            cost = float(product[3])
-            selling_price = cost * 3
-
-            # Print formatted row
-            print("%s\t%s\t\t%s\t\t%s\t%s\t\t%.2f\t\t%s" %
-                  (str(index), product[0], product[1], product[2],
-                   product[3], selling_price, product[4]))
-
-        except:
-            print("Error displaying product " + str(index))
\ No newline at end of file
+    # Print product rows
+    if renderer is None:
+        renderer = CatalogueRenderer(inventory_data, format_table_row)
+    return renderer.print_page(page)
@@ -0,0 +1,353 @@
+"""
+History rebuilding module for WeCare Beauty system.
+Reads existing invoice and purchase form files into one SQLite database.
+
+Files are parsed in parallel by a pool of processes, and the results are
+saved by this process in batches. Each saved file is noted with its size
+and modification time, so a run that was interrupted carries on where it
+stopped and later runs only read new or changed files, and files that
+could not be read before.
+
+Usage:
+    python reindex.py [DIRECTORY ...]
+"""
+
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Database the history is rebuilt into
+HISTORY_DB = "history.db"
+
+# Files parsed by one worker task, and saved in one database transaction
+CHUNK_SIZE = 200
+
+# Width of the product and brand columns in documents
+COLUMN_WIDTH = 15
+
+
+def is_document_file(name):
+    """
+    Checks whether a file name belongs to an invoice or purchase form.
+
+    Parameters:
+        name (str): File name without directory
+
+    Returns:
+        bool: True for a document file
+    """
+    return (name.startswith("INV-") or name.startswith("PO-")) and name.endswith(".txt")
+
+
+def iter_document_files(directories):
+    """
+    Finds document files in directories and their subdirectories.
+
+    Parameters:
+        directories (list): Directories to search
+
+    Yields:
+        tuple: (path, size, modification time in nanoseconds)
+    """
+    pending = list(directories)
+    while pending:
+        directory = pending.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            print("Cannot read directory " + directory)
+            continue
+
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                pending.append(entry.path)
+            elif is_document_file(entry.name):
+                stat = entry.stat()
+                yield entry.path, stat.st_size, stat.st_mtime_ns
+
+
+def split_product_brand(text):
+    """
+    Splits the product and brand columns of an item line.
+
+    Both columns are 15 characters wide, but a longer product name pushes
+    the brand along, so the split falls on the first space from column 15.
+
+    Parameters:
+        text (str): Item line without its number columns
+
+    Returns:
+        tuple: (product, brand)
+    """
+    split_at = text.find(" ", COLUMN_WIDTH)
+    if split_at == -1:
+        return text.strip(), ""
+    return text[:split_at].strip(), text[split_at:].strip()
+
+
+def parse_document(path):
+    """
+    Reads an invoice or purchase form file.
+
+    Parameters:
+        path (str): Path of document file
+
+    Returns:
+        dict: Number, kind, date, name, phone, shipping, total and item lines,
+              or None if the file is not a complete document
+    """
+    document = {"number": None, "kind": None, "date": None, "name": None,
+                "phone": None, "shipping": 0.0, "total": None, "lines": []}
+
+    file = open(path, "r")
+    try:
+        text_lines = file.read().split("\n")
+    finally:
+        file.close()
+
+    # Dashed lines split the header, column headings, items and totals
+    section = "header"
+    for text in text_lines:
+        if text.startswith("-" * 10):
+            if section == "header":
+                section = "headings"
+            elif section == "headings":
+                section = "items"
+            elif section == "items":
+                section = "totals"
+        elif section == "header":
+            if text.startswith("Invoice Number: "):
+                document["number"] = text[16:].strip()
+                document["kind"] = "SALE"
+            elif text.startswith("Form Number: "):
+                document["number"] = text[13:].strip()
+                document["kind"] = "RESTOCK"
+            elif text.startswith("Date: "):
+                document["date"] = text[6:].strip()
+            elif text.startswith("Customer Name: "):
+                document["name"] = text[15:].strip()
+            elif text.startswith("Supplier: "):
+                document["name"] = text[10:].strip()
+            elif text.startswith("Phone Number: "):
+                document["phone"] = text[14:].strip()
+        elif section == "headings":
+            # Column headings, product names can start with the same word
+            if text.strip() != "" and text.split()[:2] != ["Product", "Brand"]:
+                return None
+        elif section == "items":
+            if text.strip() == "":
+                continue
+            if text.startswith("Shipping Cost:"):
+                document["shipping"] = float(text.split()[-1])
+            elif document["kind"] == "SALE":
+                # Product, brand, quantity, free, price, amount
+                parts = text.rsplit(None, 4)
+                if len(parts) != 5:
+                    return None
+                product, brand = split_product_brand(parts[0])
+                document["lines"].append((product, brand, int(parts[1]), int(parts[2]),
+                                          float(parts[3]), float(parts[4])))
+            else:
+                # Product, brand, quantity, cost, amount
+                parts = text.rsplit(None, 3)
+                if len(parts) != 4:
+                    return None
+                product, brand = split_product_brand(parts[0])
+                document["lines"].append((product, brand, int(parts[1]), 0,
+                                          float(parts[2]), float(parts[3])))
+        elif text.startswith("Total Amount:"):
+            document["total"] = float(text.split()[-1])
+
+    # A file cut short has no total
+    if document["number"] is None or document["total"] is None:
+        return None
+    return document
+
+
+def parse_chunk(files):
+    """
+    Parses a group of files in a worker process.
+
+    Parameters:
+        files (list): Tuples of (path, size, modification time)
+
+    Returns:
+        list: Tuples of (path, size, modification time, document or None)
+    """
+    results = []
+    for path, size, mtime in files:
+        try:
+            document = parse_document(path)
+        except (OSError, ValueError, UnicodeDecodeError):
+            document = None
+        results.append((path, size, mtime, document))
+    return results
+
+
+def open_history(filename=HISTORY_DB):
+    """
+    Opens the history database, creating its tables if needed.
+
+    Parameters:
+        filename (str): Name of history database
+
+    Returns:
+        sqlite3.Connection: Open database
+    """
+    connection = sqlite3.connect(filename)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime INTEGER NOT NULL,
+            saved INTEGER NOT NULL
+        );
+
+        -- Old random numbers can repeat, so documents are keyed by path
+        CREATE TABLE IF NOT EXISTS documents (
+            path TEXT PRIMARY KEY,
+            number TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            date TEXT,
+            name TEXT,
+            phone TEXT,
+            shipping REAL NOT NULL,
+            total REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS documents_number ON documents (number);
+        CREATE INDEX IF NOT EXISTS documents_date ON documents (date);
+        CREATE INDEX IF NOT EXISTS documents_name ON documents (name);
+
+        CREATE TABLE IF NOT EXISTS document_lines (
+            path TEXT NOT NULL,
+            line INTEGER NOT NULL,
+            product TEXT NOT NULL,
+            brand TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            free INTEGER NOT NULL,
+            price REAL NOT NULL,
+            amount REAL NOT NULL,
+            PRIMARY KEY (path, line)
+        );
+        CREATE INDEX IF NOT EXISTS document_lines_product ON document_lines (product);
+    """)
+    return connection
+
+
+def save_chunk(connection, results):
+    """
+    Saves parsed documents and marks their files as done in one transaction.
+
+    Parameters:
+        connection (sqlite3.Connection): History database
+        results (list): Tuples from parse_chunk
+
+    Returns:
+        int: Number of documents saved
+    """
+    saved = 0
+    with connection:
+        for path, size, mtime, document in results:
+            connection.execute("DELETE FROM document_lines WHERE path = ?", (path,))
+            connection.execute("DELETE FROM documents WHERE path = ?", (path,))
+            if document is not None:
+                connection.execute(
+                    "INSERT INTO documents "
+                    "(path, number, kind, date, name, phone, shipping, total) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (path, document["number"], document["kind"], document["date"],
+                     document["name"], document["phone"], document["shipping"],
+                     document["total"]))
+                connection.executemany(
+                    "INSERT INTO document_lines "
+                    "(path, line, product, brand, quantity, free, price, amount) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(path, line_number) + line
+                     for line_number, line in enumerate(document["lines"], 1)])
+                saved += 1
+
+            # Unreadable files are noted too, and read again on the next run
+            connection.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime, saved) VALUES (?, ?, ?, ?)",
+                (path, size, mtime, int(document is not None)))
+    return saved
+
+
+def iter_chunks(files, chunk_size=CHUNK_SIZE):
+    """
+    Groups files into lists for the worker processes.
+
+    Parameters:
+        files: Iterable of file tuples
+        chunk_size (int): Files per group
+
+    Yields:
+        list: File tuples
+    """
+    chunk = []
+    for item in files:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def rebuild_history(directories=None, filename=HISTORY_DB, workers=None):
+    """
+    Reads every new or changed document file into the history database.
+
+    Parameters:
+        directories (list): Directories to search, None for the current
+                            directory (which holds inventory.txt.documents)
+        filename (str): Name of history database
+        workers (int): Worker processes, None for one per processor
+
+    Returns:
+        dict: Counts of files found, skipped, saved and unreadable
+    """
+    if directories is None:
+        directories = ["."]
+
+    connection = open_history(filename)
+    summary = {"found": 0, "skipped": 0, "saved": 0, "unreadable": 0}
+    try:
+        # Files already saved and unchanged since
+        done = {}
+        for path, size, mtime in connection.execute(
+                "SELECT path, size, mtime FROM files WHERE saved = 1"):
+            done[path] = (size, mtime)
+
+        todo = []
+        for path, size, mtime in iter_document_files(directories):
+            summary["found"] += 1
+            if done.get(path) == (size, mtime):
+                summary["skipped"] += 1
+            else:
+                todo.append((path, size, mtime))
+
+        # Results arrive in order and each chunk is saved as soon as it is ready
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for results in executor.map(parse_chunk, iter_chunks(todo)):
+                saved = save_chunk(connection, results)
+                summary["saved"] += saved
+                summary["unreadable"] += len(results) - saved
+    finally:
+        connection.close()
+    return summary
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        result = rebuild_history(sys.argv[1:])
+    else:
+        result = rebuild_history()
+
+    print("Document files found: " + str(result["found"]))
+    print("Already up to date: " + str(result["skipped"]))
+    print("Documents saved: " + str(result["saved"]))
+    print("Files that could not be read: " + str(result["unreadable"]))
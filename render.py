@@ -0,0 +1,168 @@
+"""
+Catalogue display module for WeCare Beauty system.
+Shows the product list one page at a time and reuses formatted rows.
+"""
+
+from inventory import format_number
+
+
+# Products shown on one page
+PAGE_SIZE = 20
+
+
+def format_table_row(inventory_data, product_id):
+    """
+    Formats a product for the full inventory table, leaving out its stock.
+
+    Parameters:
+        inventory_data (Inventory): Product information
+        product_id (int): Product ID
+
+    Returns:
+        tuple: Text before and after the stock figure
+    """
+    return ("%s\t%s\t\t%s\t\t" %
+            (str(product_id), inventory_data.get_name(product_id),
+             inventory_data.get_brand(product_id)),
+            "\t%s\t\t%.2f\t\t%s" %
+            (format_number(inventory_data.get_cost(product_id)),
+             inventory_data.get_price(product_id), inventory_data.get_origin(product_id)))
+
+
+def format_stock_row(inventory_data, product_id):
+    """
+    Formats a product for the restock menu, leaving out its stock.
+
+    Parameters:
+        inventory_data (Inventory): Product information
+        product_id (int): Product ID
+
+    Returns:
+        tuple: Text before and after the stock figure
+    """
+    return ("%d. %s (%s) - Stock: " %
+            (product_id, inventory_data.get_name(product_id),
+             inventory_data.get_brand(product_id)),
+            " - Cost: %s" % format_number(inventory_data.get_cost(product_id)))
+
+
+def format_sale_row(inventory_data, product_id):
+    """
+    Formats a product for the sale menu, leaving out its stock.
+
+    Parameters:
+        inventory_data (Inventory): Product information
+        product_id (int): Product ID
+
+    Returns:
+        tuple: Text before and after the stock figure
+    """
+    return ("%d. %s (%s) - Price: $%.2f - Stock: " %
+            (product_id, inventory_data.get_name(product_id),
+             inventory_data.get_brand(product_id),
+             inventory_data.get_price(product_id)),
+            "")
+
+
+class CatalogueRenderer:
+    """
+    Paged product list with a cache of formatted rows.
+
+    Rows are only formatted when a page that shows them is displayed.
+    Everything but the stock figure is cached together with the cost and
+    selling price it was formatted for, so a cached row is only formatted
+    again after a restock or new pricing rules change them. Stock is
+    filled in on every display.
+    """
+
+    def __init__(self, inventory_data, format_row, page_size=PAGE_SIZE):
+        """
+        Creates a renderer for an inventory.
+
+        Parameters:
+            inventory_data (Inventory): Product information
+            format_row (function): Formats one product as text before and after its stock
+            page_size (int): Products shown on one page
+
+        Returns:
+            None
+        """
+        self.inventory_data = inventory_data
+        self.format_row = format_row
+        self.page_size = page_size
+        self.row_cache = {}
+
+    def render_row(self, product_id):
+        """
+        Gets the formatted row of a product, formatting it if needed.
+
+        Parameters:
+            product_id (int): Product ID
+
+        Returns:
+            str: Formatted row
+        """
+        key = (self.inventory_data.costs[product_id], self.inventory_data.prices[product_id])
+        cached = self.row_cache.get(product_id)
+        if cached is None or cached[0] != key:
+            cached = (key, self.format_row(self.inventory_data, product_id))
+            self.row_cache[product_id] = cached
+        before, after = cached[1]
+        return before + str(self.inventory_data.quantities[product_id]) + after
+
+    def iter_rows(self, first_id=1, last_id=None):
+        """
+        Produces formatted rows one at a time.
+
+        Parameters:
+            first_id (int): First product ID
+            last_id (int): Last product ID, None for the end of the inventory
+
+        Yields:
+            str: Formatted row
+        """
+        if last_id is None or last_id > len(self.inventory_data):
+            last_id = len(self.inventory_data)
+        for product_id in range(first_id, last_id + 1):
+            yield self.render_row(product_id)
+
+    def page_count(self):
+        """
+        Gets the number of pages.
+
+        Returns:
+            int: Number of pages, at least 1
+        """
+        return max(1, (len(self.inventory_data) + self.page_size - 1) // self.page_size)
+
+    def clamp_page(self, page):
+        """
+        Keeps a page number inside the valid range.
+
+        Parameters:
+            page (int): Page number starting at 1
+
+        Returns:
+            int: Valid page number
+        """
+        return min(max(page, 1), self.page_count())
+
+    def print_page(self, page):
+        """
+        Prints one page of products.
+
+        Parameters:
+            page (int): Page number starting at 1
+
+        Returns:
+            int: Page number that was printed
+        """
+        page = self.clamp_page(page)
+        first_id = (page - 1) * self.page_size + 1
+        last_id = first_id + self.page_size - 1
+
+        # One print call for the whole page
+        print("\n".join(self.iter_rows(first_id, last_id)))
+        if self.page_count() > 1:
+            print("Page %d of %d" % (page, self.page_count()))
+        return page
@@ -0,0 +1,431 @@
+"""
+Reorder module for WeCare Beauty system.
+Finds products that are running out and drafts purchase lists for them.
+
+Each product's days of cover is its stock divided by its recent sales
+per day. Products are kept in a heap ordered by days of cover, which is
+updated whenever a product's stock changes, so the most urgent products
+are always at the top. Only sales count towards the sales rate: they are
+read from the sales history, then from SALE events as they are published,
+so stock corrections and write-downs do not look like demand.
+
+Products have no supplier column, so suppliers are looked up by brand
+in the suppliers file next to the inventory ("Brand, Supplier" per line).
+Brands not listed there are ordered from a supplier of the same name.
+
+Usage:
+    python reorder.py [inventory.txt] [--order]
+"""
+
+import datetime
+import heapq
+import math
+import os
+import sys
+from docwriter import flush_documents
+from events import get_events_filename, read_events
+from numbering import close_allocators
+from reports import get_history_filename, parse_history_line
+from storage import open_storage
+from write import generate_purchase_form
+
+
+# Days of sales used to work out the sales rate
+VELOCITY_DAYS = 28
+
+# Products with less cover than this are reordered
+REORDER_COVER_DAYS = 7
+
+# Stock a reorder brings a product up to, in days of cover
+TARGET_COVER_DAYS = 30
+
+# Smallest quantity ordered of a product
+MIN_ORDER_QUANTITY = 10
+
+
+def get_suppliers_filename(filename="inventory.txt"):
+    """
+    Gets the name of the brand to supplier list of an inventory.
+
+    Parameters:
+        filename (str): Name of inventory file or database
+
+    Returns:
+        str: Name of suppliers file
+    """
+    return filename + ".suppliers"
+
+
+def load_suppliers(filename):
+    """
+    Reads which supplier each brand is ordered from.
+
+    Parameters:
+        filename (str): Name of suppliers file
+
+    Returns:
+        dict: Supplier name by brand, empty if there is no file
+    """
+    suppliers = {}
+    if not os.path.exists(filename):
+        return suppliers
+
+    file = open(filename, "r")
+    try:
+        for line in file:
+            parts = line.strip().split(", ", 1)
+            if len(parts) == 2:
+                suppliers[parts[0]] = parts[1]
+    finally:
+        file.close()
+    return suppliers
+
+
+class ReorderEngine:
+    """
+    Products ordered by days of cover, kept up to date as stock changes.
+
+    Heap entries are (days of cover, product ID, version). When a product
+    changes, a new entry is pushed and older ones are skipped when they
+    reach the top, so each change costs O(log n).
+    """
+
+    def __init__(self, inventory_data, today=None):
+        """
+        Creates the engine, reading recent sales from the history file.
+
+        Parameters:
+            inventory_data (Inventory): Product information
+            today (date): Current day, None for today
+
+        Returns:
+            None
+        """
+        self.inventory_data = inventory_data
+        if today is None:
+            today = datetime.date.today()
+        self.day = today.toordinal()
+
+        # Units sold per product and day inside the window, and their sum
+        self.daily_units = {}
+        self.window_units = {}
+
+        # Sales published from here on are read from the event file
+        self.events_offset = 0
+        events_filename = get_events_filename(inventory_data.filename)
+        if os.path.exists(events_filename):
+            self.events_offset = os.path.getsize(events_filename)
+
+        self.heap = []
+        self.versions = {}
+
+        self.load_history()
+        for product_id in inventory_data.product_ids():
+            self.push(product_id)
+
+        inventory_data.add_listener(self.update_product)
+
+    def load_history(self):
+        """
+        Adds sales inside the window from the history file.
+
+        Returns:
+            None
+        """
+        history_filename = get_history_filename(self.inventory_data.filename)
+        if not os.path.exists(history_filename):
+            return
+
+        first_day = self.day - VELOCITY_DAYS + 1
+        history_file = open(history_filename, "r")
+        try:
+            for line in history_file:
+                entry = parse_history_line(line)
+                if entry is None or entry[0] != "SALE":
+                    continue
+                try:
+                    day = datetime.date.fromisoformat(entry[1]).toordinal()
+                except ValueError:
+                    continue
+                if first_day <= day <= self.day:
+                    # Free units leave the shelf too
+                    self.add_units(entry[3], day, entry[4] + entry[5])
+        finally:
+            history_file.close()
+
+    def add_units(self, product_id, day, units):
+        """
+        Adds sold units to a product's sales window.
+
+        Parameters:
+            product_id (int): Product ID
+            day (int): Day ordinal
+            units (int): Units taken out of stock
+
+        Returns:
+            None
+        """
+        days = self.daily_units.get(product_id)
+        if days is None:
+            days = {}
+            self.daily_units[product_id] = days
+        days[day] = days.get(day, 0) + units
+        self.window_units[product_id] = self.window_units.get(product_id, 0) + units
+
+    def velocity(self, product_id):
+        """
+        Gets a product's average sales per day over the window.
+
+        Parameters:
+            product_id (int): Product ID
+
+        Returns:
+            float: Units per day
+        """
+        return self.window_units.get(product_id, 0) / float(VELOCITY_DAYS)
+
+    def days_of_cover(self, product_id):
+        """
+        Gets how many days a product's stock lasts at its sales rate.
+
+        Parameters:
+            product_id (int): Product ID
+
+        Returns:
+            float: Days of cover, infinite for products that are not selling
+        """
+        stock = self.inventory_data.get_quantity(product_id)
+        if stock <= 0:
+            return 0.0
+        rate = self.velocity(product_id)
+        if rate <= 0:
+            return math.inf
+        return stock / rate
+
+    def push(self, product_id):
+        """
+        Puts a product's current days of cover on the heap.
+
+        Parameters:
+            product_id (int): Product ID
+
+        Returns:
+            None
+        """
+        version = self.versions.get(product_id, 0) + 1
+        self.versions[product_id] = version
+        heapq.heappush(self.heap, (self.days_of_cover(product_id), product_id, version))
+
+        # Rebuild once skipped entries outnumber live ones
+        if len(self.heap) > 2 * len(self.versions) + 64:
+            self.rebuild()
+
+    def rebuild(self):
+        """
+        Rebuilds the heap from current figures, dropping old entries.
+
+        Returns:
+            None
+        """
+        self.heap = [(self.days_of_cover(product_id), product_id, self.versions[product_id])
+                     for product_id in self.versions]
+        heapq.heapify(self.heap)
+
+    def update_product(self, product_id):
+        """
+        Moves a product in the heap after its stock changes.
+
+        Called by the inventory whenever stock or cost changes. The sale
+        behind a change is counted once its event is published.
+
+        Parameters:
+            product_id (int): Changed product ID
+
+        Returns:
+            None
+        """
+        self.push(product_id)
+
+    def read_sales(self):
+        """
+        Adds sales published since the last read, here or at other counters.
+
+        Returns:
+            None
+        """
+        first_day = self.day - VELOCITY_DAYS + 1
+        sold = set()
+        events, self.events_offset = read_events(self.inventory_data.filename,
+                                                 self.events_offset, None)
+        for offset, event in events:
+            if event.get("kind") != "SALE":
+                continue
+            try:
+                day = datetime.date.fromisoformat(event["time"][:10]).toordinal()
+                product_id = int(event["product"])
+                units = -int(event["quantity_change"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if first_day <= day <= self.day:
+                self.add_units(product_id, day, units)
+                sold.add(product_id)
+
+        for product_id in sold:
+            if self.inventory_data.has_product(product_id):
+                self.push(product_id)
+
+    def roll_window(self, today=None):
+        """
+        Drops sales that have left the window when the day changes.
+
+        Parameters:
+            today (date): Current day, None for today
+
+        Returns:
+            None
+        """
+        if today is None:
+            today = datetime.date.today()
+        day = today.toordinal()
+        if day == self.day:
+            return
+        self.day = day
+
+        first_day = day - VELOCITY_DAYS + 1
+        for product_id, days in self.daily_units.items():
+            for old_day in [d for d in days if d < first_day]:
+                self.window_units[product_id] -= days.pop(old_day)
+        self.rebuild()
+
+    def low_stock(self, limit=None, cover_days=REORDER_COVER_DAYS):
+        """
+        Gets the products with the least days of cover.
+
+        Parameters:
+            limit (int): Most products to return, None for all below cover_days
+            cover_days (float): Products with at least this cover are left out
+
+        Returns:
+            list: Tuples of (product ID, days of cover, stock, units per day),
+                  most urgent first
+        """
+        self.roll_window()
+        self.read_sales()
+        found = []
+        for cover, product_id, version in self.iter_heap():
+            if cover >= cover_days or (limit is not None and len(found) >= limit):
+                break
+            found.append((product_id, cover, self.inventory_data.get_quantity(product_id),
+                          self.velocity(product_id)))
+        return found
+
+    def iter_heap(self):
+        """
+        Goes through live heap entries in order without changing the heap.
+
+        Stale entries at the top are removed first, the rest are skipped.
+
+        Yields:
+            tuple: (days of cover, product ID, version)
+        """
+        while self.heap and self.heap[0][2] != self.versions.get(self.heap[0][1]):
+            heapq.heappop(self.heap)
+
+        # Walk the heap as a tree, always taking the smallest open entry
+        candidates = []
+        if self.heap:
+            candidates.append((self.heap[0], 0))
+        while candidates:
+            entry, position = heapq.heappop(candidates)
+            if entry[2] == self.versions.get(entry[1]):
+                yield entry
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < len(self.heap):
+                    heapq.heappush(candidates, (self.heap[child], child))
+
+    def reorder_quantity(self, product_id):
+        """
+        Gets how many units bring a product up to the target cover.
+
+        Parameters:
+            product_id (int): Product ID
+
+        Returns:
+            int: Units to order
+        """
+        target = math.ceil(self.velocity(product_id) * TARGET_COVER_DAYS)
+        needed = target - max(self.inventory_data.get_quantity(product_id), 0)
+        return max(needed, MIN_ORDER_QUANTITY)
+
+    def draft_purchase_lists(self, suppliers=None):
+        """
+        Drafts purchase lists for every product below the reorder cover.
+
+        Parameters:
+            suppliers (dict): Supplier by brand, None to read the suppliers file
+
+        Returns:
+            dict: Lists of items by supplier, in the format generate_purchase_form takes
+        """
+        if suppliers is None:
+            suppliers = load_suppliers(get_suppliers_filename(self.inventory_data.filename))
+
+        drafts = {}
+        for product_id, cover, stock, rate in self.low_stock():
+            brand = self.inventory_data.get_brand(product_id)
+            supplier = suppliers.get(brand, brand)
+            drafts.setdefault(supplier, []).append({
+                "id": product_id,
+                "quantity": self.reorder_quantity(product_id),
+                "new_cost": None})
+        return drafts
+
+
+def print_low_stock(engine, limit=5):
+    """
+    Prints the products that most need restocking.
+
+    Parameters:
+        engine (ReorderEngine): Reorder engine
+        limit (int): Most products to show
+
+    Returns:
+        None
+    """
+    products = engine.low_stock(limit)
+    if not products:
+        return
+    print("Low stock:")
+    for product_id, cover, stock, rate in products:
+        print("  %d. %s (%s) - Stock: %d - %.1f days left" %
+              (product_id, engine.inventory_data.get_name(product_id),
+               engine.inventory_data.get_brand(product_id), stock, cover))
+
+
+if __name__ == "__main__":
+    arguments = [argument for argument in sys.argv[1:] if argument != "--order"]
+    if arguments:
+        storage = open_storage(arguments[0])
+    else:
+        storage = open_storage()
+
+    inventory_data = storage.load()
+    reorder_engine = ReorderEngine(inventory_data)
+    purchase_lists = reorder_engine.draft_purchase_lists()
+
+    if not purchase_lists:
+        print("Nothing needs reordering.")
+
+    for supplier_name, items in sorted(purchase_lists.items()):
+        print("\nSupplier: " + supplier_name)
+        for item in items:
+            print("  %d. %s - order %d" % (item["id"], inventory_data.get_name(item["id"]),
+                                          item["quantity"]))
+
+        # Turn each draft into a purchase form
+        if "--order" in sys.argv:
+            generate_purchase_form(supplier_name, items, inventory_data)
+
+    flush_documents()
+    close_allocators()
+    storage.close()
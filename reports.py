@@ -0,0 +1,363 @@
+"""
+Sales reporting module for WeCare Beauty system.
+Keeps running totals of sales and restocks for quick reports.
+
+Every invoice and purchase form adds one line per product to a history
+file next to the inventory:
+    KIND, DATE, DOCUMENT, PRODUCT_ID, QUANTITY, FREE, AMOUNT, UNIT_COST
+
+SalesReport reads that file once and then only the lines added since,
+adding each to totals per month, product, brand and day. Reports are
+answered from those totals without reading any invoice files.
+
+Usage:
+    python reports.py [inventory.txt] [YYYY-MM]
+"""
+
+import datetime
+import heapq
+import os
+import sys
+
+
+# Products or brands shown in a top list
+TOP_LIMIT = 20
+
+
+def get_history_filename(filename="inventory.txt"):
+    """
+    Gets the name of the sales history file of an inventory.
+
+    Parameters:
+        filename (str): Name of inventory file or database
+
+    Returns:
+        str: Name of history file
+    """
+    return filename + ".history"
+
+
+def record_history(kind, document_num, when, lines, filename="inventory.txt"):
+    """
+    Adds the product lines of one document to the history file.
+
+    The lines are written with a single append so documents from several
+    counters do not mix.
+
+    Parameters:
+        kind (str): Transaction type (SALE or RESTOCK)
+        document_num (str): Invoice or purchase form number
+        when (datetime): Date and time of the document
+        lines (list): Tuples of (product ID, quantity, free units, amount, unit cost)
+        filename (str): Name of inventory file or database
+
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    try:
+        date_str = "%d-%02d-%02d" % (when.year, when.month, when.day)
+        text = ""
+        for product_id, quantity, free, amount, cost in lines:
+            text += "%s, %s, %s, %d, %d, %d, %r, %r\n" % (
+                kind, date_str, document_num, product_id, quantity, free,
+                float(amount), float(cost))
+
+        history_file = open(get_history_filename(filename), "a")
+        try:
+            history_file.write(text)
+        finally:
+            history_file.close()
+        return True
+    except:
+        print("Error saving sales history")
+        return False
+
+
+def parse_history_line(line):
+    """
+    Splits a history line into its values.
+
+    Parameters:
+        line (str): History line
+
+    Returns:
+        tuple: (kind, day, document, product ID, quantity, free, amount, unit cost),
+               or None if the line is not valid
+    """
+    parts = line.strip().split(", ")
+    if len(parts) != 8:
+        return None
+    try:
+        return (parts[0], parts[1], parts[2], int(parts[3]), int(parts[4]),
+                int(parts[5]), float(parts[6]), float(parts[7]))
+    except ValueError:
+        return None
+
+
+def new_month():
+    """
+    Creates empty totals for one month.
+
+    Sales totals are lists of [units sold, free units, revenue, cost of goods].
+    Restock totals are lists of [units bought, amount spent].
+
+    Returns:
+        dict: Totals by product, brand and day, and restocks by product
+    """
+    return {"products": {}, "brands": {}, "days": {}, "restocks": {}}
+
+
+def add_sale(totals, key, quantity, free, amount, cost):
+    """
+    Adds one sale line to a totals dictionary.
+
+    Parameters:
+        totals (dict): Totals to update
+        key: Product ID, brand or day
+        quantity (int): Units paid for
+        free (int): Units given free
+        amount (float): Amount paid
+        cost (float): Cost of all units handed over
+
+    Returns:
+        None
+    """
+    row = totals.get(key)
+    if row is None:
+        row = [0, 0, 0.0, 0.0]
+        totals[key] = row
+    row[0] += quantity
+    row[1] += free
+    row[2] += amount
+    row[3] += cost
+
+
+class SalesReport:
+    """
+    Sales and restock totals kept up to date from the history file.
+    """
+
+    def __init__(self, inventory_data):
+        """
+        Creates a report for an inventory, reading the history so far.
+
+        Parameters:
+            inventory_data (Inventory): Product information
+
+        Returns:
+            None
+        """
+        self.inventory_data = inventory_data
+        self.history_filename = get_history_filename(inventory_data.filename)
+        self.offset = 0
+        self.months = {}
+        self.update()
+
+    def update(self):
+        """
+        Adds history lines written since the last update.
+
+        Returns:
+            int: Number of lines added
+        """
+        if not os.path.exists(self.history_filename):
+            return 0
+
+        added = 0
+        history_file = open(self.history_filename, "rb")
+        try:
+            history_file.seek(self.offset)
+            for line in history_file:
+                # Stop at a line that is still being written
+                if not line.endswith(b"\n"):
+                    break
+                self.offset += len(line)
+                if self.add_line(line.decode("utf-8")):
+                    added += 1
+        finally:
+            history_file.close()
+        return added
+
+    def add_line(self, line):
+        """
+        Adds one history line to the totals.
+
+        Parameters:
+            line (str): History line
+
+        Returns:
+            bool: True if the line was valid
+        """
+        entry = parse_history_line(line)
+        if entry is None:
+            return False
+        kind, day, document_num, product_id, quantity, free, amount, cost = entry
+
+        month = day[:7]
+        totals = self.months.get(month)
+        if totals is None:
+            totals = new_month()
+            self.months[month] = totals
+
+        if kind == "RESTOCK":
+            row = totals["restocks"].setdefault(product_id, [0, 0.0])
+            row[0] += quantity
+            row[1] += amount
+            return True
+
+        # Free units cost as much as sold ones
+        cost_of_goods = cost * (quantity + free)
+        add_sale(totals["products"], product_id, quantity, free, amount, cost_of_goods)
+        add_sale(totals["days"], day, quantity, free, amount, cost_of_goods)
+        if self.inventory_data.has_product(product_id):
+            brand = self.inventory_data.get_brand(product_id)
+            add_sale(totals["brands"], brand, quantity, free, amount, cost_of_goods)
+        return True
+
+    def merged_totals(self, section, month=None):
+        """
+        Gets one kind of totals for a month or for all time.
+
+        Parameters:
+            section (str): "products", "brands", "days" or "restocks"
+            month (str): Month as YYYY-MM, None for all months
+
+        Returns:
+            dict: Totals by key
+        """
+        self.update()
+        if month is not None:
+            return self.months.get(month, new_month())[section]
+
+        merged = {}
+        for totals in self.months.values():
+            for key, row in totals[section].items():
+                if key in merged:
+                    merged[key] = [a + b for a, b in zip(merged[key], row)]
+                else:
+                    merged[key] = list(row)
+        return merged
+
+    def top_products(self, limit=TOP_LIMIT, month=None):
+        """
+        Gets the products with the most revenue.
+
+        Parameters:
+            limit (int): Number of products
+            month (str): Month as YYYY-MM, None for all months
+
+        Returns:
+            list: Tuples of (product ID, [units, free units, revenue, cost of goods])
+        """
+        totals = self.merged_totals("products", month)
+        return heapq.nlargest(limit, totals.items(), key=lambda item: item[1][2])
+
+    def top_brands(self, limit=TOP_LIMIT, month=None):
+        """
+        Gets the brands with the most revenue.
+
+        Parameters:
+            limit (int): Number of brands
+            month (str): Month as YYYY-MM, None for all months
+
+        Returns:
+            list: Tuples of (brand, [units, free units, revenue, cost of goods])
+        """
+        totals = self.merged_totals("brands", month)
+        return heapq.nlargest(limit, totals.items(), key=lambda item: item[1][2])
+
+    def daily_totals(self, month=None):
+        """
+        Gets sales totals for each day.
+
+        Parameters:
+            month (str): Month as YYYY-MM, None for all months
+
+        Returns:
+            list: Tuples of (day, [units, free units, revenue, cost of goods]) by date
+        """
+        return sorted(self.merged_totals("days", month).items())
+
+    def summary(self, month=None):
+        """
+        Gets overall sales and restock totals.
+
+        Parameters:
+            month (str): Month as YYYY-MM, None for all months
+
+        Returns:
+            dict: Units, free units, revenue, cost of goods, margin and restock spending
+        """
+        units = 0
+        free = 0
+        revenue = 0.0
+        cost = 0.0
+        for row in self.merged_totals("days", month).values():
+            units += row[0]
+            free += row[1]
+            revenue += row[2]
+            cost += row[3]
+
+        spent = 0.0
+        for row in self.merged_totals("restocks", month).values():
+            spent += row[1]
+
+        return {"units": units, "free_units": free, "revenue": revenue,
+                "cost_of_goods": cost, "margin": revenue - cost,
+                "restock_spending": spent}
+
+    def print_report(self, month=None):
+        """
+        Prints the summary and top products of a month.
+
+        Parameters:
+            month (str): Month as YYYY-MM, None for all months
+
+        Returns:
+            None
+        """
+        if month is None:
+            print("Sales report for all months")
+        else:
+            print("Sales report for " + month)
+        print("-" * 80)
+
+        totals = self.summary(month)
+        print("Units sold: %d (free: %d)" % (totals["units"], totals["free_units"]))
+        print("Revenue: %.2f" % totals["revenue"])
+        print("Cost of goods: %.2f" % totals["cost_of_goods"])
+        print("Margin: %.2f" % totals["margin"])
+        print("Restock spending: %.2f" % totals["restock_spending"])
+
+        print("-" * 80)
+        print("%-5s %-20s %-15s %-6s %-6s %-12s %-12s" %
+              ("ID", "Product", "Brand", "Units", "Free", "Revenue", "Margin"))
+        for product_id, row in self.top_products(TOP_LIMIT, month):
+            if self.inventory_data.has_product(product_id):
+                name = self.inventory_data.get_name(product_id)
+                brand = self.inventory_data.get_brand(product_id)
+            else:
+                name = "Unknown"
+                brand = ""
+            print("%-5d %-20s %-15s %-6d %-6d %-12.2f %-12.2f" %
+                  (product_id, name, brand, row[0], row[1], row[2], row[2] - row[3]))
+
+
+if __name__ == "__main__":
+    # Imported here because storage imports write, which imports this module
+    from storage import open_storage
+
+    if len(sys.argv) > 1:
+        storage = open_storage(sys.argv[1])
+    else:
+        storage = open_storage()
+
+    # This month unless another is given
+    if len(sys.argv) > 2:
+        report_month = sys.argv[2]
+    else:
+        today = datetime.date.today()
+        report_month = "%d-%02d" % (today.year, today.month)
+
+    SalesReport(storage.load()).print_report(report_month)
+    storage.close()
@@ -0,0 +1,157 @@
+"""
+Product search module for WeCare Beauty system.
+Finds products by name, brand or origin without listing the whole catalogue.
+"""
+
+
+# Longest name prefix kept in the index; longer words are checked directly
+MAX_PREFIX = 12
+
+
+def name_words(text):
+    """
+    Splits text into lower case words for searching.
+
+    Parameters:
+        text (str): Product name or search text
+
+    Returns:
+        list: Lower case words
+    """
+    return text.lower().split()
+
+
+class ProductIndex:
+    """
+    Search indexes over an inventory.
+
+    Brand and origin are hash indexes on the whole lower case value.
+    Product names are indexed by every prefix of every word, so a search
+    for "vit ser" finds "Vitamin C Serum" with a few dictionary lookups.
+    The index follows the inventory and picks up products as they are added.
+    """
+
+    def __init__(self, inventory_data):
+        """
+        Builds the indexes for every product in an inventory.
+
+        Parameters:
+            inventory_data (Inventory): Product information
+
+        Returns:
+            None
+        """
+        self.inventory_data = inventory_data
+        self.brand_index = {}
+        self.origin_index = {}
+        self.prefix_index = {}
+        self.indexed = set()
+
+        for product_id in inventory_data.product_ids():
+            self.update_product(product_id)
+
+        # Keep up to date with later changes
+        inventory_data.add_listener(self.update_product)
+
+    def update_product(self, product_id):
+        """
+        Adds a product to the indexes if it is not indexed yet.
+
+        Stock and cost changes do not affect the indexes, so products
+        that are already indexed are skipped.
+
+        Parameters:
+            product_id (int): Product ID
+
+        Returns:
+            None
+        """
+        if product_id in self.indexed:
+            return
+        self.indexed.add(product_id)
+
+        brand = self.inventory_data.get_brand(product_id).lower()
+        self.brand_index.setdefault(brand, set()).add(product_id)
+
+        origin = self.inventory_data.get_origin(product_id).lower()
+        self.origin_index.setdefault(origin, set()).add(product_id)
+
+        for word in name_words(self.inventory_data.get_name(product_id)):
+            for length in range(1, min(len(word), MAX_PREFIX) + 1):
+                self.prefix_index.setdefault(word[:length], set()).add(product_id)
+
+    def find_by_brand(self, brand):
+        """
+        Finds products of a brand.
+
+        Parameters:
+            brand (str): Brand name, any case
+
+        Returns:
+            list: Sorted product IDs
+        """
+        return sorted(self.brand_index.get(brand.strip().lower(), ()))
+
+    def find_by_origin(self, origin):
+        """
+        Finds products from a country of origin.
+
+        Parameters:
+            origin (str): Country of origin, any case
+
+        Returns:
+            list: Sorted product IDs
+        """
+        return sorted(self.origin_index.get(origin.strip().lower(), ()))
+
+    def find_by_name(self, text):
+        """
+        Finds products whose name has a word starting with each search word.
+
+        Parameters:
+            text (str): Search words, any case
+
+        Returns:
+            list: Sorted product IDs
+        """
+        words = name_words(text)
+        if not words:
+            return []
+
+        # Start from the rarest word to keep the intersection small
+        candidate_sets = []
+        for word in words:
+            candidate_sets.append(self.prefix_index.get(word[:MAX_PREFIX], set()))
+        candidate_sets.sort(key=len)
+
+        matches = set(candidate_sets[0])
+        for candidates in candidate_sets[1:]:
+            matches &= candidates
+
+        # Words longer than the indexed prefix need a direct check
+        long_words = [word for word in words if len(word) > MAX_PREFIX]
+        if long_words:
+            checked = set()
+            for product_id in matches:
+                product_words = name_words(self.inventory_data.get_name(product_id))
+                if all(any(candidate.startswith(word) for candidate in product_words)
+                       for word in long_words):
+                    checked.add(product_id)
+            matches = checked
+
+        return sorted(matches)
+
+    def search(self, text):
+        """
+        Finds products by name, brand or origin.
+
+        Parameters:
+            text (str): Search text
+
+        Returns:
+            list: Sorted product IDs
+        """
+        matches = set(self.find_by_name(text))
+        matches.update(self.brand_index.get(text.strip().lower(), ()))
+        matches.update(self.origin_index.get(text.strip().lower(), ()))
+        return sorted(matches)
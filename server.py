@@ -0,0 +1,538 @@
+"""
+HTTP server module for WeCare Beauty system.
+Lets counter tablets list, search, sell and restock over a local JSON API.
+
+The inventory stays loaded in this process. Requests are read by asyncio,
+and all inventory work runs on one worker thread, so no two requests
+change the inventory at once. Sales and restocks that arrive together
+are applied as one group transaction: one lock, one catch-up with other
+counters and one journal write or database commit for the whole group.
+
+Endpoints:
+    GET  /products?page=N        One page of products
+    GET  /products/ID            One product
+    GET  /search?q=TEXT          Products matching a name, brand or origin
+    GET  /customers/PHONE        A customer's details and invoices
+    GET  /customers?q=NAME       Customers whose name matches
+    POST /sales                  {"name", "phone", "items": [{"id", "quantity"}],
+                                  "shipping": true or false}
+    POST /restocks               {"name", "items": [{"id", "quantity", "new_cost"}]}
+    GET  /metrics                Metrics in Prometheus text format
+
+Usage:
+    python server.py [inventory.txt] [PORT]
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+from batch import STOCK_SHORTAGE, validate_order
+from customers import get_customer_registry
+from docwriter import flush_documents
+from metrics import (format_metrics, record_error, save_metrics,
+                     setup_metrics_from_environment)
+from numbering import close_allocators
+from render import PAGE_SIZE
+from search import ProductIndex
+from storage import open_storage
+from write import generate_invoice, generate_purchase_form, group_transaction, sync_inventory
+
+
+# Address and port the server listens on
+HOST = "127.0.0.1"
+PORT = 8080
+
+# Most sales and restocks applied in one group transaction
+MAX_GROUP_SIZE = 100
+
+# Longest time reads go without catching up with other counters, in seconds
+SYNC_INTERVAL = 0.5
+
+# Largest request body accepted, in bytes
+MAX_BODY_SIZE = 1024 * 1024
+
+# Longest wait for the next request on an open connection, in seconds
+IDLE_TIMEOUT = 30.0
+
+# Reason phrases for the status codes used
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found",
+               405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+               500: "Internal Server Error"}
+
+
+def product_json(inventory_data, product_id):
+    """
+    Gets a product as a JSON ready dictionary.
+
+    Parameters:
+        inventory_data (Inventory): Product information
+        product_id (int): Product ID
+
+    Returns:
+        dict: Product details
+    """
+    cost = inventory_data.get_cost(product_id)
+    return {"id": product_id, "name": inventory_data.get_name(product_id),
+            "brand": inventory_data.get_brand(product_id),
+            "quantity": inventory_data.get_quantity(product_id),
+            "cost": cost, "price": inventory_data.get_price(product_id),
+            "origin": inventory_data.get_origin(product_id)}
+
+
+def order_records(kind, payload):
+    """
+    Turns a JSON order into batch records so it is checked by the same rules.
+
+    Parameters:
+        kind (str): "sale" or "restock"
+        payload (dict): Request body
+
+    Returns:
+        list: (line number, record dict) tuples, as batch.validate_order takes
+    """
+    items = payload.get("items")
+    if not isinstance(items, list) or not items:
+        items = [{}]
+
+    records = []
+    for line_number, item in enumerate(items, 1):
+        if not isinstance(item, dict):
+            item = {}
+        record = {"type": kind, "name": payload.get("name"), "phone": payload.get("phone"),
+                  "product_id": item.get("id"), "quantity": item.get("quantity"),
+                  "new_cost": item.get("new_cost")}
+        if payload.get("shipping") is True:
+            record["shipping"] = "y"
+        records.append((line_number, record))
+    return records
+
+
+class InventoryServer:
+    """
+    JSON API over one loaded inventory.
+    """
+
+    def __init__(self, storage):
+        """
+        Loads the inventory and builds the search index.
+
+        Parameters:
+            storage: Opened inventory storage
+
+        Returns:
+            None
+        """
+        self.storage = storage
+        self.inventory_data = storage.load()
+        self.product_index = ProductIndex(self.inventory_data)
+        self.customer_registry = get_customer_registry(self.inventory_data.filename)
+        self.last_sync = time.monotonic()
+
+        # One thread does all inventory work
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inventory-worker")
+        self.orders = None
+
+    # Work done on the worker thread
+
+    def sync_if_stale(self):
+        """
+        Catches up with other counters if it has not been done lately.
+
+        Returns:
+            None
+        """
+        if time.monotonic() - self.last_sync >= SYNC_INTERVAL:
+            sync_inventory(self.inventory_data)
+            self.last_sync = time.monotonic()
+
+    def list_products(self, page):
+        """
+        Gets one page of products.
+
+        Parameters:
+            page (int): Page number starting at 1
+
+        Returns:
+            tuple: (status, response dict)
+        """
+        self.sync_if_stale()
+        pages = max(1, (len(self.inventory_data) + PAGE_SIZE - 1) // PAGE_SIZE)
+        page = min(max(page, 1), pages)
+        first_id = (page - 1) * PAGE_SIZE + 1
+        last_id = min(first_id + PAGE_SIZE - 1, len(self.inventory_data))
+        return 200, {"page": page, "pages": pages,
+                     "products": [product_json(self.inventory_data, product_id)
+                                  for product_id in range(first_id, last_id + 1)]}
+
+    def get_product(self, product_id):
+        """
+        Gets one product.
+
+        Parameters:
+            product_id (int): Product ID
+
+        Returns:
+            tuple: (status, response dict)
+        """
+        self.sync_if_stale()
+        if not self.inventory_data.has_product(product_id):
+            return 404, {"error": "product not found"}
+        return 200, product_json(self.inventory_data, product_id)
+
+    def search_products(self, text):
+        """
+        Finds products by name, brand or origin.
+
+        Parameters:
+            text (str): Search text
+
+        Returns:
+            tuple: (status, response dict)
+        """
+        self.sync_if_stale()
+        return 200, {"products": [product_json(self.inventory_data, product_id)
+                                  for product_id in self.product_index.search(text)]}
+
+    def get_customer(self, phone_number):
+        """
+        Gets a customer's details and invoices by phone number.
+
+        Parameters:
+            phone_number (str): Phone number in any format
+
+        Returns:
+            tuple: (status, response dict)
+        """
+        customer = self.customer_registry.find_by_phone(phone_number)
+        if customer is None:
+            return 404, {"error": "customer not found"}
+        response = dict(customer)
+        response["invoices"] = [{"date": day, "invoice": invoice_num, "amount": amount}
+                                for day, invoice_num, amount in
+                                self.customer_registry.get_invoices(phone_number)]
+        return 200, response
+
+    def search_customers(self, text):
+        """
+        Finds customers by name.
+
+        Parameters:
+            text (str): Search text
+
+        Returns:
+            tuple: (status, response dict)
+        """
+        return 200, {"customers": [dict(customer)
+                                   for customer in self.customer_registry.find_by_name(text)]}
+
+    def apply_order(self, kind, payload):
+        """
+        Validates and applies one sale or restock inside the open group.
+
+        Parameters:
+            kind (str): "sale" or "restock"
+            payload (dict): Request body
+
+        Returns:
+            tuple: (status, response dict)
+        """
+        order, error_kind, error = validate_order(order_records(kind, payload),
+                                                  self.inventory_data)
+        if error:
+            # Stock shortages are a conflict with other sales, not a bad request
+            if error_kind == STOCK_SHORTAGE:
+                return 409, {"error": error}
+            return 400, {"error": error}
+
+        if kind == "sale":
+            filename = generate_invoice(order["name"], order["phone"], order["items"],
+                                        self.inventory_data, shipping=order["shipping"])
+            # Stock was checked above under the same lock, so this is an error
+            if filename is None:
+                return 500, {"error": "invoice could not be created"}
+        else:
+            filename = generate_purchase_form(order["name"], order["items"],
+                                              self.inventory_data)
+            if filename is None:
+                return 500, {"error": "purchase form could not be created"}
+
+        return 200, {"document": filename,
+                     "stock": dict([(str(item["id"]),
+                                     self.inventory_data.get_quantity(item["id"]))
+                                    for item in order["items"]])}
+
+    def apply_orders(self, orders):
+        """
+        Applies a group of sales and restocks as one transaction.
+
+        Parameters:
+            orders (list): Tuples of (kind, payload)
+
+        Returns:
+            list: (status, response dict) for each order
+        """
+        results = []
+        try:
+            # Documents are still written; only their screen copy is silenced
+            with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+                with group_transaction(self.inventory_data):
+                    for kind, payload in orders:
+                        results.append(self.apply_order(kind, payload))
+            self.last_sync = time.monotonic()
+        except:
+            record_error("server")
+            results = [(500, {"error": "changes could not be saved"})] * len(orders)
+        return results
+
+    # Work done on the event loop
+
+    async def run_in_worker(self, function, *args):
+        """
+        Runs inventory work on the worker thread.
+
+        Parameters:
+            function (function): Work to run
+            args: Arguments for the function
+
+        Returns:
+            Result of the function
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.worker, function, *args)
+
+    async def order_writer(self):
+        """
+        Takes waiting orders off the queue and applies them in groups.
+
+        Returns:
+            None
+        """
+        while True:
+            group = [await self.orders.get()]
+            while len(group) < MAX_GROUP_SIZE and not self.orders.empty():
+                group.append(self.orders.get_nowait())
+
+            results = await self.run_in_worker(self.apply_orders,
+                                               [(kind, payload) for kind, payload, future in group])
+            for (kind, payload, future), result in zip(group, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def submit_order(self, kind, payload):
+        """
+        Queues a sale or restock and waits for its group to be saved.
+
+        Parameters:
+            kind (str): "sale" or "restock"
+            payload (dict): Request body
+
+        Returns:
+            tuple: (status, response dict)
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.orders.put((kind, payload, future))
+        return await future
+
+    async def route(self, method, target, body):
+        """
+        Handles one request.
+
+        Parameters:
+            method (str): HTTP method
+            target (str): Request path and query
+            body (bytes): Request body
+
+        Returns:
+            tuple: (status, response dict or str)
+        """
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        parts = [part for part in url.path.split("/") if part]
+
+        if parts == ["metrics"] and method == "GET":
+            return 200, format_metrics()
+
+        if parts == ["products"] and method == "GET":
+            try:
+                page = int(query.get("page", ["1"])[0])
+            except ValueError:
+                return 400, {"error": "page must be a number"}
+            return await self.run_in_worker(self.list_products, page)
+
+        if len(parts) == 2 and parts[0] == "products" and method == "GET":
+            if not parts[1].isdigit():
+                return 404, {"error": "product not found"}
+            return await self.run_in_worker(self.get_product, int(parts[1]))
+
+        if parts == ["search"] and method == "GET":
+            return await self.run_in_worker(self.search_products, query.get("q", [""])[0])
+
+        if parts == ["customers"] and method == "GET":
+            return await self.run_in_worker(self.search_customers, query.get("q", [""])[0])
+
+        if len(parts) == 2 and parts[0] == "customers" and method == "GET":
+            return await self.run_in_worker(self.get_customer, parts[1])
+
+        if parts in (["sales"], ["restocks"]):
+            if method != "POST":
+                return 405, {"error": "use POST"}
+            try:
+                payload = json.loads(body.decode("utf-8"))
+            except ValueError:
+                return 400, {"error": "body must be JSON"}
+            if not isinstance(payload, dict):
+                return 400, {"error": "body must be a JSON object"}
+
+            # Only true or false, so a string such as "no" is not taken as shipping
+            if not isinstance(payload.get("shipping", False), bool):
+                return 400, {"error": "shipping must be true or false"}
+            if parts == ["sales"]:
+                return await self.submit_order("sale", payload)
+            return await self.submit_order("restock", payload)
+
+        return 404, {"error": "not found"}
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serves requests on one connection until the client closes it.
+
+        Parameters:
+            reader (StreamReader): Incoming data
+            writer (StreamWriter): Outgoing data
+
+        Returns:
+            None
+        """
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+                if not request_line:
+                    break
+                parts = request_line.decode("latin-1").split()
+                if len(parts) != 3:
+                    break
+                method, target, version = parts
+
+                # Read headers
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, separator, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get("content-length", "0"))
+                except ValueError:
+                    length = -1
+                if length < 0 or length > MAX_BODY_SIZE:
+                    await self.send_response(writer, 413, {"error": "body too large"}, False)
+                    break
+                body = await reader.readexactly(length)
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                if version == "HTTP/1.0":
+                    keep_alive = headers.get("connection", "").lower() == "keep-alive"
+
+                try:
+                    status, response = await self.route(method, target, body)
+                except:
+                    record_error("server")
+                    status, response = 500, {"error": "internal error"}
+                await self.send_response(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def send_response(self, writer, status, response, keep_alive):
+        """
+        Writes one HTTP response.
+
+        Parameters:
+            writer (StreamWriter): Outgoing data
+            status (int): HTTP status code
+            response: Dictionary sent as JSON, or text sent as is
+            keep_alive (bool): Whether the connection stays open
+
+        Returns:
+            None
+        """
+        if isinstance(response, str):
+            body = response.encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body = json.dumps(response).encode("utf-8")
+            content_type = "application/json"
+
+        if keep_alive:
+            connection = "keep-alive"
+        else:
+            connection = "close"
+        head = ("HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n"
+                "Connection: %s\r\n\r\n" % (status, STATUS_TEXT.get(status, ""),
+                                            content_type, len(body), connection))
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def serve(self, host=HOST, port=PORT):
+        """
+        Runs the server until it is cancelled.
+
+        Parameters:
+            host (str): Address to listen on
+            port (int): Port to listen on
+
+        Returns:
+            None
+        """
+        self.orders = asyncio.Queue()
+        writer_task = asyncio.create_task(self.order_writer())
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print("Serving inventory on http://%s:%d" % (host, port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            writer_task.cancel()
+
+    def close(self):
+        """
+        Waits for queued documents and releases the storage.
+
+        Returns:
+            None
+        """
+        self.worker.shutdown()
+        flush_documents()
+        close_allocators()
+        self.storage.close()
+        save_metrics()
+
+
+if __name__ == "__main__":
+    setup_metrics_from_environment()
+
+    if len(sys.argv) > 1:
+        inventory_server = InventoryServer(open_storage(sys.argv[1]))
+    else:
+        inventory_server = InventoryServer(open_storage())
+
+    if len(sys.argv) > 2:
+        server_port = int(sys.argv[2])
+    else:
+        server_port = PORT
+
+    try:
+        asyncio.run(inventory_server.serve(HOST, server_port))
+    except KeyboardInterrupt:
+        print("Server stopped")
+    finally:
+        inventory_server.close()
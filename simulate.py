@@ -0,0 +1,513 @@
+"""
+Load simulator for WeCare Beauty system.
+Runs several counters at once to find how many the system can serve.
+
+Each counter runs the real sale and restock screens (operation.sell_items
+and operation.restock_items) with answers typed by a script instead of a
+person. Popular products are chosen far more often than others (a Zipf
+curve), and most baskets hold one or two products. Stock starts low, so
+counters compete for the same units and popular products need restocks.
+
+After the run the final stock of every product is checked against the
+sales and restocks in the history file, to catch lost updates and
+overselling. Every storage backend is simulated in a fresh temporary
+directory, so real files are never touched.
+
+Usage:
+    python simulate.py [COUNTERS] [TRANSACTIONS] [--processes] [OUTPUT_FILE]
+
+TRANSACTIONS is the number of sales and restocks per counter. Counters
+are threads unless --processes is given.
+"""
+
+import builtins
+import contextlib
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from benchmark import summarize, write_synthetic_inventory
+from docwriter import flush_documents
+from events import read_events
+from numbering import close_allocators
+from operation import restock_items, sell_items
+from read import get_inventory_data
+from render import CatalogueRenderer, format_sale_row, format_stock_row
+from reports import get_history_filename, parse_history_line
+from search import ProductIndex
+from storage import open_storage
+from write import save_inventory
+
+
+# Counters and transactions per counter used when none are given
+DEFAULT_COUNTERS = 4
+DEFAULT_TRANSACTIONS = 100
+
+# Inventory files simulated, one per storage backend
+STORAGE_FILES = ["inventory.txt", "inventory.db"]
+
+# Products in the simulated inventory and their starting stock
+PRODUCT_COUNT = 500
+START_STOCK = 40
+
+# Popularity of the n-th most popular product is 1 / n ** ZIPF_EXPONENT
+ZIPF_EXPONENT = 1.1
+
+# Chance that a basket gets one more product, and the largest basket
+BASKET_CONTINUE = 0.45
+MAX_BASKET_ITEMS = 6
+
+# Units of one product in a sale, and how often each is bought
+SALE_QUANTITIES = [1, 2, 3, 4, 5, 6]
+SALE_QUANTITY_WEIGHTS = [60, 25, 9, 3, 2, 1]
+
+# Share of transactions that are restocks, and units added per restocked product
+RESTOCK_SHARE = 0.1
+RESTOCK_QUANTITY = (20, 60)
+
+# Share of restocked products that get a new cost price
+COST_CHANGE_SHARE = 0.1
+
+# Same baskets on every run
+RANDOM_SEED = 2024
+
+# Script of the counter running on the current thread
+current_script = threading.local()
+
+
+class BasketAbandoned(Exception):
+    """
+    Raised to leave a sale the script cannot finish, like a customer walking away.
+    """
+
+
+class CounterScript:
+    """
+    Answers the prompts of the sale and restock screens for one counter.
+
+    Prompts are recognised by their text. A sale that runs out of planned
+    products after a stock shortage is abandoned, since the screen has no
+    way to finish without adding another product.
+    """
+
+    def __init__(self, counter_number, product_count):
+        """
+        Creates the script of one counter.
+
+        Parameters:
+            counter_number (int): Counter number, also used to seed its choices
+            product_count (int): Number of products
+
+        Returns:
+            None
+        """
+        self.counter_number = counter_number
+        self.rng = random.Random(RANDOM_SEED + counter_number)
+
+        # Same popularity order for every counter, so they compete for the same products
+        order = list(range(1, product_count + 1))
+        random.Random(RANDOM_SEED).shuffle(order)
+        self.popular_ids = order
+        self.cum_weights = list(itertools.accumulate(
+            [1.0 / rank ** ZIPF_EXPONENT for rank in range(1, product_count + 1)]))
+
+        self.items = []
+        self.position = 0
+        self.current = None
+        self.customer = None
+
+    def pick_products(self, count):
+        """
+        Picks different products by popularity.
+
+        Parameters:
+            count (int): Number of products
+
+        Returns:
+            list: Product IDs
+        """
+        picked = []
+        while len(picked) < min(count, len(self.popular_ids)):
+            product_id = self.rng.choices(self.popular_ids, cum_weights=self.cum_weights)[0]
+            if product_id not in picked:
+                picked.append(product_id)
+        return picked
+
+    def plan_sale(self):
+        """
+        Plans the next sale.
+
+        Returns:
+            None
+        """
+        size = 1
+        while size < MAX_BASKET_ITEMS and self.rng.random() < BASKET_CONTINUE:
+            size += 1
+        self.items = [{"id": product_id,
+                       "quantity": self.rng.choices(SALE_QUANTITIES, SALE_QUANTITY_WEIGHTS)[0]}
+                      for product_id in self.pick_products(size)]
+
+        # Regular customers come back
+        number = self.rng.randint(1, 200)
+        self.customer = ("98%08d" % number, "Customer %d" % number)
+        self.position = 0
+
+    def plan_restock(self):
+        """
+        Plans the next restock.
+
+        Returns:
+            None
+        """
+        self.items = []
+        for product_id in self.pick_products(self.rng.randint(1, 3)):
+            item = {"id": product_id, "quantity": self.rng.randint(*RESTOCK_QUANTITY),
+                    "new_cost": None}
+            if self.rng.random() < COST_CHANGE_SHARE:
+                item["new_cost"] = float(self.rng.randint(100, 2000))
+            self.items.append(item)
+        self.position = 0
+
+    def answer(self, prompt):
+        """
+        Gives the answer a person at the counter would type.
+
+        Parameters:
+            prompt (str): Prompt shown by the screen
+
+        Returns:
+            str: Typed answer
+
+        Raises:
+            BasketAbandoned: If the planned products have run out
+        """
+        if "phone number" in prompt:
+            return self.customer[0]
+        if "customer name" in prompt:
+            # Returning customers keep their stored name
+            if "[" in prompt:
+                return ""
+            return self.customer[1]
+        if "supplier name" in prompt:
+            return "Supplier %d" % self.counter_number
+        if "product ID" in prompt:
+            if self.position >= len(self.items):
+                raise BasketAbandoned()
+            self.current = self.items[self.position]
+            self.position += 1
+            return str(self.current["id"])
+        if "quantity to" in prompt:
+            return str(self.current["quantity"])
+        if "Update cost price" in prompt:
+            if self.current["new_cost"] is None:
+                return "n"
+            return "y"
+        if "new cost price" in prompt:
+            return str(self.current["new_cost"])
+        if "Add more items" in prompt:
+            if self.position < len(self.items):
+                return "y"
+            return "n"
+        if "shipped" in prompt:
+            return "N"
+        raise BasketAbandoned()
+
+
+def scripted_input(prompt=""):
+    """
+    Stands in for input, answering with the current thread's script.
+
+    Parameters:
+        prompt (str): Prompt shown by the screen
+
+    Returns:
+        str: Answer from the script
+    """
+    return current_script.script.answer(prompt)
+
+
+def run_counter(filename, counter_number, transactions):
+    """
+    Runs one counter's sales and restocks.
+
+    Parameters:
+        filename (str): Name of inventory file or database
+        counter_number (int): Counter number
+        transactions (int): Sales and restocks to run
+
+    Returns:
+        dict: Latencies by kind and counts of completed and failed transactions
+    """
+    storage = open_storage(filename)
+    inventory_data = storage.load()
+    product_index = ProductIndex(inventory_data)
+    sale_renderer = CatalogueRenderer(inventory_data, format_sale_row)
+    stock_renderer = CatalogueRenderer(inventory_data, format_stock_row)
+
+    script = CounterScript(counter_number, len(inventory_data))
+    current_script.script = script
+
+    result = {"sale": [], "restock": [], "sales_done": 0, "sales_failed": 0,
+              "restocks_done": 0, "restocks_failed": 0}
+    for number in range(transactions):
+        if script.rng.random() < RESTOCK_SHARE:
+            script.plan_restock()
+            start = time.perf_counter()
+            done = restock_items(inventory_data, product_index, stock_renderer)
+            result["restock"].append(time.perf_counter() - start)
+            result["restocks_done" if done else "restocks_failed"] += 1
+        else:
+            script.plan_sale()
+            start = time.perf_counter()
+            done = sell_items(inventory_data, product_index, sale_renderer)
+            result["sale"].append(time.perf_counter() - start)
+            result["sales_done" if done else "sales_failed"] += 1
+
+    # Invoice files are part of the work, wait for them
+    flush_documents()
+    close_allocators()
+    storage.close()
+    return result
+
+
+def run_counter_process(filename, counter_number, transactions):
+    """
+    Runs one counter in a worker process, with scripted input and no screen output.
+
+    Parameters:
+        filename (str): Name of inventory file or database
+        counter_number (int): Counter number
+        transactions (int): Sales and restocks to run
+
+    Returns:
+        dict: Result from run_counter
+    """
+    builtins.input = scripted_input
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+        return run_counter(filename, counter_number, transactions)
+
+
+def create_inventory(filename):
+    """
+    Creates the simulated inventory with low stock.
+
+    Parameters:
+        filename (str): Name of inventory file or database
+
+    Returns:
+        dict: Starting stock by product ID
+    """
+    write_synthetic_inventory("inventory.txt", PRODUCT_COUNT)
+    inventory_data = get_inventory_data("inventory.txt")
+    for product_id in inventory_data.product_ids():
+        inventory_data.set_quantity(product_id, START_STOCK)
+    save_inventory(inventory_data, "inventory.txt", False)
+
+    # A new database imports the text inventory
+    if filename != "inventory.txt":
+        open_storage(filename).close()
+    return dict((product_id, START_STOCK) for product_id in inventory_data.product_ids())
+
+
+def check_stock(filename, start_stock):
+    """
+    Checks final stock against the recorded sales and restocks.
+
+    Parameters:
+        filename (str): Name of inventory file or database
+        start_stock (dict): Starting stock by product ID
+
+    Returns:
+        dict: Counts of lost updates, oversold products and repeated document numbers
+    """
+    expected = dict(start_stock)
+    documents = set()
+    repeated_documents = 0
+    last_document = None
+    history_file = open(get_history_filename(filename), "r")
+    try:
+        for line in history_file:
+            entry = parse_history_line(line)
+            if entry is None:
+                continue
+            kind, day, document_num, product_id, quantity, free, amount, cost = entry
+            if kind == "SALE":
+                expected[product_id] -= quantity + free
+            else:
+                expected[product_id] += quantity
+
+            # Lines of one document are written together
+            if (kind, document_num) != last_document:
+                if (kind, document_num) in documents:
+                    repeated_documents += 1
+                documents.add((kind, document_num))
+                last_document = (kind, document_num)
+    finally:
+        history_file.close()
+
+    storage = open_storage(filename)
+    inventory_data = storage.load()
+    storage.close()
+
+    lost_updates = 0
+    oversold = 0
+    for product_id in inventory_data.product_ids():
+        stock = inventory_data.get_quantity(product_id)
+        if stock != expected[product_id]:
+            lost_updates += 1
+        if stock < 0:
+            oversold += 1
+
+    # Stock must never have dropped below zero on the way either
+    events, offset = read_events(filename, 0, None)
+    negative_events = len([event for event_offset, event in events if event["stock"] < 0])
+    return {"lost_updates": lost_updates, "oversold_products": oversold,
+            "negative_stock_events": negative_events,
+            "repeated_documents": repeated_documents, "documents": len(documents)}
+
+
+def simulate_storage(filename, counters, transactions, processes=False):
+    """
+    Runs every counter against one storage backend and checks the result.
+
+    Should be called from an empty working directory.
+
+    Parameters:
+        filename (str): Name of inventory file or database
+        counters (int): Number of counters running at once
+        transactions (int): Sales and restocks per counter
+        processes (bool): Whether counters are processes instead of threads
+
+    Returns:
+        dict: Throughput, latencies, outcome counts and stock checks
+    """
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+        start_stock = create_inventory(filename)
+
+    start = time.perf_counter()
+    if processes:
+        with ProcessPoolExecutor(max_workers=counters) as executor:
+            results = list(executor.map(run_counter_process, [filename] * counters,
+                                        range(1, counters + 1), [transactions] * counters))
+    else:
+        original_input = builtins.input
+        builtins.input = scripted_input
+        try:
+            with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+                with ThreadPoolExecutor(max_workers=counters) as executor:
+                    results = list(executor.map(run_counter, [filename] * counters,
+                                                range(1, counters + 1),
+                                                [transactions] * counters))
+        finally:
+            builtins.input = original_input
+    elapsed = time.perf_counter() - start
+
+    report = {"counters": counters, "mode": "processes" if processes else "threads"}
+    for kind in ("sale", "restock"):
+        latencies = []
+        for result in results:
+            latencies.extend(result[kind])
+        report[kind] = summarize(latencies, elapsed)
+    for key in ("sales_done", "sales_failed", "restocks_done", "restocks_failed"):
+        report[key] = sum([result[key] for result in results])
+    report["per_second"] = (report["sales_done"] + report["restocks_done"]) / elapsed
+    report["elapsed_s"] = elapsed
+
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+        report["checks"] = check_stock(filename, start_stock)
+    return report
+
+
+def run_simulation(counters=DEFAULT_COUNTERS, transactions=DEFAULT_TRANSACTIONS,
+                   processes=False, storage_files=None):
+    """
+    Simulates every storage backend in its own temporary directory.
+
+    Parameters:
+        counters (int): Number of counters running at once
+        transactions (int): Sales and restocks per counter
+        processes (bool): Whether counters are processes instead of threads
+        storage_files (list): Inventory files to simulate, None for STORAGE_FILES
+
+    Returns:
+        dict: Reports by inventory file
+    """
+    if storage_files is None:
+        storage_files = STORAGE_FILES
+
+    reports = {}
+    original_directory = os.getcwd()
+    for filename in storage_files:
+        work_directory = tempfile.mkdtemp(prefix="wecare-sim-")
+        os.chdir(work_directory)
+        try:
+            print("Simulating %d counters on %s..." % (counters, filename))
+            reports[filename] = simulate_storage(filename, counters, transactions, processes)
+        finally:
+            os.chdir(original_directory)
+            shutil.rmtree(work_directory, ignore_errors=True)
+    return reports
+
+
+def print_report(reports):
+    """
+    Prints simulation results.
+
+    Parameters:
+        reports (dict): Reports by inventory file from run_simulation
+
+    Returns:
+        None
+    """
+    for filename, report in reports.items():
+        checks = report["checks"]
+        print("\n%s - %d counters (%s) - %.1f transactions per second" %
+              (filename, report["counters"], report["mode"], report["per_second"]))
+        print("  Sales: %d done, %d failed   Restocks: %d done, %d failed" %
+              (report["sales_done"], report["sales_failed"],
+               report["restocks_done"], report["restocks_failed"]))
+        for kind in ("sale", "restock"):
+            result = report[kind]
+            print("  %-8s p50 %8.2f ms   p90 %8.2f ms   p99 %8.2f ms   max %8.2f ms" %
+                  (kind, result["p50_ms"], result["p90_ms"], result["p99_ms"], result["max_ms"]))
+        print("  Lost updates: %d   Oversold products: %d   Negative stock events: %d   "
+              "Repeated document numbers: %d" %
+              (checks["lost_updates"], checks["oversold_products"],
+               checks["negative_stock_events"], checks["repeated_documents"]))
+
+
+if __name__ == "__main__":
+    arguments = [argument for argument in sys.argv[1:] if argument != "--processes"]
+    counter_count = DEFAULT_COUNTERS
+    transaction_count = DEFAULT_TRANSACTIONS
+    output_filename = None
+    if len(arguments) > 0:
+        counter_count = int(arguments[0])
+    if len(arguments) > 1:
+        transaction_count = int(arguments[1])
+    if len(arguments) > 2:
+        output_filename = arguments[2]
+
+    simulation_reports = run_simulation(counter_count, transaction_count,
+                                        "--processes" in sys.argv)
+    print_report(simulation_reports)
+
+    if output_filename is not None:
+        with open(output_filename, "w") as output_file:
+            json.dump(simulation_reports, output_file, indent=2)
+        print("Results saved to " + output_filename)
+
+    # Any sign of lost or oversold stock fails the run
+    problems = 0
+    for simulation_report in simulation_reports.values():
+        simulation_checks = simulation_report["checks"]
+        problems += (simulation_checks["lost_updates"] + simulation_checks["oversold_products"] +
+                     simulation_checks["negative_stock_events"] +
+                     simulation_checks["repeated_documents"])
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,504 @@
+"""
+Snapshot module for WeCare Beauty system.
+Saves the inventory file so a crash never leaves it half written.
+
+A snapshot is written to a temporary file, synced to disk and then
+renamed over the inventory file in one step. The previous files are
+kept as inventory.txt.1, inventory.txt.2 and so on, so a damaged file
+can be replaced by the newest good one.
+
+The first line of a snapshot is a header with the format version, the
+number of products and a CRC-32 checksum of the product lines:
+    # WeCare inventory version=1 products=0000000003 crc32=1a2b3c4d
+Files without a header, written by older versions, are still read.
+
+Each save also writes a binary copy (inventory.txt.bin) that loads
+without parsing a line: quantities, costs and selling prices are stored
+as raw 8 byte columns and names as a newline separated string pool.
+Brands and origins repeat, so each distinct value is pooled once and
+products hold a 4 byte index into the pool. Loading is a few bulk
+copies and splits. The binary copy holds the header line of the text
+file it was made from, and is only used while that still matches the
+text file.
+"""
+
+import mmap
+import os
+import shutil
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from inventory import Inventory
+from pricing import check_pricing_rules
+
+
+# Format version written in the header
+SNAPSHOT_VERSION = 1
+
+# Older snapshots kept next to the inventory file
+SNAPSHOT_GENERATIONS = 3
+
+# Header with fixed width fields, so it can be filled in after the products
+HEADER_FORMAT = "# WeCare inventory version=%d products=%010d crc32=%08x\n"
+
+# Start of every header line
+HEADER_PREFIX = "# WeCare inventory "
+
+# Start and format version of the binary copy
+BINARY_MAGIC = b"WCINVBIN"
+BINARY_VERSION = 2
+
+# Magic, version, products, CRC-32 of the sections, text file size, the
+# stamp of the pricing rules the prices come from, the byte lengths of
+# the text header and names pool, and the number of values and byte
+# length of the brand and origin pools
+BINARY_HEADER = struct.Struct("<8sIQIQIIQIQIQ")
+
+
+def get_generation_filename(filename, generation):
+    """
+    Gets the name of an older snapshot.
+
+    Parameters:
+        filename (str): Name of inventory file
+        generation (int): 1 for the newest older snapshot
+
+    Returns:
+        str: Name of snapshot file
+    """
+    return "%s.%d" % (filename, generation)
+
+
+def get_snapshot_filenames(filename="inventory.txt"):
+    """
+    Gets the inventory file and its older snapshots, newest first.
+
+    Parameters:
+        filename (str): Name of inventory file
+
+    Returns:
+        list: Names of snapshot files that exist
+    """
+    filenames = [filename]
+    for generation in range(1, SNAPSHOT_GENERATIONS + 1):
+        filenames.append(get_generation_filename(filename, generation))
+    return [name for name in filenames if os.path.exists(name)]
+
+
+def format_header(product_count, checksum):
+    """
+    Formats a snapshot header line.
+
+    Parameters:
+        product_count (int): Number of products
+        checksum (int): CRC-32 of the product lines
+
+    Returns:
+        str: Header line
+    """
+    return HEADER_FORMAT % (SNAPSHOT_VERSION, product_count, checksum)
+
+
+def parse_header(line):
+    """
+    Reads a snapshot header line.
+
+    Parameters:
+        line (str): First line of an inventory file
+
+    Returns:
+        dict: Version, products and crc32, or None if the line is not a header
+
+    Raises:
+        ValueError: If the header is damaged or from a newer version
+    """
+    if not line.startswith(HEADER_PREFIX):
+        return None
+
+    header = {}
+    for field in line[len(HEADER_PREFIX):].split():
+        name, separator, value = field.partition("=")
+        header[name] = value
+
+    try:
+        version = int(header["version"])
+        products = int(header["products"])
+        checksum = int(header["crc32"], 16)
+    except (KeyError, ValueError):
+        raise ValueError("Damaged header: " + line.strip())
+
+    if version > SNAPSHOT_VERSION:
+        raise ValueError("Inventory file version %d is newer than this program" % version)
+    return {"version": version, "products": products, "crc32": checksum}
+
+
+def sync_directory(filename):
+    """
+    Makes a rename in a file's directory survive a power cut.
+
+    Not every system can sync a directory, so failures are ignored.
+
+    Parameters:
+        filename (str): Name of a file in the directory
+
+    Returns:
+        None
+    """
+    try:
+        directory = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(directory)
+    except OSError:
+        pass
+    finally:
+        os.close(directory)
+
+
+def rotate_generations(filename):
+    """
+    Moves older snapshots one generation back and keeps the current file.
+
+    The oldest snapshot is dropped. The current file stays in place,
+    linked or copied as the newest older snapshot, so there is never a
+    moment without an inventory file.
+
+    Parameters:
+        filename (str): Name of inventory file
+
+    Returns:
+        None
+    """
+    for generation in range(SNAPSHOT_GENERATIONS, 1, -1):
+        older = get_generation_filename(filename, generation - 1)
+        if os.path.exists(older):
+            os.replace(older, get_generation_filename(filename, generation))
+
+    if os.path.exists(filename):
+        newest = get_generation_filename(filename, 1)
+        if os.path.exists(newest):
+            os.remove(newest)
+        try:
+            os.link(filename, newest)
+        except OSError:
+            # Some file systems have no hard links
+            shutil.copyfile(filename, newest)
+
+
+def write_snapshot(inventory_data, filename="inventory.txt"):
+    """
+    Writes every product to the inventory file in one atomic step.
+
+    Products are written to a temporary file with a placeholder header,
+    which is filled in once the checksum is known. After the file is on
+    disk, the older snapshots are rotated and it is renamed into place.
+
+    Parameters:
+        inventory_data (Inventory): Product information
+        filename (str): Name of inventory file
+
+    Returns:
+        bytes: Header line written
+
+    Raises:
+        OSError: If the snapshot could not be written
+    """
+    # Each writer has its own temporary file, so two saves never mix
+    temp_filename = "%s.%d.%d.tmp" % (filename, os.getpid(), threading.get_ident())
+    checksum = 0
+    product_count = 0
+
+    file = open(temp_filename, "wb")
+    try:
+        file.write(format_header(0, 0).encode("utf-8"))
+
+        # Write in blocks so large inventories are not held twice in memory
+        block = []
+        for product_id in inventory_data.product_ids():
+            block.append(", ".join(inventory_data.get_row(product_id)) + "\n")
+            if len(block) >= 10000:
+                data = "".join(block).encode("utf-8")
+                checksum = zlib.crc32(data, checksum)
+                file.write(data)
+                block = []
+            product_count += 1
+        data = "".join(block).encode("utf-8")
+        checksum = zlib.crc32(data, checksum)
+        file.write(data)
+
+        # Header has the same length whatever its values
+        header_line = format_header(product_count, checksum).encode("utf-8")
+        file.seek(0)
+        file.write(header_line)
+        file.flush()
+        os.fsync(file.fileno())
+    except:
+        file.close()
+        os.remove(temp_filename)
+        raise
+    file.close()
+
+    rotate_generations(filename)
+    os.replace(temp_filename, filename)
+    sync_directory(filename)
+    return header_line
+
+
+def read_header_line(filename="inventory.txt"):
+    """
+    Reads the header line of an inventory file without reading the products.
+
+    Parameters:
+        filename (str): Name of inventory file
+
+    Returns:
+        bytes: Header line, or None if the file is missing or has no header
+    """
+    try:
+        file = open(filename, "rb")
+    except OSError:
+        return None
+    try:
+        line = file.readline(len(HEADER_FORMAT) + 64)
+    finally:
+        file.close()
+    if line.startswith(HEADER_PREFIX.encode("utf-8")) and line.endswith(b"\n"):
+        return line
+    return None
+
+
+def get_binary_filename(filename="inventory.txt"):
+    """
+    Gets the name of the binary copy of an inventory file.
+
+    Parameters:
+        filename (str): Name of inventory file
+
+    Returns:
+        str: Name of binary file
+    """
+    return filename + ".bin"
+
+
+def column_bytes(values):
+    """
+    Gets the bytes of a number column in little-endian order.
+
+    Parameters:
+        values (array): Numbers
+
+    Returns:
+        bytes: Raw column
+    """
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def column_from_bytes(typecode, data):
+    """
+    Rebuilds a number column from little-endian bytes.
+
+    Parameters:
+        typecode (str): Array type code
+        data (bytes): Raw column
+
+    Returns:
+        array: Numbers
+    """
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def pool_column(values):
+    """
+    Splits a text column into its distinct values and one index per product.
+
+    Parameters:
+        values (list): Text of each product
+
+    Returns:
+        tuple: (list of distinct values, array of indexes)
+    """
+    positions = {}
+    indexes = array("I", [positions.setdefault(value, len(positions)) for value in values])
+    return list(positions), indexes
+
+
+def write_binary_snapshot(inventory_data, filename, header_line):
+    """
+    Writes the binary copy of an inventory file.
+
+    The copy is only a cache of the text file, so it is not synced to
+    disk; a copy damaged by a crash fails its checksum and is rebuilt.
+
+    Parameters:
+        inventory_data (Inventory): Products as saved in the text file
+        filename (str): Name of inventory file
+        header_line (bytes): Header line of the text file
+
+    Returns:
+        None
+
+    Raises:
+        OSError: If the copy could not be written
+    """
+    brand_values, brand_indexes = pool_column(inventory_data.brands[1:])
+    origin_values, origin_indexes = pool_column(inventory_data.origins[1:])
+    sections = [header_line,
+                column_bytes(inventory_data.quantities[1:]),
+                column_bytes(inventory_data.costs[1:]),
+                column_bytes(inventory_data.prices[1:]),
+                "\n".join(inventory_data.names[1:]).encode("utf-8"),
+                column_bytes(brand_indexes),
+                "\n".join(brand_values).encode("utf-8"),
+                column_bytes(origin_indexes),
+                "\n".join(origin_values).encode("utf-8")]
+    checksum = 0
+    for section in sections:
+        checksum = zlib.crc32(section, checksum)
+
+    header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(inventory_data), checksum,
+                                os.path.getsize(filename), inventory_data.price_stamp,
+                                len(sections[0]), len(sections[4]),
+                                len(brand_values), len(sections[6]),
+                                len(origin_values), len(sections[8]))
+
+    # Loading counters may rebuild the copy at the same time as a save
+    binary_filename = get_binary_filename(filename)
+    temp_filename = "%s.%d.%d.tmp" % (binary_filename, os.getpid(), threading.get_ident())
+    file = open(temp_filename, "wb")
+    try:
+        file.write(header)
+        for section in sections:
+            file.write(section)
+    finally:
+        file.close()
+    os.replace(temp_filename, binary_filename)
+
+
+def split_pool(data, count):
+    """
+    Splits a string pool back into its strings.
+
+    Parameters:
+        data (bytes): Newline separated strings
+        count (int): Number of strings expected
+
+    Returns:
+        list: Strings, or None if the count does not match
+    """
+    if count == 0:
+        return []
+    strings = data.decode("utf-8").split("\n")
+    if len(strings) != count:
+        return None
+    return strings
+
+
+def unpool_column(values, index_data):
+    """
+    Rebuilds a text column from its distinct values and indexes.
+
+    Every product gets the same string object for the same value.
+
+    Parameters:
+        values (list): Distinct values
+        index_data (bytes): Raw index column
+
+    Returns:
+        list: Text of each product, or None if an index is out of range
+    """
+    indexes = column_from_bytes("I", index_data)
+    if indexes and max(indexes) >= len(values):
+        return None
+    return list(map(list(map(sys.intern, values)).__getitem__, indexes))
+
+
+def load_binary_snapshot(filename="inventory.txt"):
+    """
+    Loads an inventory from its binary copy.
+
+    Parameters:
+        filename (str): Name of inventory file
+
+    Returns:
+        Inventory: Products from the copy, or None if it is missing, does
+                   not match the text file or is damaged
+    """
+    header_line = read_header_line(filename)
+    if header_line is None:
+        return None
+    try:
+        file = open(get_binary_filename(filename), "rb")
+    except OSError:
+        return None
+
+    try:
+        if os.fstat(file.fileno()).st_size < BINARY_HEADER.size:
+            return None
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, version, product_count, checksum, source_size, price_stamp,
+             header_length, names_length, brand_count, brands_length,
+             origin_count, origins_length) = BINARY_HEADER.unpack_from(data, 0)
+            if magic != BINARY_MAGIC or version != BINARY_VERSION:
+                return None
+
+            # Made from another version of the text file
+            position = BINARY_HEADER.size
+            if (data[position:position + header_length] != header_line or
+                    source_size != os.path.getsize(filename)):
+                return None
+
+            lengths = [header_length, 8 * product_count, 8 * product_count, 8 * product_count,
+                       names_length, 4 * product_count, brands_length,
+                       4 * product_count, origins_length]
+            if BINARY_HEADER.size + sum(lengths) != len(data):
+                print("Binary inventory copy is damaged, reading the text file instead")
+                return None
+
+            # Slices are copies, so nothing refers to the map once it is closed
+            sections = []
+            section_checksum = 0
+            for length in lengths:
+                section = data[position:position + length]
+                section_checksum = zlib.crc32(section, section_checksum)
+                sections.append(section)
+                position += length
+        finally:
+            data.close()
+    finally:
+        file.close()
+
+    if section_checksum != checksum:
+        print("Binary inventory copy is damaged, reading the text file instead")
+        return None
+
+    names = split_pool(sections[4], product_count)
+    brand_values = split_pool(sections[6], brand_count)
+    origin_values = split_pool(sections[8], origin_count)
+    if names is None or brand_values is None or origin_values is None:
+        return None
+    brands = unpool_column(brand_values, sections[5])
+    origins = unpool_column(origin_values, sections[7])
+    if brands is None or origins is None:
+        return None
+
+    # Prices are worked out again if the pricing rules changed since the copy was made
+    rules = check_pricing_rules(filename)
+    prices = None
+    if price_stamp == rules.stamp:
+        prices = column_from_bytes("d", sections[3])
+
+    inventory_data = Inventory(rules)
+    inventory_data.add_products(names, brands, column_from_bytes("q", sections[1]),
+                                column_from_bytes("d", sections[2]), origins, prices)
+    return inventory_data
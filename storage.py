@@ -0,0 +1,557 @@
+"""
+Storage module for WeCare Beauty system.
+Lets the inventory live in the text file or in an SQLite database.
+
+Both backends offer the same methods:
+    load(): Loads the inventory
+    transaction(inventory_data): Context manager for one sale or restock
+    record(kind, document_num, changes, inventory_data, details): Saves changes
+    sync(inventory_data): Catches up with other counters
+    save(inventory_data): Saves every product
+    close(): Releases the storage
+"""
+
+import contextlib
+import datetime
+import os
+import sqlite3
+import threading
+from events import get_events_filename, publish_events
+from inventory import Inventory
+from journal import apply_journal_entries
+from locking import LOCK_TIMEOUT, inventory_lock
+from metrics import timed
+from pricing import check_pricing_rules
+from read import get_inventory_data, iter_products, refresh_inventory
+from write import (record_inventory_batch, record_inventory_changes, save_inventory,
+                   text_transaction)
+
+
+# Products used when a new database has nothing to import
+SAMPLE_PRODUCTS = [
+    ("Vitamin C Serum", "Garnier", 200, 1000.0, "France"),
+    ("Skin Cleanser", "Cetaphil", 100, 280.0, "Switzerland"),
+    ("Sunscreen", "Aqualogica", 200, 700.0, "India"),
+]
+
+
+class TextStorage:
+    """
+    Inventory kept in inventory.txt with its stock journal.
+
+    A whole-file save is expensive, so batch runs hold the lock and save
+    once at the end instead of recording every order.
+    """
+
+    single_save = True
+
+    def __init__(self, filename="inventory.txt"):
+        """
+        Creates text file storage.
+
+        Parameters:
+            filename (str): Name of inventory file
+
+        Returns:
+            None
+        """
+        self.filename = filename
+
+    def load(self):
+        """
+        Loads the inventory from the text file and journal.
+
+        Returns:
+            Inventory: Product information
+        """
+        inventory_data = get_inventory_data(self.filename)
+        inventory_data.storage = self
+        return inventory_data
+
+    def transaction(self, inventory_data):
+        """
+        Holds the file lock after catching up with other counters.
+
+        Parameters:
+            inventory_data (Inventory): Master inventory
+
+        Returns:
+            Context manager holding the lock
+        """
+        return text_transaction(inventory_data)
+
+    def lock(self):
+        """
+        Holds the file lock without catching up, for batch runs.
+
+        Returns:
+            Context manager holding the lock
+        """
+        return inventory_lock(self.filename)
+
+    def record(self, kind, document_num, changes, inventory_data, details):
+        """
+        Appends changes to the stock journal.
+
+        Parameters:
+            kind (str): Transaction type (SALE or RESTOCK)
+            document_num (str): Invoice or purchase form number
+            changes (list): List of dicts with id, quantity_change, stock and cost
+            inventory_data (Inventory): Master inventory
+            details (dict): Not kept in the text file, the document has them
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        return record_inventory_changes(kind, document_num, changes, inventory_data)
+
+    def record_batch(self, records, inventory_data):
+        """
+        Appends the changes of several transactions to the journal at once.
+
+        Parameters:
+            records (list): Tuples of (kind, document number, changes, details)
+            inventory_data (Inventory): Master inventory
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        return record_inventory_batch(records, inventory_data)
+
+    def sync(self, inventory_data):
+        """
+        Catches up with changes made by other counters.
+
+        Parameters:
+            inventory_data (Inventory): Master inventory
+
+        Returns:
+            None
+        """
+        with inventory_lock(self.filename):
+            refresh_inventory(inventory_data)
+
+    def save(self, inventory_data):
+        """
+        Rewrites the whole inventory file.
+
+        Parameters:
+            inventory_data (Inventory): Product information
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        return save_inventory(inventory_data, self.filename)
+
+    def close(self):
+        """
+        Nothing to release for a text file.
+
+        Returns:
+            None
+        """
+        return None
+
+
+class SqliteStorage:
+    """
+    Inventory kept in an SQLite database.
+
+    Products sit in an indexed table, and every sale and restock is one
+    transaction that updates only the changed rows and adds them to a
+    ledger, together with an entry for the invoice or purchase form.
+    The database runs in WAL mode so readers do not block the writer.
+    """
+
+    single_save = False
+
+    def __init__(self, filename="inventory.db", import_filename="inventory.txt"):
+        """
+        Opens (and if needed creates) the database.
+
+        Parameters:
+            filename (str): Name of database file
+            import_filename (str): Text inventory imported into a new database
+
+        Returns:
+            None
+        """
+        self.filename = filename
+        self.import_filename = import_filename
+        self.thread_lock = threading.Lock()
+
+        # Last ledger entry and full save this process has seen
+        self.last_change_id = 0
+        self.generation = 0
+
+        # Changes of the open transaction, published once it commits
+        self.unpublished = []
+
+        # Transactions are started by hand, so autocommit mode is used
+        self.connection = sqlite3.connect(filename, timeout=LOCK_TIMEOUT,
+                                          isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+
+    def create_tables(self):
+        """
+        Creates tables and indexes that do not exist yet.
+
+        Returns:
+            None
+        """
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS products (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                brand TEXT NOT NULL,
+                quantity INTEGER NOT NULL,
+                cost REAL NOT NULL,
+                origin TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS products_name ON products (name);
+            CREATE INDEX IF NOT EXISTS products_brand ON products (brand);
+            CREATE INDEX IF NOT EXISTS products_origin ON products (origin);
+
+            CREATE TABLE IF NOT EXISTS documents (
+                number TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                name TEXT,
+                phone TEXT,
+                total REAL,
+                shipping_fee REAL,
+                filename TEXT,
+                created TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS documents_created ON documents (created);
+
+            CREATE TABLE IF NOT EXISTS ledger (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                document TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                product_id INTEGER NOT NULL,
+                quantity_change INTEGER NOT NULL,
+                stock INTEGER NOT NULL,
+                cost REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ledger_document ON ledger (document);
+            CREATE INDEX IF NOT EXISTS ledger_product ON ledger (product_id);
+
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+
+    def get_generation(self):
+        """
+        Gets the number of full saves made to the database.
+
+        Returns:
+            int: Save generation
+        """
+        row = self.connection.execute(
+            "SELECT value FROM settings WHERE key = 'generation'").fetchone()
+        if row is None:
+            return 0
+        return int(row[0])
+
+    def import_products(self):
+        """
+        Fills an empty database from the text inventory or sample data.
+
+        Returns:
+            None
+        """
+        if os.path.exists(self.import_filename):
+            products = list(iter_products(self.import_filename))
+        else:
+            products = SAMPLE_PRODUCTS
+
+        with self.thread_lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Another counter may have filled it meanwhile
+                count = self.connection.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+                if count == 0:
+                    self.connection.executemany(
+                        "INSERT INTO products (id, name, brand, quantity, cost, origin) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        [(product_id,) + tuple(product)
+                         for product_id, product in enumerate(products, 1)])
+                self.connection.execute("COMMIT")
+            except:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    @timed("inventory_load")
+    def load(self):
+        """
+        Loads the inventory from the database.
+
+        Returns:
+            Inventory: Product information
+        """
+        if self.connection.execute("SELECT COUNT(*) FROM products").fetchone()[0] == 0:
+            self.import_products()
+
+        with self.thread_lock:
+            # Read everything from one consistent snapshot
+            self.connection.execute("BEGIN")
+            try:
+                inventory_data = self.read_products()
+                self.last_change_id = self.connection.execute(
+                    "SELECT COALESCE(MAX(id), 0) FROM ledger").fetchone()[0]
+                self.generation = self.get_generation()
+            finally:
+                self.connection.execute("COMMIT")
+
+        inventory_data.filename = self.filename
+        inventory_data.storage = self
+        return inventory_data
+
+    def read_products(self):
+        """
+        Reads every product row.
+
+        Returns:
+            Inventory: Product information
+        """
+        inventory_data = Inventory(check_pricing_rules(self.filename))
+        for product_id, name, brand, quantity, cost, origin in self.connection.execute(
+                "SELECT id, name, brand, quantity, cost, origin FROM products ORDER BY id"):
+            # IDs must stay in step with positions
+            if product_id != len(inventory_data) + 1:
+                raise ValueError("Product IDs in " + self.filename + " are not consecutive")
+            inventory_data.add_product(name, brand, quantity, cost, origin)
+        return inventory_data
+
+    def refresh(self, inventory_data):
+        """
+        Applies changes committed by other counters since the last refresh.
+
+        Parameters:
+            inventory_data (Inventory): Master inventory
+
+        Returns:
+            None
+        """
+        generation = self.get_generation()
+        if generation != self.generation:
+            # Whole inventory was saved elsewhere, copy every row
+            fresh_data = self.read_products()
+            for product_id in fresh_data.product_ids():
+                if not inventory_data.has_product(product_id):
+                    inventory_data.add_product(fresh_data.get_name(product_id),
+                                               fresh_data.get_brand(product_id),
+                                               fresh_data.get_quantity(product_id),
+                                               fresh_data.get_cost(product_id),
+                                               fresh_data.get_origin(product_id))
+                    continue
+                apply_journal_entries(inventory_data, [
+                    (product_id, fresh_data.get_quantity(product_id),
+                     fresh_data.get_cost(product_id))])
+            self.generation = generation
+            self.last_change_id = self.connection.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM ledger").fetchone()[0]
+            return
+
+        entries = []
+        for change_id, product_id, stock, cost in self.connection.execute(
+                "SELECT id, product_id, stock, cost FROM ledger WHERE id > ? ORDER BY id",
+                (self.last_change_id,)):
+            entries.append((product_id, stock, cost))
+            self.last_change_id = change_id
+        apply_journal_entries(inventory_data, entries)
+
+    @contextlib.contextmanager
+    def transaction(self, inventory_data):
+        """
+        Runs one sale or restock as a database transaction.
+
+        The write lock is taken at the start, so the stock check and the
+        update cannot interleave with another counter.
+
+        Parameters:
+            inventory_data (Inventory): Master inventory
+        """
+        with self.thread_lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.unpublished = []
+            last_change_id = self.last_change_id
+            try:
+                self.refresh(inventory_data)
+                yield
+                if not self.unpublished:
+                    self.connection.execute("COMMIT")
+                    return
+
+                # The event lock is taken before committing, so no other counter
+                # can publish between this commit and its events
+                with inventory_lock(get_events_filename(self.filename)):
+                    self.connection.execute("COMMIT")
+                    publish_events(self.unpublished, self.filename)
+            except:
+                if self.connection.in_transaction:
+                    self.connection.execute("ROLLBACK")
+
+                    # Ledger rows of this transaction are gone again
+                    self.last_change_id = last_change_id
+                raise
+            finally:
+                self.unpublished = []
+
+    def record(self, kind, document_num, changes, inventory_data, details):
+        """
+        Updates changed product rows and adds them to the ledger.
+
+        Should be called inside transaction.
+
+        Parameters:
+            kind (str): Transaction type (SALE or RESTOCK)
+            document_num (str): Invoice or purchase form number
+            changes (list): List of dicts with id, quantity_change, stock and cost
+            inventory_data (Inventory): Master inventory
+            details (dict): Customer or supplier name, phone, file and total
+
+        Returns:
+            bool: True if successful
+        """
+        self.connection.executemany(
+            "UPDATE products SET quantity = ?, cost = ? WHERE id = ?",
+            [(change["stock"], change["cost"], change["id"]) for change in changes])
+
+        for change in changes:
+            cursor = self.connection.execute(
+                "INSERT INTO ledger (document, kind, product_id, quantity_change, stock, cost) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (document_num, kind, change["id"], change["quantity_change"],
+                 change["stock"], change["cost"]))
+            self.last_change_id = cursor.lastrowid
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO documents "
+            "(number, kind, name, phone, total, shipping_fee, filename, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (document_num, kind, details.get("name"), details.get("phone"),
+             details.get("total"), details.get("shipping_fee", 0),
+             details.get("filename"), datetime.datetime.now().isoformat(" ")))
+        self.unpublished.append((kind, document_num, changes, details))
+        return True
+
+    def record_batch(self, records, inventory_data):
+        """
+        Records several transactions, committed together with the open transaction.
+
+        Parameters:
+            records (list): Tuples of (kind, document number, changes, details)
+            inventory_data (Inventory): Master inventory
+
+        Returns:
+            bool: True if successful
+        """
+        for kind, document_num, changes, details in records:
+            self.record(kind, document_num, changes, inventory_data, details or {})
+        return True
+
+    def sync(self, inventory_data):
+        """
+        Catches up with changes made by other counters.
+
+        Parameters:
+            inventory_data (Inventory): Master inventory
+
+        Returns:
+            None
+        """
+        with self.thread_lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.refresh(inventory_data)
+            finally:
+                self.connection.execute("COMMIT")
+
+    def save(self, inventory_data):
+        """
+        Writes every product row in one transaction.
+
+        Parameters:
+            inventory_data (Inventory): Product information
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            with self.thread_lock:
+                self.connection.execute("BEGIN IMMEDIATE")
+                try:
+                    self.connection.executemany(
+                        "INSERT OR REPLACE INTO products "
+                        "(id, name, brand, quantity, cost, origin) VALUES (?, ?, ?, ?, ?, ?)",
+                        [(product_id, inventory_data.get_name(product_id),
+                          inventory_data.get_brand(product_id),
+                          inventory_data.get_quantity(product_id),
+                          inventory_data.get_cost(product_id),
+                          inventory_data.get_origin(product_id))
+                         for product_id in inventory_data.product_ids()])
+                    self.connection.execute("DELETE FROM products WHERE id > ?",
+                                            (len(inventory_data),))
+
+                    # Tell other counters to reload everything
+                    self.generation = self.get_generation() + 1
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO settings (key, value) VALUES ('generation', ?)",
+                        (str(self.generation),))
+
+                    # Changes made without recording them are published with the save
+                    with inventory_lock(get_events_filename(self.filename)):
+                        self.connection.execute("COMMIT")
+                        publish_events(inventory_data.unsaved_records, self.filename)
+                    inventory_data.unsaved_records = []
+                except:
+                    if self.connection.in_transaction:
+                        self.connection.execute("ROLLBACK")
+                    raise
+            print("Inventory database updated!")
+            return True
+        except:
+            print("Error saving inventory data")
+            return False
+
+    def lock(self):
+        """
+        Not needed, every batch order is its own transaction.
+
+        Returns:
+            Context manager that does nothing
+        """
+        return contextlib.nullcontext()
+
+    def close(self):
+        """
+        Closes the database connection.
+
+        Returns:
+            None
+        """
+        self.connection.close()
+
+
+def open_storage(filename="inventory.txt"):
+    """
+    Opens the storage backend that suits a file name.
+
+    Files ending in .db, .sqlite or .sqlite3 use SQLite, anything else
+    is a text inventory file.
+
+    Parameters:
+        filename (str): Name of inventory file or database
+
+    Returns:
+        TextStorage or SqliteStorage: Opened storage
+    """
+    if filename.lower().endswith((".db", ".sqlite", ".sqlite3")):
+        return SqliteStorage(filename)
+    return TextStorage(filename)
@@ -0,0 +1,43 @@
+"""
+Shared fixtures for the WeCare Beauty tests.
+
+Every test runs in its own empty directory, so inventory files, journals,
+documents and counters never leak from one test into another.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import customers
+import docwriter
+import events
+import pricing
+import write
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """
+    Runs a test in a fresh directory, where loading creates the sample inventory.
+
+    Returns:
+        pathlib.Path: The test directory
+    """
+    monkeypatch.chdir(tmp_path)
+
+    # Caches are keyed by relative file names, which now point elsewhere
+    customers.registries.clear()
+    pricing.active_rules.clear()
+    docwriter.document_index.clear()
+    docwriter.index_offsets.clear()
+    events.unpublished_lines.clear()
+
+    yield tmp_path
+
+    write.wait_for_compaction()
+    docwriter.flush_documents()
+
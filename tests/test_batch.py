@@ -0,0 +1,65 @@
+"""
+Tests for headless batch runs from order files.
+"""
+
+import os
+
+import storage
+from batch import run_batch
+from storage import open_storage
+
+
+ORDERS = """type,order,name,phone,product_id,quantity,new_cost,shipping
+sale,1,Asha,9800000001,1,2,,
+sale,1,Asha,9800000001,2,1,,
+restock,2,Supplier,,3,10,650,
+sale,3,Bina,9800000002,3,25,,y
+sale,4,Chet,9800000003,9,1,,
+"""
+
+
+def write_orders():
+    with open("orders.csv", "w") as order_file:
+        order_file.write(ORDERS)
+
+
+def document_files():
+    names = []
+    for directory, subdirectories, files in os.walk("."):
+        names.extend([name for name in files if name.startswith(("INV-", "PO-"))])
+    return sorted(names)
+
+
+def test_batch_applies_valid_orders_and_rejects_the_rest(workdir):
+    write_orders()
+
+    summary = run_batch("orders.csv")
+
+    assert (summary["invoices"], summary["purchase_forms"], summary["rejected"]) == (2, 1, 1)
+    assert summary["errors"][0].startswith("line 6: product_id")
+    inventory_data = open_storage("inventory.txt").load()
+    assert inventory_data.get_quantity(1) == 198
+    assert inventory_data.get_quantity(2) == 99
+    # 25 bought and 8 free
+    assert inventory_data.get_quantity(3) == 210 - 33
+    assert len(document_files()) == 3
+    assert os.path.exists("inventory.txt.history")
+
+
+def test_failed_save_writes_no_documents(workdir, monkeypatch):
+    write_orders()
+    open_storage("inventory.txt").load()
+    with monkeypatch.context() as patch:
+        patch.setattr(storage.TextStorage, "save", lambda self, inventory_data: False)
+        summary = run_batch("orders.csv")
+
+    assert (summary["invoices"], summary["purchase_forms"]) == (0, 0)
+    assert "inventory could not be saved" in summary["errors"][-1]
+    assert document_files() == []
+    assert not os.path.exists("inventory.txt.history")
+    assert not os.path.exists("inventory.txt.customers")
+    assert open_storage("inventory.txt").load().get_quantity(1) == 200
+
+    # The numbers of the lost orders go to the next run
+    run_batch("orders.csv")
+    assert document_files()[0].startswith("INV-10000_")
@@ -0,0 +1,35 @@
+"""
+Tests for where invoices and purchase forms are stored and found.
+"""
+
+import os
+
+from docwriter import find_document, flush_documents, get_document_dir
+from storage import open_storage
+from write import generate_invoice, generate_purchase_form
+
+
+def test_documents_are_kept_beside_the_inventory(workdir, monkeypatch):
+    os.mkdir("shop")
+    inventory_filename = os.path.join(str(workdir), "shop", "inventory.txt")
+    os.mkdir("elsewhere")
+    monkeypatch.chdir("elsewhere")
+
+    inventory_data = open_storage(inventory_filename).load()
+    invoice = generate_invoice("Asha Rai", "9800000001", [{"id": 1, "quantity": 1}],
+                               inventory_data, shipping=False)
+    form = generate_purchase_form("Supplier", [{"id": 2, "quantity": 3, "new_cost": None}],
+                                  inventory_data)
+    assert flush_documents() == []
+
+    directory = get_document_dir(inventory_filename)
+    assert invoice.startswith(os.path.join(directory, "INV", ""))
+    assert os.path.basename(invoice).startswith("INV-10000_Asha_Rai_")
+    assert os.path.exists(invoice)
+    assert os.listdir(".") == []
+
+    # The index is read the same way from any directory
+    monkeypatch.chdir(workdir)
+    assert find_document("INV-10000", directory) == invoice
+    assert find_document("PO-10000", directory) == form
+    assert find_document("INV-99999", directory) is None
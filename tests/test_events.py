@@ -0,0 +1,139 @@
+"""
+Tests for the stock event feed and its consumer cursors.
+"""
+
+import os
+
+import pytest
+
+from batch import run_batch
+from events import EventCursor, get_events_filename, publish_events, read_events
+from storage import open_storage
+from write import commit_restock, commit_sale, generate_invoice, generate_purchase_form
+
+
+BACKENDS = ["inventory.txt", "inventory.db"]
+
+ORDERS = """type,order,name,phone,product_id,quantity,new_cost,shipping
+sale,1,Asha,9800000001,1,2,,
+sale,1,Asha,9800000001,2,1,,
+restock,2,Supplier,,3,10,650,
+sale,3,Bina,9800000002,3,1,,y
+"""
+
+
+def all_events(filename):
+    events, offset = read_events(filename, limit=None)
+    return [event for offset, event in events]
+
+
+@pytest.mark.parametrize("filename", BACKENDS)
+def test_sales_and_restocks_are_published(workdir, filename):
+    storage = open_storage(filename)
+    inventory_data = storage.load()
+    generate_invoice("Asha", "9800000001", [{"id": 1, "quantity": 2}],
+                     inventory_data, shipping=False)
+    generate_purchase_form("Supplier", [{"id": 2, "quantity": 5, "new_cost": 300.0}],
+                           inventory_data)
+    storage.close()
+
+    events = all_events(filename)
+    assert [(event["kind"], event["product"], event["quantity_change"], event["stock"])
+            for event in events] == [("SALE", 1, -2, 198), ("RESTOCK", 2, 5, 105)]
+    assert events[1]["cost"] == 300.0
+
+
+@pytest.mark.parametrize("filename", BACKENDS)
+def test_batch_run_publishes_every_order(workdir, filename):
+    open_storage(filename).close()
+    with open("orders.csv", "w") as order_file:
+        order_file.write(ORDERS)
+
+    summary = run_batch("orders.csv", filename)
+
+    assert summary["rejected"] == 0
+    assert [(event["kind"], event["product"], event["quantity_change"])
+            for event in all_events(filename)] == [
+        ("SALE", 1, -2), ("SALE", 2, -1), ("RESTOCK", 3, 10), ("SALE", 3, -1)]
+
+
+@pytest.mark.parametrize("filename", BACKENDS)
+def test_full_save_publishes_unrecorded_changes(workdir, filename):
+    storage = open_storage(filename)
+    inventory_data = storage.load()
+    commit_sale("INV-1", [{"id": 1, "quantity": 2}], inventory_data, save=False)
+    commit_restock("PO-1", [{"id": 2, "quantity": 4, "new_cost": None}], inventory_data,
+                   save=False)
+    assert all_events(filename) == []
+
+    assert storage.save(inventory_data)
+    storage.close()
+
+    assert [(event["document"], event["product"], event["stock"])
+            for event in all_events(filename)] == [("INV-1", 1, 198), ("PO-1", 2, 104)]
+    assert inventory_data.unsaved_records == []
+
+
+def test_cursor_hands_out_events_until_committed(workdir):
+    storage = open_storage("inventory.txt")
+    inventory_data = storage.load()
+    for product_id in (1, 2, 3):
+        generate_invoice("Asha", "9800000001", [{"id": product_id, "quantity": 1}],
+                         inventory_data, shipping=False)
+
+    cursor = EventCursor("reports")
+    assert [event["product"] for offset, event in cursor.poll(limit=2)] == [1, 2]
+
+    # Not committed, so the events come back
+    cursor.rewind()
+    assert [event["product"] for offset, event in cursor.poll(limit=2)] == [1, 2]
+    cursor.commit()
+
+    # A new cursor with the same name carries on after the commit
+    cursor = EventCursor("reports")
+    assert [event["product"] for offset, event in cursor.poll()] == [3]
+    assert cursor.poll() == []
+    assert [event["product"] for offset, event in EventCursor("audit").poll()] == [1, 2, 3]
+
+
+def test_line_still_being_written_is_left_for_later(workdir):
+    storage = open_storage("inventory.txt")
+    inventory_data = storage.load()
+    generate_invoice("Asha", "9800000001", [{"id": 1, "quantity": 1}],
+                     inventory_data, shipping=False)
+    with open(get_events_filename(), "a") as events_file:
+        events_file.write('{"kind":"SALE","prod')
+
+    cursor = EventCursor("reports")
+    assert len(cursor.poll()) == 1
+    cursor.commit()
+
+    # The next event starts on a line of its own
+    generate_invoice("Asha", "9800000001", [{"id": 2, "quantity": 1}],
+                     inventory_data, shipping=False)
+    assert [event["product"] for offset, event in cursor.poll()] == [2]
+
+
+def test_events_that_could_not_be_written_are_retried(workdir, monkeypatch):
+    storage = open_storage("inventory.txt")
+    inventory_data = storage.load()
+    generate_invoice("Asha", "9800000001", [{"id": 1, "quantity": 1}],
+                     inventory_data, shipping=False)
+    size = os.path.getsize(get_events_filename())
+
+    def fail(descriptor):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(os, "fsync", fail)
+        assert not publish_events([("SALE", "INV-1", [{"id": 2, "quantity_change": -1,
+                                                       "stock": 99, "cost": 280.0}],
+                                    None)])
+
+    # The failed write was taken back
+    assert os.path.getsize(get_events_filename()) == size
+
+    generate_invoice("Asha", "9800000001", [{"id": 3, "quantity": 1}],
+                     inventory_data, shipping=False)
+    assert [(event["document"], event["product"]) for event in all_events("inventory.txt")] == [
+        ("INV-10000", 1), ("INV-1", 2), ("INV-10001", 3)]
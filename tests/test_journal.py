@@ -0,0 +1,128 @@
+"""
+Tests for the stock journal and its background compaction.
+"""
+
+import os
+import threading
+
+import journal
+import write
+from locking import inventory_lock
+from read import get_inventory_data
+from write import generate_invoice, generate_purchase_form, save_inventory
+
+
+def sell(inventory_data, product_id, quantity):
+    return generate_invoice("Test Customer", "9800000000",
+                            [{"id": product_id, "quantity": quantity}],
+                            inventory_data, shipping=False)
+
+
+def test_sale_is_journalled_not_saved(workdir):
+    inventory_data = get_inventory_data()
+    with open("inventory.txt") as inventory_file:
+        before = inventory_file.read()
+
+    assert sell(inventory_data, 1, 2) is not None
+
+    with open("inventory.txt") as inventory_file:
+        assert inventory_file.read() == before
+    entries, offset = journal.read_journal("inventory.txt.journal")
+    assert entries == [(1, 198, 1000.0)]
+    assert offset == os.path.getsize("inventory.txt.journal")
+
+
+def test_journal_is_replayed_on_load(workdir):
+    inventory_data = get_inventory_data()
+    sell(inventory_data, 1, 2)
+    generate_purchase_form("Supplier", [{"id": 2, "quantity": 5, "new_cost": 300.0}],
+                           inventory_data)
+
+    loaded = get_inventory_data()
+    assert loaded.get_quantity(1) == 198
+    assert loaded.get_quantity(2) == 105
+    assert loaded.get_cost(2) == 300.0
+
+
+def test_torn_transaction_is_ignored(workdir):
+    get_inventory_data()
+    journal.append_journal("SALE", "INV-1", [{"id": 1, "quantity_change": -1,
+                                              "stock": 199, "cost": 1000.0}])
+    complete = os.path.getsize("inventory.txt.journal")
+
+    # A crash in the middle of the next transaction
+    with open("inventory.txt.journal", "a") as journal_file:
+        journal_file.write("SALE, INV-2, 1, -5, 194, 1000.0\n")
+        journal_file.write("END, INV")
+
+    entries, offset = journal.read_journal("inventory.txt.journal")
+    assert entries == [(1, 199, 1000.0)]
+    assert offset == complete
+    assert get_inventory_data().get_quantity(1) == 199
+
+
+def test_compaction_folds_journal_into_file(workdir, monkeypatch):
+    monkeypatch.setattr(write, "COMPACT_SIZE", 1)
+    inventory_data = get_inventory_data()
+
+    sell(inventory_data, 1, 2)
+    write.wait_for_compaction()
+
+    assert not os.path.exists("inventory.txt.journal")
+    assert not os.path.exists("inventory.txt.journal.old")
+    assert get_inventory_data().get_quantity(1) == 198
+
+
+def test_compaction_keeps_changes_recorded_while_it_waits(workdir, monkeypatch):
+    monkeypatch.setattr(write, "COMPACT_SIZE", 1)
+    inventory_data = get_inventory_data()
+
+    # Hold the lock so the compaction thread waits behind these sales
+    with inventory_lock("inventory.txt"):
+        sell(inventory_data, 1, 2)
+        monkeypatch.setattr(write, "COMPACT_SIZE", 1024 * 1024)
+        sell(inventory_data, 1, 1)
+        sell(inventory_data, 3, 2)
+    write.wait_for_compaction()
+
+    assert not os.path.exists("inventory.txt.journal.old")
+    loaded = get_inventory_data()
+    assert loaded.get_quantity(1) == 197
+    assert loaded.get_quantity(3) == 198
+
+
+def test_stale_compaction_does_not_replace_newer_save(workdir, monkeypatch):
+    monkeypatch.setattr(write, "COMPACT_SIZE", 1)
+    inventory_data = get_inventory_data()
+
+    with inventory_lock("inventory.txt"):
+        sell(inventory_data, 1, 2)
+
+        # A full save lands before the compaction gets the lock
+        inventory_data.set_quantity(2, 42)
+        assert save_inventory(inventory_data)
+    write.wait_for_compaction()
+
+    loaded = get_inventory_data()
+    assert loaded.get_quantity(1) == 198
+    assert loaded.get_quantity(2) == 42
+
+
+def test_concurrent_sales_during_compaction_are_not_lost(workdir, monkeypatch):
+    monkeypatch.setattr(write, "COMPACT_SIZE", 200)
+    results = []
+
+    def counter():
+        inventory_data = get_inventory_data()
+        for sale in range(20):
+            results.append(sell(inventory_data, 3, 1))
+
+    threads = [threading.Thread(target=counter) for number in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    write.wait_for_compaction()
+
+    assert None not in results
+    assert get_inventory_data().get_quantity(3) == 120
@@ -0,0 +1,29 @@
+"""
+Tests for the console menus.
+"""
+
+import builtins
+
+import render
+from operation import view_inventory
+from read import get_inventory_data
+
+
+def answer(monkeypatch, *replies):
+    replies = list(replies)
+    monkeypatch.setattr(builtins, "input", lambda prompt="": replies.pop(0))
+
+
+def test_view_inventory_pages_through_every_product(workdir, monkeypatch, capsys):
+    inventory_data = get_inventory_data()
+    renderer = render.CatalogueRenderer(inventory_data, render.format_table_row, 2)
+    capsys.readouterr()
+    answer(monkeypatch, "n", "n", "p", "")
+
+    view_inventory(inventory_data, renderer)
+
+    output = capsys.readouterr().out
+    assert [line for line in output.splitlines() if line.startswith("Page")] == [
+        "Page 1 of 2", "Page 2 of 2", "Page 2 of 2", "Page 1 of 2"]
+    assert "Sunscreen" in output
+    assert "India" in output
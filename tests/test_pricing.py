@@ -0,0 +1,130 @@
+"""
+Tests for pricing rules and basket pricing.
+"""
+
+import datetime
+
+import pytest
+
+from pricing import (check_pricing_rules, get_pricing_filename, parse_rule, price_basket,
+                     refresh_prices)
+from read import get_inventory_data
+
+
+RULES = """# Store rules
+markup, all, 2
+markup, brand Cetaphil, 2.5
+discount, origin India, 10
+free, product 3, 2+1
+bundle, product 1 2, 15
+"""
+
+
+def write_rules(text):
+    with open(get_pricing_filename("inventory.txt"), "w") as rules_file:
+        rules_file.write(text)
+
+
+def prices(inventory_data):
+    refresh_prices(inventory_data)
+    return [inventory_data.prices[product_id] for product_id in inventory_data.product_ids()]
+
+
+def test_default_rules_without_a_file(workdir):
+    inventory_data = get_inventory_data()
+
+    basket = price_basket(inventory_data, [{"id": 1, "quantity": 3}, {"id": 2, "quantity": 2}])
+
+    assert prices(inventory_data) == [3000.0, 840.0, 2100.0]
+    assert [(line["free"], line["units"]) for line in basket["lines"]] == [(1, 4), (0, 2)]
+    assert basket["total"] == 3 * 3000.0 + 2 * 840.0
+    assert basket["stock_used"] == {1: 4, 2: 2}
+
+
+def test_rules_file_sets_prices_and_offers(workdir):
+    write_rules(RULES)
+    inventory_data = get_inventory_data()
+
+    assert prices(inventory_data) == [2000.0, 700.0, 1260.0]
+
+    basket = price_basket(inventory_data, [{"id": 3, "quantity": 4},
+                                           {"id": 1, "quantity": 3}])
+    assert [line["free"] for line in basket["lines"]] == [2, 0]
+    assert basket["stock_used"] == {3: 6, 1: 3}
+
+
+def test_bundle_discount_applies_to_complete_sets(workdir):
+    write_rules(RULES)
+    inventory_data = get_inventory_data()
+
+    basket = price_basket(inventory_data, [{"id": 1, "quantity": 2}, {"id": 2, "quantity": 1}])
+
+    # One full set of products 1 and 2
+    assert basket["total"] == pytest.approx(2 * 2000.0 + 700.0 - 0.15 * (2000.0 + 700.0))
+    assert price_basket(inventory_data, [{"id": 1, "quantity": 2}])["total"] == 4000.0
+
+
+def test_most_specific_and_latest_rule_wins(workdir):
+    write_rules("markup, all, 2\n"
+                "markup, cost 500, 4\n"
+                "markup, origin France, 5\n"
+                "markup, product 1, 6\n"
+                "markup, cost 500, 3\n")
+    inventory_data = get_inventory_data()
+
+    assert prices(inventory_data) == [6000.0, 560.0, 2100.0]
+
+
+def test_rules_outside_their_dates_are_left_out(workdir):
+    today = datetime.date.today()
+    write_rules("discount, all, 50, %s, %s\n"
+                "free, all, 1+1, %s\n" % (today - datetime.timedelta(days=7),
+                                         today - datetime.timedelta(days=1),
+                                         today + datetime.timedelta(days=1)))
+    inventory_data = get_inventory_data()
+
+    basket = price_basket(inventory_data, [{"id": 2, "quantity": 2}])
+
+    assert basket["lines"][0]["price"] == 280.0
+    assert basket["lines"][0]["free"] == 0
+
+
+def test_invalid_lines_are_skipped(workdir, capsys):
+    write_rules("markup, all, 2\n"
+                "markup, everything, 9\n"
+                "discount, brand Garnier, 10\n")
+
+    inventory_data = get_inventory_data()
+
+    assert prices(inventory_data) == [1800.0, 560.0, 1400.0]
+    assert "Ignoring pricing rule on line 2" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("line", [
+    "markup, all",
+    "sale, all, 10",
+    "markup, all, 0",
+    "discount, all, 120",
+    "free, all, 0+1",
+    "markup, product 1 2, 2",
+    "bundle, product 1, 10",
+    "markup, brand, 2",
+    "discount, all, 10, tomorrow",
+])
+def test_invalid_rule_is_an_error(line):
+    with pytest.raises(ValueError):
+        parse_rule(line)
+
+
+def test_rules_are_read_again_when_the_file_changes(workdir):
+    write_rules("markup, all, 2\n")
+    inventory_data = get_inventory_data()
+    assert prices(inventory_data) == [2000.0, 560.0, 1400.0]
+    rules = check_pricing_rules("inventory.txt")
+
+    # Unchanged file, the compiled rules are kept
+    assert check_pricing_rules("inventory.txt") is rules
+
+    write_rules("markup, all, 2.5\nfree, all, 2+1\n")
+    assert prices(inventory_data) == [2500.0, 700.0, 1750.0]
+    assert price_basket(inventory_data, [{"id": 1, "quantity": 2}])["lines"][0]["free"] == 1
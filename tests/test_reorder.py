@@ -0,0 +1,69 @@
+"""
+Tests for low stock alerts and purchase list drafts.
+"""
+
+from read import get_inventory_data
+from reorder import ReorderEngine, get_suppliers_filename
+from write import generate_invoice, save_inventory
+
+
+def sell(inventory_data, product_id, quantity):
+    return generate_invoice("Test Customer", "9800000000",
+                            [{"id": product_id, "quantity": quantity}],
+                            inventory_data, shipping=False)
+
+
+def test_sales_count_towards_the_sales_rate(workdir):
+    inventory_data = get_inventory_data()
+    engine = ReorderEngine(inventory_data)
+
+    sell(inventory_data, 3, 12)
+
+    # Buy 3 get 1 free, so 16 units leave the shelf
+    assert engine.low_stock(cover_days=1000) == [(3, 184 / (16 / 28.0), 184, 16 / 28.0)]
+
+
+def test_stock_corrections_are_not_sales(workdir):
+    inventory_data = get_inventory_data()
+    engine = ReorderEngine(inventory_data)
+
+    # A count correction and a write-down of damaged stock
+    inventory_data.set_quantity(1, 20)
+    inventory_data.set_quantity(2, 5)
+    assert save_inventory(inventory_data)
+
+    assert engine.velocity(1) == 0
+    assert engine.velocity(2) == 0
+    assert engine.low_stock() == []
+
+
+def test_sales_at_other_counters_are_counted(workdir):
+    engine = ReorderEngine(get_inventory_data())
+
+    sell(get_inventory_data(), 2, 3)
+
+    assert engine.low_stock(cover_days=1000)[0][0] == 2
+    assert engine.velocity(2) == 4 / 28.0
+
+
+def test_new_engine_reads_sales_from_history(workdir):
+    inventory_data = get_inventory_data()
+    sell(inventory_data, 1, 3)
+
+    engine = ReorderEngine(get_inventory_data())
+
+    # Counted once, from the history and not again from the events
+    assert engine.low_stock(cover_days=2000)[0][0] == 1
+    assert engine.velocity(1) == 4 / 28.0
+
+
+def test_suppliers_are_read_next_to_the_inventory(workdir):
+    inventory_data = get_inventory_data()
+    sell(inventory_data, 2, 72)
+    with open(get_suppliers_filename("inventory.txt"), "w") as suppliers_file:
+        suppliers_file.write("Cetaphil, Galderma Traders\n")
+
+    drafts = ReorderEngine(inventory_data).draft_purchase_lists()
+
+    assert list(drafts) == ["Galderma Traders"]
+    assert drafts["Galderma Traders"][0]["id"] == 2
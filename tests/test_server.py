@@ -0,0 +1,137 @@
+"""
+Tests for the JSON API: request checks, status codes and saved orders.
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from server import InventoryServer
+from storage import open_storage
+
+
+@pytest.fixture
+def inventory_server(workdir):
+    inventory_server = InventoryServer(open_storage())
+    yield inventory_server
+    inventory_server.close()
+
+
+def call(inventory_server, method, target, payload=None):
+    """
+    Routes one request the way a connection would, with the order writer running.
+    """
+    async def run():
+        inventory_server.orders = asyncio.Queue()
+        writer_task = asyncio.create_task(inventory_server.order_writer())
+        try:
+            body = b""
+            if payload is not None:
+                body = json.dumps(payload).encode("utf-8")
+            return await inventory_server.route(method, target, body)
+        finally:
+            writer_task.cancel()
+    return asyncio.run(run())
+
+
+def sale(quantity, **fields):
+    payload = {"name": "Asha", "phone": "9800000001",
+               "items": [{"id": 2, "quantity": quantity}]}
+    payload.update(fields)
+    return payload
+
+
+def test_sale_is_saved_and_returns_new_stock(inventory_server):
+    status, response = call(inventory_server, "POST", "/sales", sale(2, shipping=True))
+
+    assert status == 200
+    assert response["stock"] == {"2": 98}
+    assert open_storage().load().get_quantity(2) == 98
+
+
+def test_restock_is_saved(inventory_server):
+    status, response = call(inventory_server, "POST", "/restocks",
+                            {"name": "Supplier", "items": [{"id": 3, "quantity": 5,
+                                                            "new_cost": 650}]})
+
+    assert status == 200
+    assert response["stock"] == {"3": 205}
+    assert open_storage().load().get_cost(3) == 650.0
+
+
+def test_not_enough_stock_is_a_conflict(inventory_server):
+    status, response = call(inventory_server, "POST", "/sales", sale(500))
+
+    assert status == 409
+    assert "not enough stock" in response["error"]
+    assert open_storage().load().get_quantity(2) == 100
+
+
+@pytest.mark.parametrize("payload", [
+    sale(0),
+    sale("two"),
+    {"name": "Asha", "phone": "9800000001", "items": [{"id": 99, "quantity": 1}]},
+    {"name": "", "phone": "9800000001", "items": [{"id": 1, "quantity": 1}]},
+    {"name": "Asha", "phone": "9800000001", "items": []},
+])
+def test_invalid_sale_is_a_bad_request(inventory_server, payload):
+    status, response = call(inventory_server, "POST", "/sales", payload)
+
+    assert status == 400
+    assert open_storage().load().get_quantity(2) == 100
+
+
+@pytest.mark.parametrize("shipping", ["no", "N", 1, None])
+def test_shipping_must_be_true_or_false(inventory_server, shipping):
+    status, response = call(inventory_server, "POST", "/sales", sale(1, shipping=shipping))
+
+    assert status == 400
+    assert response["error"] == "shipping must be true or false"
+
+
+def test_body_must_be_a_json_object(inventory_server):
+    assert asyncio.run(inventory_server.route("POST", "/sales", b"[1, 2]"))[0] == 400
+    assert asyncio.run(inventory_server.route("POST", "/sales", b"{bad"))[0] == 400
+
+
+def test_reads_and_unknown_paths(inventory_server):
+    status, response = call(inventory_server, "GET", "/products?page=1")
+    assert status == 200
+    assert [product["id"] for product in response["products"]] == [1, 2, 3]
+
+    assert call(inventory_server, "GET", "/products/2")[1]["brand"] == "Cetaphil"
+    assert call(inventory_server, "GET", "/products/9")[0] == 404
+    assert call(inventory_server, "GET", "/products?page=x")[0] == 400
+    assert call(inventory_server, "GET", "/sales")[0] == 405
+    assert call(inventory_server, "GET", "/nothing")[0] == 404
+
+
+def test_requests_over_a_connection(inventory_server):
+    async def run():
+        inventory_server.orders = asyncio.Queue()
+        writer_task = asyncio.create_task(inventory_server.order_writer())
+        listener = await asyncio.start_server(inventory_server.handle_connection,
+                                              "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            body = json.dumps(sale(1, shipping=False)).encode("utf-8")
+            writer.write(b"POST /sales HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % len(body)
+                         + body)
+            writer.write(b"GET /products/2 HTTP/1.1\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            data = await reader.read()
+            writer.close()
+            return data
+        finally:
+            writer_task.cancel()
+            listener.close()
+            await listener.wait_closed()
+
+    data = asyncio.run(run()).decode("utf-8")
+
+    assert data.startswith("HTTP/1.1 200 OK\r\n")
+    assert data.count("HTTP/1.1 200 OK") == 2
+    assert data.rstrip().endswith('"origin": "Switzerland"}')
+    assert '"quantity": 99' in data
@@ -0,0 +1,95 @@
+"""
+Tests for checksummed inventory snapshots and their older generations.
+"""
+
+import os
+import zlib
+
+import pytest
+
+from read import get_inventory_data
+from snapshot import get_binary_filename, parse_header
+from write import save_inventory
+
+
+def save_quantities(*quantities):
+    """
+    Saves the sample inventory once for each stock level of product 1.
+    """
+    inventory_data = get_inventory_data()
+    for quantity in quantities:
+        inventory_data.set_quantity(1, quantity)
+        assert save_inventory(inventory_data)
+
+
+def damage(filename):
+    """
+    Changes one product line without updating the header.
+    """
+    with open(filename, "rb") as snapshot_file:
+        data = snapshot_file.read()
+    header_end = data.index(b"\n") + 1
+    body = data[header_end:].replace(b"Garnier", b"Garnjer", 1)
+    with open(filename, "wb") as snapshot_file:
+        snapshot_file.write(data[:header_end] + body)
+    if os.path.exists(get_binary_filename(filename)):
+        os.remove(get_binary_filename(filename))
+
+
+def test_header_matches_product_lines(workdir):
+    save_quantities(150)
+
+    with open("inventory.txt", "rb") as snapshot_file:
+        header_line = snapshot_file.readline()
+        body = snapshot_file.read()
+    header = parse_header(header_line.decode("utf-8"))
+    assert header["products"] == 3
+    assert header["crc32"] == zlib.crc32(body)
+
+
+def test_file_without_header_still_loads(workdir):
+    inventory_data = get_inventory_data()
+
+    assert len(inventory_data) == 3
+    with open("inventory.txt") as snapshot_file:
+        assert parse_header(snapshot_file.readline()) is None
+
+
+def test_damaged_file_falls_back_to_older_snapshot(workdir, capsys):
+    save_quantities(150, 120)
+    capsys.readouterr()
+    damage("inventory.txt")
+
+    inventory_data = get_inventory_data()
+
+    assert inventory_data.get_quantity(1) == 150
+    assert inventory_data.get_brand(1) == "Garnier"
+    assert "Loaded older inventory file 'inventory.txt.1'" in capsys.readouterr().out
+
+
+def test_every_snapshot_damaged_is_an_error(workdir):
+    save_quantities(150, 120, 90, 60)
+    for filename in ("inventory.txt", "inventory.txt.1", "inventory.txt.2",
+                     "inventory.txt.3"):
+        damage(filename)
+
+    with pytest.raises(ValueError):
+        get_inventory_data()
+
+    # The damaged file is left for repair, not replaced by sample data
+    with open("inventory.txt", "rb") as snapshot_file:
+        assert b"Garnjer" in snapshot_file.read()
+
+
+def test_damaged_binary_copy_is_not_used(workdir):
+    save_quantities(150)
+    with open(get_binary_filename("inventory.txt"), "r+b") as binary_file:
+        binary_file.seek(-1, os.SEEK_END)
+        last = binary_file.read(1)
+        binary_file.seek(-1, os.SEEK_END)
+        binary_file.write(bytes([last[0] ^ 0xFF]))
+
+    inventory_data = get_inventory_data()
+
+    assert inventory_data.get_quantity(1) == 150
+    assert inventory_data.get_origin(3) == "India"
@@ -0,0 +1,112 @@
+"""
+Tests for the SQLite inventory, its transactions and its ledger.
+"""
+
+import sqlite3
+
+import pytest
+
+from read import get_inventory_data
+from storage import open_storage
+from write import generate_invoice, generate_purchase_form, save_inventory
+
+
+def load():
+    storage = open_storage("inventory.db")
+    return storage, storage.load()
+
+
+def query(sql):
+    connection = sqlite3.connect("inventory.db")
+    try:
+        return connection.execute(sql).fetchall()
+    finally:
+        connection.close()
+
+
+def test_sale_updates_row_ledger_and_document(workdir):
+    storage, inventory_data = load()
+
+    assert generate_invoice("Asha", "9800000001", [{"id": 1, "quantity": 3}],
+                            inventory_data, shipping=False) is not None
+    storage.close()
+
+    assert query("SELECT quantity FROM products WHERE id = 1") == [(196,)]
+    assert query("SELECT document, kind, product_id, quantity_change, stock FROM ledger") == [
+        ("INV-10000", "SALE", 1, -4, 196)]
+    assert query("SELECT number, kind, name, phone FROM documents") == [
+        ("INV-10000", "SALE", "Asha", "9800000001")]
+
+
+def test_failed_transaction_is_rolled_back(workdir):
+    storage, inventory_data = load()
+    generate_purchase_form("Supplier", [{"id": 2, "quantity": 5, "new_cost": 300.0}],
+                           inventory_data)
+    last_change_id = storage.last_change_id
+
+    with pytest.raises(OSError):
+        with storage.transaction(inventory_data):
+            storage.record("SALE", "INV-1", [{"id": 2, "quantity_change": -5, "stock": 100,
+                                              "cost": 300.0}], inventory_data, {})
+            raise OSError("counter closed")
+
+    assert storage.last_change_id == last_change_id
+    assert not storage.connection.in_transaction
+    storage.close()
+
+    assert query("SELECT quantity, cost FROM products WHERE id = 2") == [(105, 300.0)]
+    assert query("SELECT document FROM ledger") == [("PO-10000",)]
+    assert query("SELECT number FROM documents") == [("PO-10000",)]
+
+
+def test_counter_catches_up_with_another_counter(workdir):
+    first, first_data = load()
+    second, second_data = load()
+
+    generate_invoice("Asha", "9800000001", [{"id": 3, "quantity": 2}],
+                     first_data, shipping=False)
+    generate_purchase_form("Supplier", [{"id": 1, "quantity": 10, "new_cost": 900.0}],
+                           first_data)
+    second.sync(second_data)
+
+    assert second_data.get_quantity(3) == 198
+    assert second_data.get_quantity(1) == 210
+    assert second_data.get_cost(1) == 900.0
+    assert second.last_change_id == first.last_change_id
+    first.close()
+    second.close()
+
+
+def test_full_save_makes_other_counters_reload(workdir):
+    first, first_data = load()
+    second, second_data = load()
+
+    # Not recorded in the ledger, only a full save carries it
+    first_data.set_quantity(2, 42)
+    assert first.save(first_data)
+    assert first.generation == 1
+
+    second.sync(second_data)
+    assert second.generation == 1
+    assert second_data.get_quantity(2) == 42
+
+    # Ledger entries after the save are still picked up
+    generate_invoice("Asha", "9800000001", [{"id": 2, "quantity": 1}],
+                     first_data, shipping=False)
+    second.sync(second_data)
+    assert second_data.get_quantity(2) == 41
+    first.close()
+    second.close()
+
+
+def test_new_database_imports_text_inventory(workdir):
+    text_data = get_inventory_data()
+    text_data.set_quantity(3, 77)
+    assert save_inventory(text_data)
+
+    storage, inventory_data = load()
+
+    assert len(inventory_data) == 3
+    assert inventory_data.get_quantity(3) == 77
+    assert inventory_data.filename == "inventory.db"
+    storage.close()
@@ -0,0 +1,152 @@
+"""
+Tests for sales and restocks made by several counters at once.
+"""
+
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+import write
+from locking import inventory_lock
+from read import get_inventory_data
+from storage import open_storage
+from write import (commit_restock, generate_invoice, generate_purchase_form,
+                   group_transaction)
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# One counter process selling product 3 one unit at a time
+COUNTER_SCRIPT = textwrap.dedent("""
+    import sys
+    from numbering import close_allocators
+    from storage import open_storage
+    from write import generate_invoice
+
+    storage = open_storage(sys.argv[1])
+    inventory_data = storage.load()
+    for sale in range(int(sys.argv[2])):
+        if generate_invoice("Counter", "9800000000", [{"id": 3, "quantity": 1}],
+                            inventory_data, shipping=False) is None:
+            sys.exit(1)
+    close_allocators()
+    storage.close()
+""")
+
+BACKENDS = ["inventory.txt", "inventory.db"]
+
+
+def load(filename):
+    storage = open_storage(filename)
+    inventory_data = storage.load()
+    return storage, inventory_data
+
+
+def fail(*args, **kwargs):
+    raise OSError("disk full")
+
+
+@pytest.mark.parametrize("filename", BACKENDS)
+def test_counter_processes_do_not_lose_sales(workdir, filename):
+    storage, inventory_data = load(filename)
+    storage.close()
+
+    environment = dict(os.environ, PYTHONPATH=REPO_DIR)
+    counters = [subprocess.Popen([sys.executable, "-c", COUNTER_SCRIPT, filename, "15"],
+                                 env=environment, stdout=subprocess.DEVNULL)
+                for number in range(4)]
+    assert [counter.wait(timeout=120) for counter in counters] == [0, 0, 0, 0]
+
+    storage, inventory_data = load(filename)
+    assert inventory_data.get_quantity(3) == 140
+    storage.close()
+
+    # Every invoice got its own number
+    with open(filename + ".inv.counter") as counter_file:
+        assert int(counter_file.read()) >= 10060
+
+
+def test_counter_sees_journal_moved_aside_before_it_looked(workdir, monkeypatch):
+    first = get_inventory_data()
+    second = get_inventory_data()
+    monkeypatch.setattr(write, "COMPACT_SIZE", 1)
+
+    # The compaction started by the first sale waits for the lock
+    with inventory_lock("inventory.txt"):
+        generate_invoice("Customer", "9800000000", [{"id": 1, "quantity": 2}],
+                         first, shipping=False)
+        generate_invoice("Customer", "9800000000", [{"id": 1, "quantity": 1}],
+                         second, shipping=False)
+        assert second.get_quantity(1) == 197
+    write.wait_for_compaction()
+
+    assert get_inventory_data().get_quantity(1) == 197
+
+
+@pytest.mark.parametrize("filename", BACKENDS)
+def test_sale_that_is_not_recorded_leaves_stock_alone(workdir, monkeypatch, filename):
+    storage, inventory_data = load(filename)
+    with monkeypatch.context() as patch:
+        if storage.single_save:
+            patch.setattr(write, "append_journal_transactions", fail)
+        else:
+            patch.setattr(storage, "record", fail)
+
+        assert generate_invoice("Customer", "9800000000", [{"id": 1, "quantity": 2}],
+                                inventory_data, shipping=False) is None
+        assert inventory_data.get_quantity(1) == 200
+
+    # The next sale is checked against the real stock and saved
+    assert generate_invoice("Customer", "9800000000", [{"id": 1, "quantity": 1}],
+                            inventory_data, shipping=False) is not None
+    storage.close()
+
+    storage, inventory_data = load(filename)
+    assert inventory_data.get_quantity(1) == 199
+    storage.close()
+
+
+@pytest.mark.parametrize("filename", BACKENDS)
+def test_restock_that_is_not_recorded_leaves_cost_alone(workdir, monkeypatch, filename):
+    storage, inventory_data = load(filename)
+    if storage.single_save:
+        monkeypatch.setattr(write, "append_journal_transactions", fail)
+    else:
+        monkeypatch.setattr(storage, "record", fail)
+
+    assert generate_purchase_form("Supplier", [{"id": 2, "quantity": 10, "new_cost": 1.0}],
+                                  inventory_data) is None
+    assert inventory_data.get_quantity(2) == 100
+    assert inventory_data.get_cost(2) == 280.0
+    storage.close()
+
+
+@pytest.mark.parametrize("filename", BACKENDS)
+def test_failed_group_restores_stock_and_numbers(workdir, filename):
+    storage, inventory_data = load(filename)
+
+    with pytest.raises(OSError):
+        with group_transaction(inventory_data):
+            commit_restock("PO-1", [{"id": 1, "quantity": 5, "new_cost": 9.0}],
+                           inventory_data)
+            generate_invoice("Customer", "9800000000", [{"id": 2, "quantity": 2}],
+                             inventory_data, shipping=False)
+            raise OSError("counter closed")
+
+    assert inventory_data.get_quantity(1) == 200
+    assert inventory_data.get_cost(1) == 1000.0
+    assert inventory_data.get_quantity(2) == 100
+    storage.close()
+
+    storage, inventory_data = load(filename)
+    assert inventory_data.get_quantity(1) == 200
+    assert inventory_data.get_quantity(2) == 100
+
+    # The invoice number of the group goes to the next invoice
+    invoice_filename = generate_invoice("Customer", "9800000000", [{"id": 2, "quantity": 1}],
+                                        inventory_data, shipping=False)
+    assert os.path.basename(invoice_filename).startswith("INV-10000_")
+    storage.close()
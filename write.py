@@ -3,296 +3,902 @@ File writing module for the WeCare Beauty System.
 Handles inventory updates and document generation.
 """
 
+import contextlib
 import datetime
-import random
+import os
+import threading
+from customers import record_customer_visit
+from docwriter import get_document_dir, get_document_path, submit_document
+from events import publish_events
+from journal import (COMPACT_SIZE, append_journal_transactions, apply_journal_entries,
+                     clear_journal, get_compacting_filename, get_journal_filename,
+                     start_compaction, finish_compaction)
+from locking import inventory_lock
+from metrics import SIZE_BUCKETS, count, observe, record_error, timed
+from numbering import next_document_number, release_document_number
+from pricing import price_basket, refresh_prices
+from reports import record_history
+from snapshot import write_binary_snapshot, write_snapshot
+from read import get_file_stamp, refresh_inventory
+
+
+# Charge added to an invoice when the order is shipped
+SHIPPING_FEE = 500
+
+# Histogram bucket limits for invoice totals
+AMOUNT_BUCKETS = (500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+# Background compaction that is currently running, if any
+compaction_thread = None
+
+
+def write_inventory_file(inventory_data, filename):
+    """
+    Writes every product to an inventory file.
+
+    Parameters:
+        inventory_data (Inventory): Product information
+        filename (str): Name of file to write
+
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    try:
+        # Written beside the real file and swapped in, so a crash keeps the old one
+        header_line = write_snapshot(inventory_data, filename)
 
+    except:
+        record_error("inventory_save")
+        print("Error saving inventory data")
+        return False
+
+    try:
+        # Binary copy for fast loading; a missing one is rebuilt when loading
+        write_binary_snapshot(inventory_data, filename, header_line)
+    except:
+        record_error("binary_save")
+    return True
 
-def save_inventory(inventory_data, filename="inventory.txt"):
+
+@timed("inventory_save")
+def save_inventory(inventory_data, filename="inventory.txt", show_message=True):
     """
     Saves inventory data to file.
 
+    The saved file already holds every journalled change, so the journal
+    is cleared afterwards. Both happen under the inventory lock, so a
+    compaction still waiting for the lock sees the new file and drops
+    its older snapshot.
+
     Parameters:
-        inventory_data (list): List of product information
+        inventory_data (Inventory): Product information
         filename (str): Name of file to save to
+        show_message (bool): Whether to print a message when done
 
     Returns:
         bool: True if successful, False otherwise
     """
-    try:
-        # Open file for writing
-        file = open(filename, "w")
+    with inventory_lock(filename):
+        if not write_inventory_file(inventory_data, filename):
+            return False
 
-        # Write each product (skip index 0)
-        for idx in range(1, len(inventory_data)):
-            product = inventory_data[idx]
+        clear_journal(filename)
 
-            # Build line from product data
-            line = ""
-            for i, field in enumerate(product):
-                line += field
-                if i < len(product) - 1:
-                    line += ", "
+        # Changes made without recording them reach the event feed with the save
+        if inventory_data.unsaved_records:
+            publish_events(inventory_data.unsaved_records, filename)
+            inventory_data.unsaved_records = []
 
-            # Write to file
-            file.write(line + "\n")
+        # Our own save is not a change made by another counter
+        if inventory_data.filename == filename:
+            inventory_data.snapshot_stamp = get_file_stamp(filename)
+            inventory_data.journal_stamp = None
+            inventory_data.journal_offset = 0
 
-        # Close file
-        file.close()
+    if show_message:
         print("Inventory file updated!")
-        return True
+    return True
+
+
+def compact_inventory(snapshot_data, filename="inventory.txt", snapshot_stamp=None):
+    """
+    Writes a fresh inventory snapshot and drops the compacted journal.
+
+    Runs under the inventory lock, so no counter saves or reads in the
+    middle. If the inventory file was saved since the compaction started,
+    that save already holds the compacted journal and is kept instead.
+
+    Parameters:
+        snapshot_data (Inventory): Copy of product information to save
+        filename (str): Name of inventory file
+        snapshot_stamp (tuple): Inventory file version when the compaction started
 
+    Returns:
+        None
+    """
+    try:
+        with inventory_lock(filename):
+            if (get_file_stamp(filename) != snapshot_stamp or
+                    not os.path.exists(get_compacting_filename(filename))):
+                return
+            if write_inventory_file(snapshot_data, filename):
+                finish_compaction(filename)
     except:
-        print("Error saving inventory data")
+        # The compacted journal is kept and still replayed on load
+        record_error("compaction")
+        print("Error compacting inventory journal")
+
+
+def wait_for_compaction():
+    """
+    Waits until a running background compaction has finished.
+
+    Parameters:
+        None
+
+    Returns:
+        None
+    """
+    if compaction_thread is not None:
+        compaction_thread.join()
+
+
+def record_inventory_changes(kind, document_num, changes, inventory_data):
+    """
+    Records stock changes in the journal instead of rewriting the inventory.
+
+    Starts a background compaction when the journal gets too large.
+    Should be called while holding the inventory lock.
+
+    Parameters:
+        kind (str): Transaction type (SALE or RESTOCK)
+        document_num (str): Invoice or purchase form number
+        changes (list): List of dicts with id, quantity_change, stock and cost
+        inventory_data (Inventory): Master inventory
+
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    return record_inventory_batch([(kind, document_num, changes, None)], inventory_data)
+
+
+def record_inventory_batch(records, inventory_data):
+    """
+    Records the changes of several transactions in the journal at once.
+
+    Should be called while holding the inventory lock.
+
+    Parameters:
+        records (list): Tuples of (kind, document number, changes, details)
+        inventory_data (Inventory): Master inventory
+
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    global compaction_thread
+
+    filename = inventory_data.filename
+    try:
+        journal_size = append_journal_transactions(
+            [(kind, document_num, changes) for kind, document_num, changes, details in records],
+            filename)
+    except:
+        print("Error saving inventory changes")
         return False
 
+    # Still under the lock, so events are in the same order as the journal
+    publish_events(records, filename)
+
+    # Our own entry is already applied, skip it when catching up
+    inventory_data.journal_offset = journal_size
+    inventory_data.journal_stamp = get_file_stamp(get_journal_filename(filename))
+
+    if journal_size >= COMPACT_SIZE and start_compaction(filename):
+        # Copy now; the thread must not see later changes
+        snapshot_data = inventory_data.copy()
+
+        compaction_thread = threading.Thread(target=compact_inventory,
+                                             args=(snapshot_data, filename,
+                                                   get_file_stamp(filename)),
+                                             name="inventory-compaction")
+        compaction_thread.start()
+
+    return True
 
-def generate_invoice(customer_name, phone_number, items_sold, inventory_data):
+
+def find_stock_shortage(inventory_data, basket):
+    """
+    Finds a product in a priced basket that does not have enough stock.
+
+    Parameters:
+        inventory_data (Inventory): Master inventory
+        basket (dict): Priced basket from price_basket
+
+    Returns:
+        tuple: (product ID, units needed, units in stock), or None if all fit
+    """
+    for product_id, units in basket["stock_used"].items():
+        stock = inventory_data.get_quantity(product_id)
+        if units > stock:
+            return product_id, units, stock
+    return None
+
+
+def remember_products(inventory_data, product_ids):
+    """
+    Notes the stock and cost of products before they are changed.
+
+    Inside a group transaction the values from before the group are kept
+    as well, so the whole group can be undone.
+
+    Parameters:
+        inventory_data (Inventory): Master inventory
+        product_ids (iterable): Products about to change
+
+    Returns:
+        dict: Product ID mapped to (stock, cost)
+    """
+    saved = {}
+    for product_id in product_ids:
+        saved[product_id] = (inventory_data.get_quantity(product_id),
+                             inventory_data.get_cost(product_id))
+        if inventory_data.pending_undo is not None:
+            inventory_data.pending_undo.setdefault(product_id, saved[product_id])
+    return saved
+
+
+def restore_products(inventory_data, saved):
+    """
+    Puts back stock and cost noted by remember_products.
+
+    Parameters:
+        inventory_data (Inventory): Master inventory
+        saved (dict): Product ID mapped to (stock, cost)
+
+    Returns:
+        None
+    """
+    apply_journal_entries(inventory_data, [(product_id, stock, cost)
+                                           for product_id, (stock, cost) in saved.items()])
+
+
+def apply_sale(inventory_data, basket):
+    """
+    Takes the units of a priced basket out of stock.
+
+    Parameters:
+        inventory_data (Inventory): Master inventory
+        basket (dict): Priced basket from price_basket
+
+    Returns:
+        list: Changes for the stock journal
+    """
+    changes = []
+    for line in basket["lines"]:
+        product_id = line["id"]
+        new_stock = inventory_data.get_quantity(product_id) - line["units"]
+        inventory_data.set_quantity(product_id, new_stock)
+        changes.append({
+            "id": product_id,
+            "quantity_change": -line["units"],
+            "stock": new_stock,
+            "cost": inventory_data.get_cost(product_id)
+        })
+    return changes
+
+
+def apply_restock(inventory_data, items_purchased):
+    """
+    Adds purchased units to stock and applies new cost prices.
+
+    Parameters:
+        inventory_data (Inventory): Master inventory
+        items_purchased (list): List of items purchased
+
+    Returns:
+        list: Changes for the stock journal, one per item
+    """
+    changes = []
+    for item in items_purchased:
+        product_id = item["id"]
+        qty = item["quantity"]
+
+        # Update cost if provided
+        new_cost = item.get("new_cost", None)
+        if new_cost:
+            inventory_data.set_cost(product_id, new_cost)
+
+        new_stock = inventory_data.get_quantity(product_id) + qty
+        inventory_data.set_quantity(product_id, new_stock)
+        changes.append({
+            "id": product_id,
+            "quantity_change": qty,
+            "stock": new_stock,
+            "cost": inventory_data.get_cost(product_id)
+        })
+    return changes
+
+
+@contextlib.contextmanager
+def text_transaction(inventory_data):
+    """
+    Holds the inventory file lock after catching up with other counters.
+
+    Parameters:
+        inventory_data (Inventory): Master inventory
+    """
+    with inventory_lock(inventory_data.filename):
+        refresh_inventory(inventory_data)
+        yield
+
+
+def inventory_transaction(inventory_data):
+    """
+    Opens a transaction on the storage the inventory was loaded from.
+
+    The inventory is brought up to date when the transaction starts.
+    Inventories loaded straight from a text file use the file lock.
+
+    Parameters:
+        inventory_data (Inventory): Master inventory
+
+    Returns:
+        Context manager holding the transaction
+    """
+    if inventory_data.storage is not None:
+        return inventory_data.storage.transaction(inventory_data)
+    return text_transaction(inventory_data)
+
+
+def record_changes(kind, document_num, changes, inventory_data, details):
+    """
+    Records stock changes in the storage the inventory was loaded from.
+
+    Should be called inside inventory_transaction.
+
+    Parameters:
+        kind (str): Transaction type (SALE or RESTOCK)
+        document_num (str): Invoice or purchase form number
+        changes (list): List of dicts with id, quantity_change, stock and cost
+        inventory_data (Inventory): Master inventory
+        details (dict): Customer or supplier name, document file and total
+
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    # Inside a group the changes are recorded together at the end
+    if inventory_data.pending_records is not None:
+        inventory_data.pending_records.append((kind, document_num, changes, details))
+        return True
+
+    if inventory_data.storage is not None:
+        return inventory_data.storage.record(kind, document_num, changes,
+                                             inventory_data, details)
+    return record_inventory_changes(kind, document_num, changes, inventory_data)
+
+
+def join_transaction(inventory_data):
+    """
+    Opens a transaction, or joins the group transaction already open.
+
+    Parameters:
+        inventory_data (Inventory): Master inventory
+
+    Returns:
+        Context manager holding the transaction
+    """
+    if inventory_data.pending_records is not None:
+        return contextlib.nullcontext()
+    return inventory_transaction(inventory_data)
+
+
+def after_commit(inventory_data, function, *args):
+    """
+    Runs work that must only happen once a change is saved.
+
+    Inside a group transaction, or a batch that saves once at the end,
+    the work waits until the changes are saved and is dropped if they
+    are not.
+
+    Parameters:
+        inventory_data (Inventory): Master inventory
+        function (function): Work to run
+        args: Arguments for the function
+
+    Returns:
+        None
+    """
+    if inventory_data.pending_finish is not None:
+        inventory_data.pending_finish.append((function, args))
+    else:
+        function(*args)
+
+
+@contextlib.contextmanager
+def group_transaction(inventory_data):
+    """
+    Runs several sales and restocks as one transaction.
+
+    The inventory is locked and brought up to date once, and all changes
+    are recorded together when the block ends, so a group costs a single
+    journal write or database commit. Each sale still checks stock
+    against the figures left by the ones before it. If the group cannot
+    be saved, stock and cost go back to what they were before it and its
+    document numbers are given back. Documents, history and customer
+    totals are only written once the group is saved (see after_commit).
+
+    Parameters:
+        inventory_data (Inventory): Master inventory
+
+    Raises:
+        IOError: If the changes could not be recorded
+    """
+    records = []
+    undo = {}
+    finish = []
+    try:
+        with inventory_transaction(inventory_data):
+            inventory_data.pending_records = records
+            inventory_data.pending_undo = undo
+            inventory_data.pending_finish = finish
+            try:
+                yield
+            finally:
+                inventory_data.pending_records = None
+                inventory_data.pending_undo = None
+                inventory_data.pending_finish = None
+
+            if records:
+                if inventory_data.storage is not None:
+                    saved = inventory_data.storage.record_batch(records, inventory_data)
+                else:
+                    saved = record_inventory_batch(records, inventory_data)
+                if not saved:
+                    raise IOError("Changes could not be saved")
+    except:
+        restore_products(inventory_data, undo)
+
+        # Newest first, since only the last number handed out can go back
+        for kind, document_num, changes, details in reversed(records):
+            release_document_number(document_num, inventory_data.filename)
+        raise
+
+    run_finishers(finish)
+
+
+def run_finishers(finish):
+    """
+    Runs work that waited for its changes to be saved (see after_commit).
+
+    Parameters:
+        finish (list): Tuples of (function, arguments)
+
+    Returns:
+        None
+    """
+    for function, args in finish:
+        try:
+            function(*args)
+        except:
+            # The changes are saved, so the rest of the work goes on
+            record_error("group_finish")
+            print("Error finishing a saved document")
+
+
+def release_unsaved(inventory_data):
+    """
+    Gives back the document numbers of changes that could not be saved.
+
+    The unsaved changes are dropped, but stock and cost in memory stay
+    as they are, so the inventory should be loaded again before use.
+
+    Parameters:
+        inventory_data (Inventory): Master inventory
+
+    Returns:
+        None
+    """
+    # Newest first, since only the last number handed out can go back
+    for kind, document_num, changes, details in reversed(inventory_data.unsaved_records):
+        release_document_number(document_num, inventory_data.filename)
+    inventory_data.unsaved_records = []
+
+
+def sync_inventory(inventory_data):
+    """
+    Catches up with changes made by other counters and pricing rules.
+
+    Parameters:
+        inventory_data (Inventory): Master inventory
+
+    Returns:
+        None
+    """
+    if inventory_data.storage is not None:
+        inventory_data.storage.sync(inventory_data)
+    else:
+        with inventory_lock(inventory_data.filename):
+            refresh_inventory(inventory_data)
+
+    # Pricing rules may have changed or a dated offer started or ended
+    refresh_prices(inventory_data)
+
+
+@timed("sale_commit")
+def commit_sale(invoice_num, items_sold, inventory_data, save=True, details=None):
+    """
+    Checks stock and takes a sale out of the inventory.
+
+    With save on, this runs in a storage transaction after catching up
+    with other counters, so stock is checked against the latest figures.
+
+    Parameters:
+        invoice_num (str): Invoice number
+        items_sold (list): List of items in the sale
+        inventory_data (Inventory): Master inventory
+        save (bool): Whether to lock, catch up and record the changes
+        details (dict): Customer name, phone and invoice file for the ledger
+
+    Returns:
+        dict: Priced basket, or None if there is not enough stock
+    """
+    if not save:
+        basket = price_basket(inventory_data, items_sold)
+        changes = apply_sale(inventory_data, basket)
+        inventory_data.unsaved_records.append(("SALE", invoice_num, changes, details))
+        return basket
+
+    saved = {}
+    try:
+        with join_transaction(inventory_data):
+
+            # Stock may have been sold at another counter meanwhile
+            basket = price_basket(inventory_data, items_sold)
+            shortage = find_stock_shortage(inventory_data, basket)
+            if shortage is not None:
+                print("Not enough stock for " + inventory_data.get_name(shortage[0]) +
+                      ": need " + str(shortage[1]) + " units, only " +
+                      str(shortage[2]) + " available now.")
+                count("sales_rejected")
+                return None
+
+            saved = remember_products(inventory_data, basket["stock_used"])
+            changes = apply_sale(inventory_data, basket)
+            details = dict(details or {})
+            details["total"] = basket["total"]
+            if not record_changes("SALE", invoice_num, changes, inventory_data, details):
+                raise IOError("Sale could not be saved")
+            return basket
+    except:
+        # Nothing was saved, so the stock in memory must not change either
+        restore_products(inventory_data, saved)
+        raise
+
+
+@timed("restock_commit")
+def commit_restock(form_num, items_purchased, inventory_data, save=True, details=None):
+    """
+    Adds a restock to the inventory.
+
+    Parameters:
+        form_num (str): Purchase form number
+        items_purchased (list): List of items purchased
+        inventory_data (Inventory): Master inventory
+        save (bool): Whether to lock, catch up and record the changes
+        details (dict): Supplier name and form file for the ledger
+
+    Returns:
+        list: Changes made, one per item
+    """
+    if not save:
+        changes = apply_restock(inventory_data, items_purchased)
+        inventory_data.unsaved_records.append(("RESTOCK", form_num, changes, details))
+        return changes
+
+    saved = {}
+    try:
+        with join_transaction(inventory_data):
+            saved = remember_products(inventory_data,
+                                      [item["id"] for item in items_purchased])
+            changes = apply_restock(inventory_data, items_purchased)
+            details = dict(details or {})
+            details["total"] = sum([change["cost"] * change["quantity_change"]
+                                    for change in changes])
+            if not record_changes("RESTOCK", form_num, changes, inventory_data, details):
+                raise IOError("Restock could not be saved")
+            return changes
+    except:
+        # Nothing was saved, so the stock in memory must not change either
+        restore_products(inventory_data, saved)
+        raise
+
+
+def finish_invoice(invoice_num, current, history_lines, filename, document,
+                   customer_name, phone_number, grand_total, inventory_filename):
+    """
+    Writes what follows a saved sale: report totals, invoice file and customer totals.
+
+    Parameters:
+        invoice_num (str): Invoice number
+        current (datetime): Time of the sale
+        history_lines (list): Report lines for record_history
+        filename (str): Name of invoice file
+        document (str): Invoice text
+        customer_name (str): Customer name
+        phone_number (str): Customer contact number
+        grand_total (float): Invoice total with shipping
+        inventory_filename (str): Name of inventory file or database
+
+    Returns:
+        None
+    """
+    # Add the sale to the report totals
+    record_history("SALE", invoice_num, current, history_lines, inventory_filename)
+
+    # Write to file in the background
+    submit_document(filename, document, invoice_num, get_document_dir(inventory_filename))
+
+    # Add to the customer's totals for next time
+    record_customer_visit(customer_name, phone_number, invoice_num, current, grand_total,
+                          inventory_filename)
+
+
+def finish_purchase_form(form_num, current, history_lines, filename, document,
+                         inventory_filename):
+    """
+    Writes what follows a saved restock: report totals and the purchase form file.
+
+    Parameters:
+        form_num (str): Purchase form number
+        current (datetime): Time of the restock
+        history_lines (list): Report lines for record_history
+        filename (str): Name of purchase form file
+        document (str): Purchase form text
+        inventory_filename (str): Name of inventory file or database
+
+    Returns:
+        None
+    """
+    # Add the restock to the report totals
+    record_history("RESTOCK", form_num, current, history_lines, inventory_filename)
+
+    # Write to file in the background
+    submit_document(filename, document, form_num, get_document_dir(inventory_filename))
+
+
+@timed("invoice")
+def generate_invoice(customer_name, phone_number, items_sold, inventory_data,
+                     shipping=False, save=True):
     """
     Creates a sales invoice and updates inventory.
 
+    Stock is checked and taken again at commit time, so a sale fails
+    cleanly if another counter sold the same units in the meantime.
+    The invoice file itself is written in the background
+    (see docwriter.flush_documents).
+
     Parameters:
         customer_name (str): Customer name
         phone_number (str): Customer contact number
         items_sold (list): List of items in the sale
-        inventory_data (list): Master inventory list
+        inventory_data (Inventory): Master inventory
+        shipping (bool): Whether to ship the order
+        save (bool): Whether to record the stock changes right away
 
     Returns:
         str: Name of generated invoice file
     """
     # Generate date and time strings
     current = datetime.datetime.now()
-    date_str = "%s-%s-%s" % (current.year, current.month, current.day)
-    time_str = "%s%s%s" % (current.hour, current.minute, current.second)
+    date_str = "%d-%02d-%02d" % (current.year, current.month, current.day)
+    time_str = "%02d%02d%02d" % (current.hour, current.minute, current.second)
 
-    # Create unique invoice number
-    invoice_num = "INV-" + str(random.randint(1000, 9999))
+    # Take the next invoice number
+    invoice_num = next_document_number("INV", inventory_data.filename)
 
     # Create filename
     name_for_file = ""
     for c in customer_name:
-        if c == ' ':
+        # Separators would put the file in another directory
+        if c == ' ' or c == '/' or c == '\\':
             name_for_file += '_'
         else:
             name_for_file += c
 
     filename = invoice_num + "_" + name_for_file + "_" + date_str + "_" + time_str + ".txt"
 
+    # Store it in the directory for its kind, month and number
+    filename = get_document_path(invoice_num, filename, current,
+                                 get_document_dir(inventory_data.filename))
+
     # Initialize totals
-    total_amount = 0
     shipping_fee = 0
+    if shipping:
+        shipping_fee = SHIPPING_FEE
 
+    basket = None
     try:
-        # Create invoice file
-        file = open(filename, "w")
-
-        # Write header
-        file.write("\t \t \t \t WeCare BEAUTY PRODUCTS\n")
-        file.write("\t \t Kamalpokhari, Kathmandu | Phone No: 9761625564\n")
-        file.write("=" * 80 + "\n\n")
-        file.write("Invoice Number: " + invoice_num + "\n")
-        file.write("Date: " + date_str + "\n")
-        file.write("Customer Name: " + customer_name + "\n")
-        file.write("Phone Number: " + phone_number + "\n\n")
-        file.write("-" * 80 + "\n")
-        file.write("%-15s %-15s %-5s %-5s %-10s %-10s\n" %
-                   ("Product", "Brand", "Qty", "Free", "Price", "Amount"))
-        file.write("-" * 80 + "\n")
-
-        # Print to screen as well
-        print("\n\t \t \t \t WeCare BEAUTY PRODUCTS")
-        print("\t \t Kamalpokhari, Kathmandu | Phone No: 9761625564")
-        print("=" * 80 + "\n")
-        print("Invoice Number: " + invoice_num)
-        print("Date: " + date_str)
-        print("Customer Name: " + customer_name)
-        print("Phone Number: " + phone_number + "\n")
-        print("-" * 80)
-        print("%-15s %-15s %-5s %-5s %-10s %-10s" %
-              ("Product", "Brand", "Qty", "Free", "Price", "Amount"))
-        print("-" * 80)
-
-        # Process each sold item
-        for item in items_sold:
-            product_id = item["id"]
-            qty = item["quantity"]
-
-            # Get product details
-            product = inventory_data[product_id]
-            name = product[0]
-            brand = product[1]
-            stock = int(product[2])
-            cost = float(product[3])
-
-            # Calculate promotion
-            free_qty = qty // 3
-
-            # Calculate price and amount
-            price = cost * 3  # 200% markup
-            amount = price * qty
-            total_amount += amount
-
-            # Write to file
-            file.write("%-15s %-15s %-5s %-5s %-10s %-10s\n" %
-                       (name, brand, str(qty), str(free_qty),
-                        str(round(price, 2)), str(round(amount, 2))))
-
-            # Print to screen
-            print("%-15s %-15s %-5s %-5s %-10s %-10s" %
-                  (name, brand, str(qty), str(free_qty),
-                   str(round(price, 2)), str(round(amount, 2))))
-
-            # Update inventory
-            new_stock = stock - (qty + free_qty)
-            inventory_data[product_id][2] = str(new_stock)
-
-        # Ask about shipping
-        shipping_input = input("\nDo you want your products to be shipped? (Y/N): ")
-        if shipping_input.upper() == "Y":
-            shipping_fee = 500
-            file.write("%-45s %s\n" % ("Shipping Cost:", str(round(shipping_fee, 2))))
-            print("%-45s %s" % ("Shipping Cost:", str(round(shipping_fee, 2))))
+        # Take the items out of stock first
+        basket = commit_sale(invoice_num, items_sold, inventory_data, save,
+                             {"name": customer_name, "phone": phone_number,
+                              "shipping_fee": shipping_fee,
+                              "filename": filename})
+        if basket is None:
+            # Nothing was sold, so the number can go to the next invoice
+            release_document_number(invoice_num, inventory_data.filename)
+            return None
+        total_amount = basket["total"]
+
+        # Report lines with the cost at the time of the sale
+        history_lines = [(line["id"], line["quantity"], line["free"], line["amount"],
+                          inventory_data.get_cost(line["id"]))
+                         for line in basket["lines"]]
+
+        # Build the whole invoice in one buffer
+        lines = []
+        lines.append("\t \t \t \t WeCare BEAUTY PRODUCTS\n")
+        lines.append("\t \t Kamalpokhari, Kathmandu | Phone No: 9761625564\n")
+        lines.append("=" * 80 + "\n\n")
+        lines.append("Invoice Number: " + invoice_num + "\n")
+        lines.append("Date: " + date_str + "\n")
+        lines.append("Customer Name: " + customer_name + "\n")
+        lines.append("Phone Number: " + phone_number + "\n\n")
+        lines.append("-" * 80 + "\n")
+        lines.append("%-15s %-15s %-5s %-5s %-10s %-10s\n" %
+                     ("Product", "Brand", "Qty", "Free", "Price", "Amount"))
+        lines.append("-" * 80 + "\n")
+
+        # Add each sold item
+        for line in basket["lines"]:
+            product_id = line["id"]
+            lines.append("%-15s %-15s %-5s %-5s %-10s %-10s\n" %
+                         (inventory_data.get_name(product_id),
+                          inventory_data.get_brand(product_id),
+                          str(line["quantity"]), str(line["free"]),
+                          str(round(line["price"], 2)),
+                          str(round(line["amount"], 2))))
+
+        # Add shipping
+        if shipping:
+            lines.append("%-45s %s\n" % ("Shipping Cost:", str(round(shipping_fee, 2))))
 
         # Calculate grand total
         grand_total = total_amount + shipping_fee
 
-        # Write totals
-        file.write("-" * 80 + "\n")
-        file.write("%-45s %s\n" % ("Total Amount:", str(round(grand_total, 2))))
-        file.write("=" * 80 + "\n")
-        file.write("\nThank you for shopping with us!\n")
-        file.write("Buy 3 Get 1 Free on all products!\n")
-        file.close()
-
-        # Print totals to screen
-        print("-" * 80)
-        print("%-45s %s" % ("Total Amount:", str(round(grand_total, 2))))
-        print("=" * 80)
-        print("\nThank you for shopping with us!")
-        print("Buy 3 Get 1 Free on all products!")
-
-        print("\nInvoice generated: " + filename)
-
-        # Update inventory file
-        save_inventory(inventory_data)
+        # Add totals
+        lines.append("-" * 80 + "\n")
+        lines.append("%-45s %s\n" % ("Total Amount:", str(round(grand_total, 2))))
+        lines.append("=" * 80 + "\n")
+        lines.append("\nThank you for shopping with us!\n")
+        for promotion in inventory_data.rules.describe():
+            lines.append(promotion + "\n")
+        document = "".join(lines)
+
+        # Show on screen; the file and totals follow once the sale is saved
+        print("\n" + document)
+        after_commit(inventory_data, finish_invoice, invoice_num, current, history_lines,
+                     filename, document, customer_name, phone_number, grand_total,
+                     inventory_data.filename)
+
+        print("Invoice generated: " + filename)
+        count("invoices")
+        observe("invoice_items", len(basket["lines"]), SIZE_BUCKETS)
+        observe("invoice_amount", grand_total, AMOUNT_BUCKETS)
         return filename
 
     except:
+        record_error("invoice")
         print("Error generating invoice")
+
+        # A sale that was never saved leaves its number to the next invoice
+        if basket is None:
+            release_document_number(invoice_num, inventory_data.filename)
         return None
 
 
-def generate_purchase_form(supplier_name, items_purchased, inventory_data):
+@timed("purchase_form")
+def generate_purchase_form(supplier_name, items_purchased, inventory_data,
+                           save=True):
     """
     Creates a purchase form and updates inventory.
 
+    The stock change is saved right away; the form file itself is
+    written in the background.
+
     Parameters:
         supplier_name (str): Supplier name
         items_purchased (list): List of items purchased
-        inventory_data (list): Master inventory list
+        inventory_data (Inventory): Master inventory
+        save (bool): Whether to record the stock changes right away
 
     Returns:
         str: Name of generated purchase form file
     """
     # Generate date and time strings
     current = datetime.datetime.now()
-    date_str = "%s-%s-%s" % (current.year, current.month, current.day)
-    time_str = "%s%s%s" % (current.hour, current.minute, current.second)
+    date_str = "%d-%02d-%02d" % (current.year, current.month, current.day)
+    time_str = "%02d%02d%02d" % (current.hour, current.minute, current.second)
 
-    # Create unique form number
-    form_num = "PO-" + str(random.randint(1000, 9999))
+    # Take the next form number
+    form_num = next_document_number("PO", inventory_data.filename)
 
     # Create filename
     name_for_file = ""
     for c in supplier_name:
-        if c == ' ':
+        # Separators would put the file in another directory
+        if c == ' ' or c == '/' or c == '\\':
             name_for_file += '_'
         else:
             name_for_file += c
 
     filename = form_num + "_" + name_for_file + "_" + date_str + "_" + time_str + ".txt"
 
+    # Store it in the directory for its kind, month and number
+    filename = get_document_path(form_num, filename, current,
+                                 get_document_dir(inventory_data.filename))
+
     # Initialize total
     total_amount = 0
 
+    changes = None
     try:
-        # Create purchase form file
-        file = open(filename, "w")
-
-        # Write header
-        file.write("\t \t \t \t WeCare BEAUTY PRODUCTS\n")
-        file.write("\t \t \t \t PURCHASE FORM\n")
-        file.write("=" * 80 + "\n\n")
-        file.write("Form Number: " + form_num + "\n")
-        file.write("Date: " + date_str + "\n")
-        file.write("Supplier: " + supplier_name + "\n\n")
-        file.write("-" * 80 + "\n")
-        file.write("%-15s %-15s %-5s %-10s %-10s\n" %
-                   ("Product", "Brand", "Qty", "Cost Price", "Amount"))
-        file.write("-" * 80 + "\n")
-
-        # Print to screen as well
-        print("\n\t \t \t \t WeCare BEAUTY PRODUCTS")
-        print("\t \t \t \t PURCHASE FORM")
-        print("=" * 80 + "\n")
-        print("Form Number: " + form_num)
-        print("Date: " + date_str)
-        print("Supplier: " + supplier_name + "\n")
-        print("-" * 80)
-        print("%-15s %-15s %-5s %-10s %-10s" %
-              ("Product", "Brand", "Qty", "Cost Price", "Amount"))
-        print("-" * 80)
-
-        # Process each purchased item
-        for item in items_purchased:
-            product_id = item["id"]
-            qty = item["quantity"]
-            new_cost = item.get("new_cost", None)
-
-            # Get product details
-            product = inventory_data[product_id]
-            name = product[0]
-            brand = product[1]
-            stock = int(product[2])
-
-            # Update cost if provided
-            if new_cost:
-                product[3] = str(new_cost)
-
-            cost = float(product[3])
+        # Add the items to stock first
+        changes = commit_restock(form_num, items_purchased, inventory_data, save,
+                                 {"name": supplier_name, "filename": filename})
+
+        # Report lines with the cost of the restock
+        history_lines = [(change["id"], change["quantity_change"], 0,
+                          change["cost"] * change["quantity_change"], change["cost"])
+                         for change in changes]
+
+        # Build the whole purchase form in one buffer
+        lines = []
+        lines.append("\t \t \t \t WeCare BEAUTY PRODUCTS\n")
+        lines.append("\t \t \t \t PURCHASE FORM\n")
+        lines.append("=" * 80 + "\n\n")
+        lines.append("Form Number: " + form_num + "\n")
+        lines.append("Date: " + date_str + "\n")
+        lines.append("Supplier: " + supplier_name + "\n\n")
+        lines.append("-" * 80 + "\n")
+        lines.append("%-15s %-15s %-5s %-10s %-10s\n" %
+                     ("Product", "Brand", "Qty", "Cost Price", "Amount"))
+        lines.append("-" * 80 + "\n")
+
+        # Add each purchased item
+        for change in changes:
+            product_id = change["id"]
+            qty = change["quantity_change"]
+            cost = change["cost"]
+
             amount = cost * qty
             total_amount += amount
 
-            # Write to file
-            file.write("%-15s %-15s %-5s %-10s %-10s\n" %
-                       (name, brand, str(qty), str(round(cost, 2)),
-                        str(round(amount, 2))))
-
-            # Print to screen
-            print("%-15s %-15s %-5s %-10s %-10s" %
-                  (name, brand, str(qty), str(round(cost, 2)),
-                   str(round(amount, 2))))
-
-            # Update inventory
-            new_stock = stock + qty
-            inventory_data[product_id][2] = str(new_stock)
-
-        # Write total
-        file.write("-" * 80 + "\n")
-        file.write("%-45s %s\n" % ("Total Amount:", str(round(total_amount, 2))))
-        file.write("=" * 80 + "\n")
-        file.close()
-
-        # Print total to screen
-        print("-" * 80)
-        print("%-45s %s" % ("Total Amount:", str(round(total_amount, 2))))
-        print("=" * 80)
-
-        print("\nPurchase form generated: " + filename)
-
-        # Update inventory file
-        save_inventory(inventory_data)
+            lines.append("%-15s %-15s %-5s %-10s %-10s\n" %
+                         (inventory_data.get_name(product_id),
+                          inventory_data.get_brand(product_id),
+                          str(qty), str(round(cost, 2)), str(round(amount, 2))))
+
+        # Add total
+        lines.append("-" * 80 + "\n")
+        lines.append("%-45s %s\n" % ("Total Amount:", str(round(total_amount, 2))))
+        lines.append("=" * 80 + "\n")
+        document = "".join(lines)
+
+        # Show on screen; the file and totals follow once the restock is saved
+        print("\n" + document)
+        after_commit(inventory_data, finish_purchase_form, form_num, current, history_lines,
+                     filename, document, inventory_data.filename)
+
+        print("Purchase form generated: " + filename)
+        count("purchase_forms")
+        observe("purchase_form_items", len(changes), SIZE_BUCKETS)
         return filename
 
     except:
+        record_error("purchase_form")
         print("Error generating purchase form")
+
+        # A restock that was never saved leaves its number to the next form
+        if changes is None:
+            release_document_number(form_num, inventory_data.filename)
         return None
\ No newline at end of file